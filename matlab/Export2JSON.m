@@ -18,6 +18,8 @@
 %         {
 %             "name": "<arbitrary component bank name>",
 %             "h": [<list of numbers, n_cmp x n_nodes x n_nodes or empty list>],
+%             "h_coo": [<list of numbers, nnz x 4, each row [cmp,row,col,val] (0-based) of the sparse h; used instead of h>],
+%             "n_nodes": <int, number of nodes in the bank's graph>,
 %             "k": [<list of numbers, n_cmp x 1 or empty list>],
 %             "learned_edge_states": [<list of numbers, ? x ? or empty list>],
 %             "edge_endnode_idx": [...],
@@ -71,10 +73,14 @@ function [] = Export2JSON(trndat, tstdat, model, frontend_spec, model_name)
         end
         curr_bank = struct();
         curr_bank.name = model.compbank_names{i};
-        curr_bank.h = zeros(numel(H), size(H{1}, 1), size(H{1}, 2), "int16");
+        curr_bank.h = []; % a dense n_cmp x n_nodes x n_nodes h is mostly zeros (nonzeros only on the graph's edges), so we export h_coo instead
+        h_coo = cell(numel(H), 1);
         for j = 1 : numel(H)
-            curr_bank.h(j,:,:) = full(H{j});
+            [r,c,v] = find(H{j});
+            h_coo{j} = [repmat(j-1, numel(r), 1),r(:)-1,c(:)-1,v(:)]; % 0-based indexing
         end
+        curr_bank.h_coo = int32(cat(1, zeros(0, 4), h_coo{:}));
+        curr_bank.n_nodes = compbank.g.n_nodes;
         curr_bank.k = k;
         curr_bank.learned_edge_states = uint8(compbank.edge_states)';
         curr_bank.edge_endnode_idx = compbank.edge_endnode_idx - 1; % convert to 0-based indexing
@@ -1,25 +1,72 @@
 # Copyright Brain Engineering Lab at Dartmouth. All rights reserved.
 # Please feel free to use this code for any non-commercial purpose under the CC Attribution-NonCommercial-ShareAlike license: https://creativecommons.org/licenses/by-nc-sa/4.0/
 # If you use this code, cite Rodriguez A, Bowen EFW, Granger R (2022) https://github.com/DartmouthGrangerLab/hnet
+import hashlib
+import os
 import numpy as np
 import scipy as sp
 import scipy.sparse
 
 
-def dataset(is_trn, n_per_class):
+MNIST_FILENAME = '../datasets/img_captchas/mnist_784.npz'
+_CACHE_VERSION = 1 # bump whenever the preprocessing below changes, to invalidate old cache files
+
+
+def dataset(is_trn, n_per_class, is_sparse=False, cache_dir=None):
     """loads the mnist dataset"""
     # INPUTS
     #   is_trn      - scalar (bool)
     #   n_per_class - scalar (int64) if -1, will use as many as possible
+    #   is_sparse   - scalar (bool) if true, data is returned as a scipy.sparse csr matrix (pytorch_hnet.evaluate() etc accept it as-is)
+    #   cache_dir   - OPTIONAL (str) directory for the processed subsets (default = 'cache' next to the mnist file; '' = don't cache)
     # RETURNS
-    #   data   - n_pts x n_pixels (bool)
+    #   data   - n_pts x n_pixels (bool) memory-mapped from the cache when possible
     #   labels - n_pts x 1 (uint8)
     seed = 10 # for consistent rng results
+    n_per_class = int(n_per_class)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(MNIST_FILENAME), 'cache')
+    if cache_dir == '':
+        data, label_idx = _mnist_subset(is_trn, n_per_class, seed)
+        if not is_sparse:
+            data = data.todense()
+        return {'data':data, 'label_idx':label_idx}
+
+    # processed subsets are cached as raw .npy arrays (memory-mappable), keyed by the parameters, seed, and source file
+    stat = os.stat(MNIST_FILENAME)
+    key = repr((_CACHE_VERSION, os.path.abspath(MNIST_FILENAME), stat.st_size, stat.st_mtime_ns, bool(is_trn), n_per_class, seed))
+    prefix = os.path.join(cache_dir, 'mnist_784.{}.n{}.seed{}.{}'.format('trn' if is_trn else 'tst', n_per_class, seed, hashlib.sha1(key.encode()).hexdigest()[:12]))
+    if not os.path.isfile(prefix + '.label_idx.npy'): # (label_idx is written last, so its presence means the rest is complete)
+        data, label_idx = _mnist_subset(is_trn, n_per_class, seed)
+        os.makedirs(cache_dir, exist_ok=True)
+        _save_npy(prefix + '.shape.npy', np.array(data.shape, dtype=np.int64))
+        _save_npy(prefix + '.indptr.npy', data.indptr)
+        _save_npy(prefix + '.indices.npy', data.indices)
+        _save_npy(prefix + '.dense.npy', np.asarray(data.todense()))
+        _save_npy(prefix + '.label_idx.npy', label_idx)
 
-    data = scipy.sparse.load_npz('../datasets/img_captchas/mnist_784.npz') # load mnist data
-    img_sz = [28,28] # MUST be square for now
+    label_idx = np.load(prefix + '.label_idx.npy')
+    if is_sparse:
+        indices = np.load(prefix + '.indices.npy', mmap_mode='r')
+        data = scipy.sparse.csr_matrix((np.ones(indices.shape[0], dtype=np.uint8), indices, np.load(prefix + '.indptr.npy')), shape=tuple(np.load(prefix + '.shape.npy')))
+    else:
+        data = np.asmatrix(np.load(prefix + '.dense.npy', mmap_mode='c')) # copy-on-write: pages are read lazily, and writes stay private
+    return {'data':data, 'label_idx':label_idx}
+
+
+def _mnist_subset(is_trn, n_per_class, seed):
+    """loads, thresholds, and subsets the mnist dataset in one vectorized sparse pass"""
+    # INPUTS
+    #   is_trn      - scalar (bool)
+    #   n_per_class - scalar (int) if -1, will use as many as possible
+    #   seed        - scalar (int) for the tst permutation
+    # RETURNS
+    #   data      - n_pts x n_pixels (scipy.sparse.csr_matrix uint8) classes in order; within a class, most prototypical first (trn) or shuffled (tst)
+    #   label_idx - n_pts (uint8)
+    data = scipy.sparse.load_npz(MNIST_FILENAME).tocsr() # load mnist data
+    label_data = np.asarray(data[:,784].todense()).ravel()
     image_data = data[:,:-1]
-    label_data = np.array(data[:,784].todense())
     if is_trn: # load trn data
         data = image_data[0:60000]
         labels = label_data[0:60000]
@@ -27,42 +74,44 @@ def dataset(is_trn, n_per_class):
         data = image_data[60000:]
         labels = label_data[60000:]
 
-    if np.min(data) != np.max(data): # normalize to range 0 --> 1
-        data = data - np.min(data)
-        data = data / np.max(data)
-
-    data = scipy.sparse.csr_matrix(data > 0.5, dtype=np.uint8) # threshold
+    # normalize to range 0 --> 1 and threshold, touching only the stored values
+    data_min = data.min()
+    data_max = data.max()
+    vals = data.data
+    if data_min != data_max:
+        vals = (vals - data_min) / (data_max - data_min)
+    data = scipy.sparse.csr_matrix((vals > 0.5, data.indices, data.indptr), shape=data.shape, dtype=np.uint8)
+    data.eliminate_zeros()
 
-    # subset (was most of get_mnist_features)
-    # uniq_labels = [0] + list(np.unique(labels).ravel()) # digits 0 --> 9
-    uniq_labels = list(np.unique(labels)) # digits 0 --> 9
+    uniq_labels, labels_inv, label_counts = np.unique(labels, return_inverse=True, return_counts=True) # digits 0 --> 9
     n_classes = len(uniq_labels) # should be 10; digits 0 --> 9
-
     if n_per_class == -1: # use almost all (preserving equal N)
-        label_counts = np.zeros(n_classes)
-        for label in uniq_labels:
-            label_counts[label] = np.sum(labels.ravel() == label)
-        n_per_class = int(np.floor(np.min(label_counts)))
-
-    class_data = []
-    class_labels = []
-    for label in uniq_labels:
-        idx = np.argwhere(labels.ravel() == label).squeeze()
-        curr_data = data[idx]
-        curr_labels = labels[idx]
+        n_per_class = int(np.min(label_counts))
+
+    if is_trn: # rms distance of each image to its class's thresholded mean image, all classes at once
+        class_indicator = scipy.sparse.csr_matrix((np.ones(len(labels)), (labels_inv, np.arange(len(labels)))), shape=(n_classes, len(labels)))
+        class_means = (np.asarray((class_indicator @ data).todense()) / label_counts[:,None] > 0.5) * 1 # n_classes x n_pixels
+        # for binary x and m, sum((x - m)^2) = sum(x) + sum(m) - 2 x.m
+        n_diff = np.asarray(data.sum(axis=1)).ravel() + class_means.sum(axis=1)[labels_inv] - 2 * np.asarray(data @ class_means.T)[np.arange(len(labels)),labels_inv]
+        data_rms = np.sqrt(n_diff / data.shape[1]) # sqrt should be unnecessary
 
+    keep = []
+    for c in range(n_classes):
+        class_idx = np.flatnonzero(labels_inv == c)
         if is_trn:
-            data_mean = (curr_data.mean(axis=0) > 0.5) * 1
-            data_diff = curr_data - data_mean
-            data_rms = np.sqrt(np.power(data_diff, 2).mean(axis=1)) # sqrt should be unnecessary
-            idx = np.array(np.argsort(data_rms, axis=0)).ravel() # sort, most prototypical first
+            idx = np.argsort(data_rms[class_idx]) # sort, most prototypical first
         else: # tst
             rng = np.random.default_rng(seed)
-            idx = rng.permutation(curr_data.shape[0])
+            idx = rng.permutation(len(class_idx))
+        keep.append(class_idx[idx[0:n_per_class]])
+    keep = np.concatenate(keep)
+
+    return data[keep], labels[keep]
 
-        class_data.append(curr_data[idx[0:n_per_class]])
-        class_labels.append(curr_labels[idx[0:n_per_class]])
 
-    data = scipy.sparse.vstack([x for x in class_data]).todense()
-    label_idx = np.array(np.vstack([x for x in class_labels])).ravel()
-    return {'data':data, 'label_idx':label_idx}
\ No newline at end of file
+def _save_npy(filename, x):
+    """np.save(), atomically (so concurrent runs never see a partial file)"""
+    tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp_filename, 'wb') as f:
+        np.save(f, x)
+    os.replace(tmp_filename, filename)
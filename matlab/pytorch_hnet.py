@@ -6,18 +6,45 @@
 #   Bowen, EFW, Granger, R, Rodriguez, A (2023). A logical re-conception of neural networks: Hamiltonian bitwise part-whole architecture. Presented at AAAI EDGeS 2023.
 """
 CALLABLE FUNCTIONS:
-    construct_hnet_model_from_json(filename:str, energy_mode:str) -> HNetModel
+    construct_hnet_model_from_json(filename:str, energy_mode:str, cmp_chunk_size:int=64) -> HNetModel
+    construct_hnet_model_from_bin(filename:str, energy_mode:str, cmp_chunk_size:int=64) -> HNetModel
+    convert_json_to_bin(filename:str) -> str
+    export_compiled_model(model:HNetModel, filename:str, n_nodes:int=None, is_native:bool=True) -> None
+    load_compiled_model(filename:str) -> HNetCompiledModel
     evaluate(model:HNetModel, dataset:dict) -> np.ndarray
+    evaluate_streaming(model:HNetModel, data, batch_size:int=1024) -> generator of np.ndarray
+    evaluate_into(model:HNetModel, data, out, batch_size:int=1024) -> np.ndarray
+    calibrate_energy_offsets(model:HNetModel, data, batch_size:int=1024) -> None
+    reset_energy_offsets(model:HNetModel) -> None
+    set_edge_feature_cache(model:HNetModel, cache:HNetEdgeFeatureCache) -> None
+    set_profiler(model:HNetModel, profiler:HNetProfiler) -> None
+    set_row_cache(model:HNetModel, cache:HNetRowCache) -> None
+    set_translation_invariance(model:HNetModel, img_sz:list, max_translation_delta:int=None, cmp_chunk_size:int=64) -> None
+    match_translations(model:HNetModel, data, bank_name:str, batch_size:int=1024) -> (np.ndarray, np.ndarray)
+    fit_linear_readout(model:HNetModel, data, label_idx, l2_reg:float=1e-3, batch_size:int=1024) -> HNetLinearReadout
+    set_readout(model:HNetModel, readout:HNetLinearReadout) -> None
+    classify(model:HNetModel, data, batch_size:int=1024) -> np.ndarray
+    evaluate_parallel(model:HNetModel, data, n_workers:int=None, n_threads_per_worker:int=1, batch_size:int=1024) -> np.ndarray
     main() -> None
 """
 import os
+import sys
+import time
 import json
-import re
+import collections
+import hashlib
+import zipfile
+import threading
 import numpy as np
-import numpy.matlib
 import torch
 import torch.nn as nn
+import torch.multiprocessing
+import scipy.sparse
 import sklearn.svm
+try:
+    import resource # not available on windows
+except ImportError:
+    resource = None
 
 
 # graph type
@@ -52,18 +79,113 @@ EDG_F     = 16
 UNIQ_EDGE_TYPES = [EDG_NULL,EDG_T,EDG_NOR,EDG_NCONV,EDG_NX,EDG_NIMPL,EDG_NY,EDG_XOR,EDG_NAND,EDG_AND,EDG_NXOR,EDG_Y,EDG_IMPL,EDG_X,EDG_CONV,EDG_OR,EDG_F]
 
 
+# binary file format (see convert_json_to_bin)
+_BIN_MAGIC = b"HNETBIN1"
+_BIN_ALIGNMENT = 64 # bytes
+_BIN_MODEL_DTYPES = {"h":np.int16, "h_coo":np.int32, "k":np.float64, "learned_edge_states":np.uint8, "edge_endnode_idx":np.int32, "edge_type_filter":np.uint8} # storage type of each array in a component bank
+
+
+# compiled model file format (see export_compiled_model)
+_COMPILED_INFO_FILENAME = "hnet_info.json" # metadata stored alongside the compiled program
+_COMPILED_MAX_NUMEL_PER_PT = 2**16 # max elements per datapoint in one chunk of a compiled model's intermediates (n_pts is symbolic, so compiled energies chunk over components instead of datapoints)
+_SPARSE_MAX_DENSITY = 0.125 # sparse node activations denser than this are densified before computing edge codes (the scatter is slower than the dense gather above ~12% active)
+
+
 # === HNET DATA STRUCTURES ===
 
 
-class HNetEnergyViaHamiltonian(nn.Module):
-    """energy matching via the Hamiltonian method"""
-    def __init__(self, h:torch.Tensor, k:torch.Tensor):
+class HNetEnergy(nn.Module):
+    """
+    base class for the energy modules; subclasses implement raw_energies() and set is_distance and energy_dtype
+    energies are normalized by a global offset so that 0 = worst match and larger = better (see Energy.m)
+    precision: raw energies are accumulated in the narrowest type that's exact (integer counts for the edge-based modes, single for the Hamiltonian's x*H*x', whose integer terms sum exactly below 2^24), and normalized energies are single
+    """
+    is_distance:bool = False # (bool) if true, raw energies are 0 = best, so they're flipped (offset = max) instead of shifted (offset = min)
+    energy_dtype:torch.dtype = torch.int32 # (torch.dtype) type of raw_energies()
+
+    def __init__(self):
         super().__init__()
-        self.h:torch.Tensor = torch.Tensor(h) # n_cmp x n_nodes x n_nodes (Tensor) ...
-        self.k:torch.Tensor = torch.Tensor(k) # n_cmp x 1 (Tensor) ...
-        self.n_cmp:int      = int(self.h.shape[0]) # (int) number of components
+        self.energy_offset:float = None # (float) model-level normalization constant; if None, each call is normalized by its own batch (see calibrate_energy_offsets)
+        self.edge_feature_cache:HNetEdgeFeatureCache = None # (HNetEdgeFeatureCache) if set, edge-based subclasses reuse encoded edge features from disk (see set_edge_feature_cache)
+        self.edge_feature_key:str = "" # (char) hash of whatever (besides the node activations) determines the encoded edge features; set by edge-based subclasses
+        self.profiler:HNetProfiler = None # (HNetProfiler) if set, records the edges / energy / normalization stages (see set_profiler)
+
+    def raw_energies(self, node_activations:torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError()
+
+    def edge_features(self, node_activations:torch.Tensor, kind:str, compute):
+        """returns compute(node_activations), reusing it from edge_feature_cache (if set) when the same node activations were encoded by the same graph and filter before"""
+        with _profile(self.profiler, "edges", node_activations) as stage:
+            if self.edge_feature_cache is None:
+                x = compute(node_activations)
+            else:
+                x = self.edge_feature_cache.get_or_compute(kind + self.edge_feature_key, node_activations, compute)
+            stage.set_output(x)
+        return x
+
+    def batch_offset(self, energies:torch.Tensor) -> torch.Tensor:
+        """normalization offset of a set of raw energies (the offset of several batches = batch_offset of their stacked offsets)"""
+        return torch.max(energies) if self.is_distance else torch.min(energies)
 
     def forward(self, node_activations:torch.Tensor):
+        """
+        Inputs
+        ======
+        node_activations - n_pts x n_nodes (Tensor) list of node activations for each datapoint
+
+        Returns
+        =======
+        energies - n_pts x n_cmp (Tensor[single])
+        """
+        with _profile(self.profiler, "energy", node_activations) as stage:
+            energies = self.raw_energies(node_activations)
+            stage.set_output(energies)
+        with _profile(self.profiler, "normalization", energies):
+            return self.normalize(energies)
+
+    def normalize(self, energies:torch.Tensor) -> torch.Tensor:
+        """normalizes raw energies (n_pts x n_cmp) by energy_offset, or by their own batch_offset if it's None; returns Tensor[single]"""
+        offset = self.batch_offset(energies) if self.energy_offset is None else self.energy_offset
+        if self.is_distance:
+            return (offset - energies).to(torch.float) # convert from 0 = best to larger = better (similarity)
+        return (energies - offset).to(torch.float)
+
+
+class HNetEnergyViaHamiltonian(HNetEnergy):
+    """energy matching via the Hamiltonian method"""
+    is_distance:bool = True
+    energy_dtype:torch.dtype = torch.float # (x*H*x' runs as a single precision GEMM; see raw_energies)
+
+    def __init__(self, h:torch.Tensor, k:torch.Tensor, cmp_chunk_size:int=64):
+        """
+        Inputs
+        ======
+        h              - n_cmp x n_nodes x n_nodes (Tensor) dense, or sparse COO (e.g. from the "h_coo" field of Export2JSON.m)
+        k              - n_cmp x 1 (Tensor)
+        cmp_chunk_size - OPTIONAL (int) number of components scored at once in dense mode; peak memory is ~cmp_chunk_size x n_pts x n_nodes
+        """
+        super().__init__()
+        self.k:torch.Tensor     = torch.Tensor(k) # n_cmp x 1 (Tensor) ...
+        self.n_cmp:int          = int(h.shape[0]) # (int) number of components
+        self.cmp_chunk_size:int = int(cmp_chunk_size) # (int) number of components scored at once (dense mode only)
+        self.is_sparse:bool     = bool(h.is_sparse) # (bool) if true, h is stored as per-term coefficients instead of n_nodes x n_nodes matrices
+        assert self.cmp_chunk_size > 0
+        if self.is_sparse:
+            # each nonzero (row,col) node pair of any H is a "term" (a node on the diagonal, or an edge); x*H*x' = sum over terms of coef * x[row] * x[col]
+            # memory scales with the number of nonzeros instead of n_cmp x n_nodes^2
+            h = h.coalesce()
+            n_nodes = int(h.shape[1])
+            cmp_idx, row, col = h.indices()
+            uniq_pairs, term_idx = torch.unique(row * n_nodes + col, return_inverse=True)
+            self.h:torch.Tensor = None
+            self.term_endnode_idx:torch.Tensor = torch.stack((torch.div(uniq_pairs, n_nodes, rounding_mode="floor"), uniq_pairs % n_nodes), dim=1) # n_terms x 2 (Tensor[int64]) node pair for each term
+            term_coef = torch.sparse_coo_tensor(torch.stack((cmp_idx, term_idx)), h.values().to(torch.float), (self.n_cmp, uniq_pairs.shape[0]), check_invariants=False).coalesce() # n_cmp x n_terms coefficient of each term in each component
+            self.term_coef_idx:torch.Tensor = term_coef.indices().clone() # 2 x nnz (Tensor[int64]) (component, term) of each nonzero coefficient; kept as dense tensors (not views of the sparse one) so the module pickles / shares memory / compiles like any other
+            self.term_coef_val:torch.Tensor = term_coef.values().clone() # nnz x 1 (Tensor[single])
+        else:
+            self.h:torch.Tensor = torch.Tensor(h) # n_cmp x n_nodes x n_nodes (Tensor) ...
+
+    def raw_energies(self, node_activations:torch.Tensor) -> torch.Tensor:
         """
         ...
         see also Energy.m
@@ -74,30 +196,62 @@ class HNetEnergyViaHamiltonian(nn.Module):
 
         Returns
         =======
-        energies - n_pts x n_cmp (Tensor[double])
+        energies - n_pts x n_cmp (Tensor[single]) unnormalized; exact for binary node activations, since h and k hold small integers
         """
         n_pts = node_activations.shape[0]
-        energies = torch.zeros((n_pts,self.n_cmp), dtype=torch.double)
-        for i in range(self.n_cmp):
-            temp = torch.matmul(self.h[i,:,:], node_activations.T) # n_nodes x n_pts
-            for j in range(n_pts):
-                energies[j,i] = torch.dot(node_activations[j,:], temp[:,j])
-            energies[:,i] += self.k[i]
-        energies = torch.max(energies) - energies # convert from 0 = best to larger = better (similarity)
+        energies = torch.zeros((n_pts,self.n_cmp), dtype=self.energy_dtype)
+        if node_activations.is_sparse: # e.g. from HNetKWTA: only the rows and columns of the few active nodes matter
+            active_idx, active_val = _sparse_rows(node_activations) # n_pts x max_n_active
+            if self.is_sparse:
+                chunk_sz = max(1, 2**22 // node_activations.shape[1]) # densify a bounded number of datapoints at a time
+                for i in range(0, n_pts, chunk_sz):
+                    x = torch.zeros((active_idx[i:i+chunk_sz].shape[0],node_activations.shape[1]), dtype=self.term_coef_val.dtype)
+                    x.scatter_add_(1, active_idx[i:i+chunk_sz], active_val[i:i+chunk_sz].to(x.dtype)) # (padding adds 0)
+                    energies[i:i+chunk_sz,:] = self.term_energies(x)
+            else:
+                chunk_sz = max(1, 2**22 // (self.n_cmp * max(1, active_idx.shape[1])**2))
+                for i in range(0, n_pts, chunk_sz): # for each chunk of datapoints
+                    idx = active_idx[i:i+chunk_sz]
+                    val = active_val[i:i+chunk_sz].to(self.h.dtype)
+                    h = self.h[:,idx[:,:,None],idx[:,None,:]] # n_cmp x chunk x max_n_active x max_n_active (each datapoint's active submatrix of each H)
+                    energies[i:i+chunk_sz,:] = torch.einsum("cpab,pa,pb->pc", h, val, val)
+        elif self.is_sparse:
+            energies[:,:] = self.term_energies(node_activations.to(self.term_coef_val.dtype))
+        else:
+            x = node_activations.to(self.h.dtype)
+            for i in range(0, self.n_cmp, self.cmp_chunk_size): # for each chunk of components
+                h = self.h[i:i+self.cmp_chunk_size,:,:] # chunk x n_nodes x n_nodes
+                temp = torch.matmul(x, h) # chunk x n_pts x n_nodes (x is broadcast across the chunk)
+                energies[:,i:i+h.shape[0]] = torch.sum(temp * x, dim=2).T # x*H*x' for every datapoint and component in the chunk
+        energies += torch.reshape(self.k, (1,self.n_cmp))
         return energies
+
+    def term_energies(self, x:torch.Tensor) -> torch.Tensor:
+        """x*H*x' (without k) for every datapoint and component, from the per-term coefficients (sparse h only); x is n_pts x n_nodes (Tensor[single])"""
+        term_activations = x[:,self.term_endnode_idx[:,0]] * x[:,self.term_endnode_idx[:,1]] # n_pts x n_terms
+        if torch.compiler.is_compiling(): # sparse tensors can't be compiled or exported: scatter each coefficient's contribution instead, a chunk of coefficients at a time (n_pts x chunk intermediate)
+            energies = torch.zeros((x.shape[0],self.n_cmp), dtype=x.dtype)
+            for i in range(0, self.term_coef_val.shape[0], _COMPILED_MAX_NUMEL_PER_PT):
+                contributions = term_activations[:,self.term_coef_idx[1,i:i+_COMPILED_MAX_NUMEL_PER_PT]] * self.term_coef_val[None,i:i+_COMPILED_MAX_NUMEL_PER_PT]
+                energies.index_add_(1, self.term_coef_idx[0,i:i+_COMPILED_MAX_NUMEL_PER_PT], contributions)
+            return energies
+        term_coef = torch.sparse_coo_tensor(self.term_coef_idx, self.term_coef_val, (self.n_cmp,self.term_endnode_idx.shape[0]), is_coalesced=True, check_invariants=False) # (no copy)
+        return torch.sparse.mm(term_coef, term_activations.T).T # sparse x dense
     
 
-class HNetEnergyViaEdgeMatching(nn.Module):
+class HNetEnergyViaEdgeMatching(HNetEnergy):
     """energy calculation via the edge matching method"""
     def __init__(self, learned_edge_states:torch.Tensor, edge_endnode_idx:torch.Tensor, edge_type_filter:torch.Tensor):
         super().__init__()
         self.learned_edge_states:torch.Tensor = torch.Tensor(learned_edge_states) # n_cmp x n_edges (Tensor[int64]) ...
         self.edge_endnode_idx:torch.Tensor    = torch.Tensor(edge_endnode_idx).to(torch.int64) # ...
         self.edge_type_filter:torch.Tensor    = torch.Tensor(edge_type_filter).to(torch.int64) # ...
+        self.edge_state_lut:tuple             = _edge_state_lut(self.edge_type_filter) # 4 (tuple of int) 2-bit node pair --> filtered edge state
+        self.edge_feature_key:str             = _hash_tensors(self.edge_endnode_idx, torch.tensor(self.edge_state_lut, dtype=torch.uint8))
         self.learned_edge_states_are_null:torch.Tensor = (self.learned_edge_states == EDG_NULL)# n_cmp x n_edges (Tensor[bool]) ...
         self.n_cmp:int = int(self.learned_edge_states.shape[0]) # (int) number of components
         
-    def forward(self, node_activations:torch.Tensor):
+    def raw_energies(self, node_activations:torch.Tensor) -> torch.Tensor:
         """
         see also Energy.m
         
@@ -107,54 +261,265 @@ class HNetEnergyViaEdgeMatching(nn.Module):
 
         Returns
         =======
-        energies - n_pts x n_cmp (Tensor[double])
+        energies - n_pts x n_cmp (Tensor[int32]) unnormalized (number of matching edges)
         """
         n_pts = node_activations.shape[0]
         n_cmp = self.learned_edge_states.shape[0]
-        edge_activations = _get_edge_states(node_activations, self.edge_endnode_idx, self.edge_type_filter)
-        energies = torch.zeros((n_pts,self.n_cmp), dtype=torch.double)
+        edge_activations = self.edge_features(node_activations, "edgestates", lambda x: _get_edge_states(x, self.edge_endnode_idx, self.edge_state_lut))
+        if torch.compiler.is_compiling(): # n_pts is symbolic (see export_compiled_model), so compare all datapoints at once, one chunk of components at a time (n_pts x chunk x n_edges intermediate)
+            cmp_chunk_sz = max(1, _COMPILED_MAX_NUMEL_PER_PT // max(1, self.learned_edge_states.shape[1]))
+            energies = []
+            for j in range(0, n_cmp, cmp_chunk_sz):
+                matches = (self.learned_edge_states[None,j:j+cmp_chunk_sz,:] == edge_activations[:,None,:]) | self.learned_edge_states_are_null[None,j:j+cmp_chunk_sz,:]
+                energies.append(torch.sum(matches, dim=2).to(self.energy_dtype))
+            return torch.cat(energies, dim=1)
+        energies = torch.zeros((n_pts,self.n_cmp), dtype=self.energy_dtype)
         for i in range(n_pts):
             for j in range(n_cmp):
                 temp = (self.learned_edge_states[j,:] == edge_activations[i,:])
                 temp = torch.logical_or(temp, self.learned_edge_states_are_null[j,:])
                 energies[i,j] = torch.sum(temp)
-        energies = energies - torch.min(energies)
         return energies
 
 
-class HNetEnergyViaBoolWeights(nn.Module):
+class HNetEnergyViaPackedEdgeMatching(HNetEnergy):
+    """energy calculation via the edge matching method, on edge states one-hot encoded into packed 64-bit words (same results as HNetEnergyViaEdgeMatching)"""
+    def __init__(self, learned_edge_states:torch.Tensor, edge_endnode_idx:torch.Tensor, edge_type_filter:torch.Tensor, max_chunk_numel:int=2**16):
+        super().__init__()
+        learned_edge_states = torch.Tensor(learned_edge_states)
+        self.edge_endnode_idx:torch.Tensor = torch.Tensor(edge_endnode_idx).to(torch.int64) # ...
+        self.edge_type_filter:torch.Tensor = torch.Tensor(edge_type_filter).to(torch.int64) # ...
+        self.edge_state_lut:tuple          = _edge_state_lut(self.edge_type_filter) # 4 (tuple of int) 2-bit node pair --> filtered edge state
+        self.edge_feature_key:str          = _hash_tensors(self.edge_endnode_idx, torch.tensor(self.edge_state_lut, dtype=torch.uint8))
+        self.packed_learned_edge_states:torch.Tensor = _pack_edge_states(learned_edge_states) # n_cmp x 4 x n_words (Tensor[int64]) one bit-plane per non-null edge state
+        self.packed_learned_edge_states_are_null:torch.Tensor = _pack_bits(learned_edge_states == EDG_NULL) # n_cmp x n_words (Tensor[int64]) null edges always match
+        self.n_cmp:int = int(learned_edge_states.shape[0]) # (int) number of components
+        self.max_chunk_numel:int = int(max_chunk_numel) # (int) max number of words in the chunk x n_cmp x n_words intermediate (small enough to stay in cache)
+
+    def raw_energies(self, node_activations:torch.Tensor) -> torch.Tensor:
+        """
+        see also Energy.m
+        
+        Inputs
+        ======
+        node_activations - n_pts x n_nodes (Tensor) list of node activations for each datapoint
+
+        Returns
+        =======
+        energies - n_pts x n_cmp (Tensor[int32]) unnormalized (number of matching edges)
+        """
+        n_pts = node_activations.shape[0]
+        packed_edge_activations = self.edge_features(node_activations, "packed", lambda x: _get_packed_edge_states(x, self.edge_endnode_idx, self.edge_state_lut)) # n_pts x 4 x n_words
+        n_words = packed_edge_activations.shape[2]
+        if torch.compiler.is_compiling(): # n_pts is symbolic (see export_compiled_model), so the whole minibatch is one chunk, scored one chunk of components at a time
+            chunk_sz = n_pts
+            chunk_starts = [0]
+            cmp_chunk_sz = max(1, _COMPILED_MAX_NUMEL_PER_PT // max(1, n_words))
+        else:
+            chunk_sz = max(1, self.max_chunk_numel // max(1, self.n_cmp * n_words)) # number of datapoints per chunk
+            chunk_starts = range(0, n_pts, chunk_sz)
+            cmp_chunk_sz = self.n_cmp
+        energies = torch.zeros((n_pts,self.n_cmp), dtype=self.energy_dtype)
+        for i in chunk_starts:
+            act = packed_edge_activations[i:i+chunk_sz,None,:,:] # chunk x 1 x 4 x n_words
+            for c in range(0, self.n_cmp, cmp_chunk_sz):
+                learned = self.packed_learned_edge_states[c:c+cmp_chunk_sz]
+                matches = self.packed_learned_edge_states_are_null[None,c:c+cmp_chunk_sz,:] | (act[:,:,0,:] & learned[None,:,0,:]) # chunk x cmp_chunk x n_words
+                for j in range(1, 4): # edge states are one-hot, so at most one plane matches per edge
+                    matches |= act[:,:,j,:] & learned[None,:,j,:]
+                energies[i:i+chunk_sz,c:c+cmp_chunk_sz] = _popcount(matches)
+        return energies
+
+
+class HNetEnergyViaBoolWeights(HNetEnergy):
     """energy calculation via the boolean weights method"""
     def __init__(self, learned_edge_states:torch.Tensor, edge_endnode_idx:torch.Tensor, edge_type_filter:torch.Tensor, do_include_null:bool, do_include_all_16:bool):
         super().__init__()
         self.edge_endnode_idx:torch.Tensor              = torch.Tensor(edge_endnode_idx).to(torch.int64) # ...
         self.edge_type_filter:torch.Tensor              = torch.Tensor(edge_type_filter).to(torch.int64) # ...
+        self.edge_state_lut:tuple                       = _edge_state_lut(self.edge_type_filter) # 4 (tuple of int) 2-bit node pair --> filtered edge state
         self.binarized_learned_edge_states:torch.Tensor = torch.Tensor(_edge_to_logical(learned_edge_states, do_include_null, do_include_all_16)) # n_cmp x n_binarized_edges (Tensor) ...
+        self.weights:torch.Tensor                       = self.binarized_learned_edge_states.to(torch.int8).T.contiguous() # n_binarized_edges x n_cmp (Tensor[int8]) prepared once for the GEMM
         self.n_cmp:int                                  = int(self.binarized_learned_edge_states.shape[0]) # (int) number of components
         self.do_include_null:bool                       = bool(do_include_null) # ...
         self.do_include_all_16:bool                     = bool(do_include_all_16) # ...
+        self.edge_feature_key:str                       = _hash_tensors(self.edge_endnode_idx, torch.tensor(self.edge_state_lut, dtype=torch.uint8), torch.tensor([self.do_include_null,self.do_include_all_16]))
 
-    def forward(self, node_activations:torch.Tensor):
+    def raw_energies(self, node_activations:torch.Tensor) -> torch.Tensor:
         """
         ...
         see also Energy.m
         
         Inputs
         ======
-        node_activations - n_pts x n_binarized_edge_states (Tensor) list of node activations for each datapoint
+        node_activations - n_pts x n_nodes (Tensor) list of node activations for each datapoint
 
         Returns
         =======
-        energies - n_pts x n_cmp (Tensor[double])
+        energies - n_pts x n_cmp (Tensor[int32]) unnormalized (number of matching edges)
         """
-        n_pts = node_activations.shape[0]
-        edge_activations = _get_edge_states(node_activations, self.edge_endnode_idx, self.edge_type_filter)
-        binarized_edge_activations = _edge_to_logical(edge_activations, self.do_include_null, self.do_include_all_16)
+        binarized_edge_activations = self.edge_features(node_activations, "logical", lambda x: _get_logical_edge_states(x, self.edge_endnode_idx, self.edge_state_lut, self.do_include_null, self.do_include_all_16))
+        energies = _int8_matmul(binarized_edge_activations.view(torch.int8), self.weights) # one GEMM for the whole minibatch (bool --> int8 is a free reinterpretation)
+        return energies
 
-        energies = torch.zeros((n_pts,self.n_cmp), dtype=torch.double)
-        for i in range(n_pts):
-            energies[i,:] = torch.matmul(self.binarized_learned_edge_states.to(torch.int8), binarized_edge_activations[i,:].to(torch.int8)) # implicit expansion
 
-        energies = energies - torch.min(energies)
+class HNetTranslatedEnergy(HNetEnergy):
+    """
+    translation invariant energy for grid-graph (GRF_GRID2D or GRF_GRID2DMULTICHAN) banks: each component is stored once, as a stencil of learned edge states around its bounding box, and is scored at every translation by 2-d correlation over per-edge-direction feature maps
+    the energy of a component is its best energy over all translations, same as the max over the shifted copies materialized by TranslateAndRotate.m (without rotation), but memory scales with n_cmp instead of n_cmp x n_translations
+    """
+    def __init__(self, learned_edge_states:torch.Tensor, edge_endnode_idx:torch.Tensor, edge_type_filter:torch.Tensor, energy_mode:str, img_sz:list, max_translation_delta:int=None, cmp_chunk_size:int=64, max_chunk_numel:int=2**24):
+        """
+        Inputs
+        ======
+        learned_edge_states   - n_cmp x n_edges (Tensor[int64]) ...
+        edge_endnode_idx      - n_edges x 2 (Tensor[int64]) edges of a grid graph (see _grid_edge_coords)
+        edge_type_filter      - ? x 1 (Tensor[int64]) ...
+        energy_mode           - (char) "edgematch" (or "bitpacked", which has the same energies) or "boolweights"
+        img_sz                - [n_rows,n_cols] or [n_rows,n_cols,n_chan] (list of int) shape of the grid
+        max_translation_delta - OPTIONAL (int) if set, components are shifted by -max_translation_delta:max_translation_delta rows and columns, and edges shifted off the grid are dropped (become EDG_NULL), as in TranslateAndRotate.m
+                                if None, components are shifted to every position where all of their (non-null) edges stay on the grid
+        cmp_chunk_size        - OPTIONAL (int) number of components correlated at once
+        max_chunk_numel       - OPTIONAL (int) max number of elements in the padded feature maps of one chunk of datapoints
+        """
+        super().__init__()
+        learned_edge_states = torch.as_tensor(learned_edge_states).to(torch.int64)
+        self.edge_endnode_idx:torch.Tensor = torch.as_tensor(edge_endnode_idx).to(torch.int64) # ...
+        self.edge_type_filter:torch.Tensor = torch.as_tensor(edge_type_filter).to(torch.int64) # ...
+        self.edge_state_lut:tuple          = _edge_state_lut(self.edge_type_filter) # 4 (tuple of int) 2-bit node pair --> filtered edge state
+        self.n_cmp:int                     = int(learned_edge_states.shape[0]) # (int) number of components
+        self.img_sz:tuple                  = (int(img_sz[0]), int(img_sz[1]), int(img_sz[2]) if len(img_sz) > 2 else 1) # (tuple of int) n_rows, n_cols, n_chan
+        self.max_chunk_numel:int           = int(max_chunk_numel) # (int) ...
+        if energy_mode not in ("edgematch","bitpacked","boolweights"):
+            raise Exception("translation invariance requires an edge-based energy mode (edgematch, bitpacked, or boolweights)")
+        assert cmp_chunk_size > 0
+        n_rows, n_cols, n_chan = self.img_sz
+        n_maps = 2 * n_chan # one feature map per (channel, edge direction)
+        edge_chan, edge_is_right, edge_row, edge_col = _grid_edge_coords(self.edge_endnode_idx, self.img_sz)
+        edge_map = 2 * edge_chan + edge_is_right.to(torch.int64) # n_edges x 1 (Tensor[int64]) feature map of each edge
+        self.edge_map_pos:torch.Tensor = (edge_map * 4 * n_rows + edge_row) * n_cols + edge_col # n_edges x 1 (Tensor[int64]) position of each edge's 00 code in the flattened n_maps*4 x n_rows x n_cols one-hot code maps
+        self.edge_feature_key:str = _hash_tensors(self.edge_endnode_idx, torch.tensor(self.img_sz))
+
+        # stencils: each component's non-null edges, relative to the top left of their bounding box
+        is_learned = (learned_edge_states != EDG_NULL) # n_cmp x n_edges
+        cmp_idx, edge_idx = torch.nonzero(is_learned, as_tuple=True)
+        big = max(n_rows, n_cols)
+        origin_row = torch.full((self.n_cmp,), big, dtype=torch.int64).scatter_reduce(0, cmp_idx, edge_row[edge_idx], "amin")
+        origin_col = torch.full((self.n_cmp,), big, dtype=torch.int64).scatter_reduce(0, cmp_idx, edge_col[edge_idx], "amin")
+        origin_row[origin_row == big] = 0 # (all-null components)
+        origin_col[origin_col == big] = 0
+        stencil_row = edge_row[edge_idx] - origin_row[cmp_idx]
+        stencil_col = edge_col[edge_idx] - origin_col[cmp_idx]
+        self.stencil_sz:tuple = (int(torch.max(stencil_row)) + 1, int(torch.max(stencil_col)) + 1) if edge_idx.shape[0] > 0 else (1,1) # (tuple of int) rows, cols of the stencils (shared by all components)
+        # (components are stored sorted by origin, so each chunk of them only needs the correlation over a small region of the maps)
+        cmp_order = torch.argsort(origin_row * n_cols + origin_col, stable=True)
+        self.cmp_order_inv:torch.Tensor = torch.argsort(cmp_order) # n_cmp x 1 (Tensor[int64]) stored component order --> original component order
+        rank = self.cmp_order_inv[cmp_idx] # stored index of each learned edge's component
+        weight = torch.zeros((self.n_cmp,n_maps*4,self.stencil_sz[0],self.stencil_sz[1]), dtype=torch.float)
+        for code in range(4): # one-hot code channels; a learned edge matches the codes that the lut maps to its state
+            is_code = (learned_edge_states[cmp_idx,edge_idx] == self.edge_state_lut[code])
+            weight[rank[is_code],4*edge_map[edge_idx[is_code]]+code,stencil_row[is_code],stencil_col[is_code]] = 1
+        self.weight:torch.Tensor = weight # n_cmp x n_maps*4 x stencil rows x stencil cols (Tensor[single]) in stored order
+        learned_stencils = torch.zeros((self.n_cmp,n_maps,self.stencil_sz[0],self.stencil_sz[1]), dtype=torch.float)
+        learned_stencils[rank,edge_map[edge_idx],stencil_row,stencil_col] = 1
+        origin_row = origin_row[cmp_order]
+        origin_col = origin_col[cmp_order]
+
+        # offsets, sorted by distance so ties go to the smallest translation
+        delta_rows = n_rows - 1 if max_translation_delta is None else int(max_translation_delta)
+        delta_cols = n_cols - 1 if max_translation_delta is None else int(max_translation_delta)
+        assert delta_rows >= 0 and delta_cols >= 0
+        self.pad:tuple = (delta_cols, delta_cols + self.stencil_sz[1] - 1, delta_rows, delta_rows + self.stencil_sz[0] - 1) # (tuple of int) padding of the feature maps (left, right, top, bottom)
+        dy, dx = torch.meshgrid(torch.arange(-delta_rows, delta_rows+1), torch.arange(-delta_cols, delta_cols+1), indexing="ij")
+        dy, dx = dy.reshape(-1), dx.reshape(-1)
+        offset_order = torch.argsort(torch.abs(dy) + torch.abs(dx), stable=True)
+        self.offsets:torch.Tensor = torch.stack((dy[offset_order], dx[offset_order]), dim=1) # n_offsets x 2 (Tensor[int64]) (row, col) translation of each offset
+
+        # component chunks (sharing an origin row), and where each component's offsets are in its chunk's correlation
+        stencil_rows = torch.zeros(self.n_cmp, dtype=torch.int64).scatter_reduce(0, rank, stencil_row, "amax") + 1 # (stored order)
+        stencil_cols = torch.zeros(self.n_cmp, dtype=torch.int64).scatter_reduce(0, rank, stencil_col, "amax") + 1
+        self.chunks:list = [] # list of (first stored component, last stored component + 1, first row, n_rows, first col, n_cols, stencil rows, stencil cols) (tuple of int) region of the padded maps each chunk's correlation is over, and the stencil size it needs
+        self.window_idx:torch.Tensor = torch.zeros((self.n_cmp,self.offsets.shape[0]), dtype=torch.int64) # n_cmp x n_offsets (Tensor[int64]) flattened position of each offset in its chunk's correlation output
+        row_start = 0
+        for n_same_row in torch.unique_consecutive(origin_row, return_counts=True)[1].tolist():
+            for i in range(row_start, row_start + n_same_row, cmp_chunk_size):
+                j = min(i + cmp_chunk_size, row_start + n_same_row)
+                row0, col0 = int(origin_row[i]), int(origin_col[i]) # (sorted)
+                out_rows = 2*delta_rows + 1
+                out_cols = int(origin_col[j-1]) - col0 + 2*delta_cols + 1
+                self.chunks.append((i, j, row0, out_rows, col0, out_cols, int(torch.max(stencil_rows[i:j])), int(torch.max(stencil_cols[i:j]))))
+                self.window_idx[i:j,:] = (delta_rows + self.offsets[None,:,0]) * out_cols + (origin_col[i:j,None] - col0 + delta_cols + self.offsets[None,:,1])
+            row_start += n_same_row
+
+        # data-independent part of the energy at each offset: learned edges shifted off the grid are null, and null edges always match (edgematch)
+        edge_exists = torch.zeros((1,n_maps,n_rows,n_cols), dtype=torch.float)
+        edge_exists[0,edge_map,edge_row,edge_col] = 1
+        n_on_grid = torch.cat([sums for _,_,sums in self._iter_window_sums(edge_exists, learned_stencils)], dim=1)[0] # n_cmp x n_offsets number of learned edges that stay on the grid
+        if energy_mode == "boolweights":
+            self.offset_bias:torch.Tensor = torch.zeros(n_on_grid.shape, dtype=torch.float) # n_cmp x n_offsets (Tensor[single]) added to the correlation
+        else:
+            self.offset_bias:torch.Tensor = self.edge_endnode_idx.shape[0] - n_on_grid # (matching + null = n_edges - mismatching learned edges on the grid)
+        if max_translation_delta is None:
+            self.offset_bias[n_on_grid < torch.sum(is_learned, dim=1)[cmp_order,None]] = -float("inf") # offsets that drop edges aren't allowed
+
+    def code_maps(self, node_activations:torch.Tensor) -> torch.Tensor:
+        """one-hot edge code (00, 01, 10, 11) of every edge, as n_pts x n_maps*4 x n_rows x n_cols feature maps (Tensor[single]); edges not in the graph are all zeros"""
+        n_rows, n_cols, n_chan = self.img_sz
+        codes = _get_edge_codes(node_activations, self.edge_endnode_idx).to(torch.int64) # n_pts x n_edges
+        maps = torch.zeros((codes.shape[0],2*n_chan*4*n_rows*n_cols), dtype=torch.float)
+        maps.scatter_(1, self.edge_map_pos[None,:] + codes * (n_rows * n_cols), 1.0)
+        return maps.view(codes.shape[0], 2*n_chan*4, n_rows, n_cols)
+
+    def _iter_window_sums(self, maps:torch.Tensor, weight:torch.Tensor):
+        """yields (first stored component, last + 1, n_pts x chunk x n_offsets (Tensor[single])) the correlation of each chunk of weight (in stored component order) with maps, at each component's offsets"""
+        padded = torch.nn.functional.pad(maps, self.pad)
+        for i0, i1, row0, out_rows, col0, out_cols, stencil_rows, stencil_cols in self.chunks:
+            region = padded[:,:,row0:row0+out_rows+stencil_rows-1,col0:col0+out_cols+stencil_cols-1]
+            sums = torch.nn.functional.conv2d(region, weight[i0:i1,:,:stencil_rows,:stencil_cols]).flatten(2) # n_pts x chunk x out_rows*out_cols
+            yield i0, i1, torch.gather(sums, 2, self.window_idx[None,i0:i1,:].expand(sums.shape[0],-1,-1))
+
+    def best_translations(self, node_activations:torch.Tensor):
+        """
+        Inputs
+        ======
+        node_activations - n_pts x n_nodes (Tensor) list of node activations for each datapoint
+
+        Returns
+        =======
+        energies   - n_pts x n_cmp (Tensor[int32]) unnormalized (number of matching edges) best energy over all translations of each component
+        offset_idx - n_pts x n_cmp (Tensor[int64]) index into self.offsets of the translation with that energy (the smallest one, if tied)
+        """
+        maps = self.edge_features(node_activations, "codemaps", self.code_maps)
+        n_pts = maps.shape[0]
+        padded_numel = maps.shape[1] * (maps.shape[2] + self.pad[2] + self.pad[3]) * (maps.shape[3] + self.pad[0] + self.pad[1])
+        if torch.compiler.is_compiling(): # n_pts is symbolic (see export_compiled_model), so the whole minibatch is one chunk of datapoints (still correlated one chunk of components at a time, see self.chunks)
+            chunk_sz = n_pts
+            chunk_starts = [0]
+        else:
+            chunk_sz = max(1, self.max_chunk_numel // padded_numel)
+            chunk_starts = range(0, n_pts, chunk_sz)
+        energies = torch.zeros((n_pts,self.n_cmp), dtype=self.energy_dtype)
+        offset_idx = torch.zeros((n_pts,self.n_cmp), dtype=torch.int64)
+        for p in chunk_starts:
+            for i0, i1, sums in self._iter_window_sums(maps[p:p+chunk_sz], self.weight):
+                best, idx = torch.max(sums + self.offset_bias[None,i0:i1,:], dim=2) # (first max = smallest translation)
+                energies[p:p+chunk_sz,i0:i1] = best.to(self.energy_dtype) # (sums of 0 / 1 below 2^24 are exact in single)
+                offset_idx[p:p+chunk_sz,i0:i1] = idx
+        return energies[:,self.cmp_order_inv], offset_idx[:,self.cmp_order_inv]
+
+    def raw_energies(self, node_activations:torch.Tensor) -> torch.Tensor:
+        """
+        see also Energy.m, TranslateAndRotate.m
+        
+        Inputs
+        ======
+        node_activations - n_pts x n_nodes (Tensor) list of node activations for each datapoint
+
+        Returns
+        =======
+        energies - n_pts x n_cmp (Tensor[int32]) unnormalized (number of matching edges) best energy over all translations of each component
+        """
+        energies,_ = self.best_translations(node_activations)
         return energies
 
 
@@ -165,48 +530,60 @@ class HNetNoNonlinearity(nn.Module):
         
     def forward(self, x):
         """x: n_pts x n_nodes (Tensor) list of energies for each datapoint"""
-        premerge_idx = numpy.matlib.repmat(np.arange(x.shape[1]).T, 1, x.shape[1]) # n_groups x n_pts
+        premerge_idx = _identity_premerge_idx(x) # n_pts x n_nodes
         return x, premerge_idx
 
 
 class HNetMax(nn.Module):
-    """nonlinearity that finds the maximum input"""
+    """nonlinearity that finds the maximum input within each group (each group = the non-null edges of one component)"""
     def __init__(self, learned_edge_states:torch.Tensor):
         super().__init__()
-        self.learned_edge_states_not_null:torch.Tensor = torch.Tensor(learned_edge_states != EDG_NULL)
+        self.member_idx, self.member_mask = _group_members(learned_edge_states) # n_cmp x max_n_members (Tensor[int64]), n_cmp x max_n_members (Tensor[bool])
+        self.n_cmp:int = int(self.member_idx.shape[0]) # (int) number of components (groups)
         
     def forward(self, x):
-        """x: n_pts x n_nodes (Tensor) list of energies for each datapoint"""
-        n_pts = x.shape[0]
-        n_cmp = self.learned_edge_states_not_null.shape[1]
-        newCompCode = np.zeros((n_pts,n_cmp), np.single)
-        premerge_idx = np.zeros((n_pts,n_cmp))
-        for i in range(n_cmp):
-            idx = torch.nonzero(self.learned_edge_states_not_null[:,i])
-            if idx.size > 0:
-                newCompCode[:,i], premerge_idx[:,i] = torch.max(x[:,idx], dim=1)
-                premerge_idx[:,i] = idx[premerge_idx[:,i]] # map back to the full list
-        return newCompCode
+        """
+        see also Encode.m
+        
+        Inputs
+        ======
+        x - n_pts x n_edges (Tensor) list of energies for each datapoint
+
+        Returns
+        =======
+        newCompCode  - n_pts x n_cmp (Tensor[single]) max of each group, 0 for empty groups
+        premerge_idx - n_pts x n_cmp (Tensor[int64]) index into x of each group's max, -1 for empty groups
+        """
+        vals = _group_values(x, self.member_idx) # n_pts x n_cmp x max_n_members
+        vals = vals.masked_fill(torch.logical_not(self.member_mask), -float("inf"))
+        newCompCode, best = torch.max(vals, dim=2)
+        return _group_output(newCompCode, best, self.member_idx, self.member_mask)
     
 
 class HNetMaxAbs(nn.Module):
-    """nonlinearity that find the maximum absolute value input"""
+    """nonlinearity that finds the input furthest from zero within each group (each group = the non-null edges of one component)"""
     def __init__(self, learned_edge_states:torch.Tensor):
         super().__init__()
-        self.learned_edge_states_not_null:torch.Tensor = torch.Tensor(learned_edge_states != EDG_NULL)
+        self.member_idx, self.member_mask = _group_members(learned_edge_states) # n_cmp x max_n_members (Tensor[int64]), n_cmp x max_n_members (Tensor[bool])
+        self.n_cmp:int = int(self.member_idx.shape[0]) # (int) number of components (groups)
         
     def forward(self, x):
-        """x: n_pts x n_nodes (Tensor) list of energies for each datapoint"""
-        n_pts = x.shape[0]
-        n_cmp = self.learned_edge_states_not_null.shape[1]
-        newCompCode = torch.zeros((n_pts,n_cmp))
-        premerge_idx = torch.zeros((n_pts,n_cmp))
-        for i in range(n_cmp):
-            idx = torch.nonzero(self.learned_edge_states_not_null[i,:])
-            if idx.size > 0:
-                newCompCode[:,i], premerge_idx[:,i] = torch.max(torch.abs(x[:,idx]), dim=1) # energy furthest from zero
-                premerge_idx[:,i] = idx(premerge_idx[:,i]) # map back to the full list
-        return newCompCode, premerge_idx
+        """
+        see also Encode.m
+        
+        Inputs
+        ======
+        x - n_pts x n_edges (Tensor) list of energies for each datapoint
+
+        Returns
+        =======
+        newCompCode  - n_pts x n_cmp (Tensor[single]) signed value of each group's energy furthest from zero, 0 for empty groups
+        premerge_idx - n_pts x n_cmp (Tensor[int64]) index into x of that energy, -1 for empty groups
+        """
+        vals = _group_values(x, self.member_idx) # n_pts x n_cmp x max_n_members
+        _, best = torch.max(torch.abs(vals).masked_fill(torch.logical_not(self.member_mask), -1), dim=2) # energy furthest from zero
+        newCompCode = torch.squeeze(torch.gather(vals, 2, best[:,:,None]), 2)
+        return _group_output(newCompCode, best, self.member_idx, self.member_mask)
 
 
 class HNetKWTA(nn.Module):
@@ -216,11 +593,27 @@ class HNetKWTA(nn.Module):
         self.n_winners:int = int(n_winners) # (int) number of winners
         
     def forward(self, x):
-        """x: n_pts x n_nodes (Tensor) list of energies for each datapoint"""
-        raise Exception("TODO")
-        # x = k_wta(x, self.n_winners) # n_trn x n_cmp_groups
-        # premerge_idx = ???
-        # return x, premerge_idx
+        """
+        see also Encode.m and ml.KWTA
+        
+        Inputs
+        ======
+        x - n_pts x n_cmp (Tensor) list of energies for each datapoint
+
+        Returns
+        =======
+        newCompCode  - n_pts x n_cmp (sparse COO Tensor[single]) 1 for each datapoint's n_winners highest energies, else 0 (the next bank consumes it without densifying)
+        premerge_idx - n_pts x n_winners (Tensor[int64]) index of each winner, highest energy first
+        """
+        n_pts, n_cmp = x.shape
+        n_winners = min(self.n_winners, n_cmp)
+        premerge_idx = torch.sort(x, dim=1, descending=True, stable=True).indices[:,:n_winners] # (not topk, which breaks ties in no fixed order; like maxk, a stable sort keeps the lowest index among tied energies, which are common since energies are integers)
+        if torch.compiler.is_compiling(): # sparse tensors can't be compiled or exported, so the compiled graph passes a dense (same valued) compcode instead
+            newCompCode = torch.zeros((n_pts,n_cmp), dtype=torch.float).scatter_(1, premerge_idx, 1.0)
+            return newCompCode, premerge_idx
+        rows = torch.arange(n_pts).repeat_interleave(n_winners)
+        newCompCode = torch.sparse_coo_tensor(torch.stack((rows, premerge_idx.reshape(-1))), torch.ones(n_pts*n_winners), (n_pts,n_cmp), check_invariants=False).coalesce()
+        return newCompCode, premerge_idx
 
 
 class HNetNonzero(nn.Module):
@@ -231,24 +624,34 @@ class HNetNonzero(nn.Module):
     def forward(self, x):
         """x: n_pts x n_nodes (Tensor) list of energies for each datapoint"""
         x = (x > 0)
-        premerge_idx = numpy.matlib.repmat(np.arange(x.shape[1]).T, 1, x.shape[1]) # n_groups x n_pts
+        premerge_idx = _identity_premerge_idx(x) # n_pts x n_nodes
         return x, premerge_idx
 
 
 class HNetComponentBank(nn.Module):
     """..."""
-    def __init__(self, energy_mode:str, name:str, h:torch.Tensor, k:torch.Tensor, learned_edge_states:torch.Tensor, edge_endnode_idx:torch.Tensor, edge_type_filter:torch.Tensor, nonlinearity_mode:str, n_winners:int):
+    def __init__(self, energy_mode:str, name:str, h:torch.Tensor, k:torch.Tensor, learned_edge_states:torch.Tensor, edge_endnode_idx:torch.Tensor, edge_type_filter:torch.Tensor, nonlinearity_mode:str, n_winners:int, cmp_chunk_size:int=64):
         super().__init__()
         do_include_null = False #TODO: should be exported from matlab
         do_include_all_16 = False #TODO: should be exported from matlab
 
         self.name:str = str(name) # just for printing
-        self.n_cmp:int = int(h.shape[0]) # (int) number of components
+        self.n_cmp:int = int(k.shape[0]) # (int) number of components (h may be empty if the model file only has h_coo)
+        self.n_nodes:int = int(h.shape[1]) if h.dim() == 3 else None # (int) number of input nodes, or None if the model file has no h
+        self.energy_mode:str = str(energy_mode) # (char) ...
+        self.learned_edge_states:torch.Tensor = learned_edge_states # n_cmp x n_edges (Tensor[int64]) kept for topk()
+        self.edge_endnode_idx:torch.Tensor = edge_endnode_idx # n_edges x 2 (Tensor[int64]) kept for topk()
+        self.edge_type_filter:torch.Tensor = edge_type_filter # ? x 1 (Tensor[int64]) kept for topk()
+        self.component_index:HNetComponentIndex = None # (HNetComponentIndex) built by the first call to topk()
+        self.profiler:HNetProfiler = None # (HNetProfiler) if set, records this bank's calls (see set_profiler)
+        self.untranslated_energy:HNetEnergy = None # (HNetEnergy) the original energy module while self.energy is an HNetTranslatedEnergy (see set_translation_invariance)
 
         if energy_mode == "hamiltonian":
-            self.energy = HNetEnergyViaHamiltonian(h, k)
+            self.energy = HNetEnergyViaHamiltonian(h, k, cmp_chunk_size)
         elif energy_mode == "edgematch":
             self.energy = HNetEnergyViaEdgeMatching(learned_edge_states, edge_endnode_idx, edge_type_filter)
+        elif energy_mode == "bitpacked":
+            self.energy = HNetEnergyViaPackedEdgeMatching(learned_edge_states, edge_endnode_idx, edge_type_filter)
         elif energy_mode == "boolweights":
             self.energy = HNetEnergyViaBoolWeights(learned_edge_states, edge_endnode_idx, edge_type_filter, do_include_null, do_include_all_16)
         else:
@@ -267,52 +670,669 @@ class HNetComponentBank(nn.Module):
         else:
             raise Exception("unexpected nonlinearity_mode")
         
+    def encode(self, x):
+        """returns (compcode, premerge_idx), as from the nonlinearity"""
+        with _profile(self.profiler, "bank", x, self.name) as stage:
+            x = self.energy(x)
+            with _profile(self.profiler, "nonlinearity", x) as nonlinearity_stage:
+                x, premerge_idx = self.nonlinearity(x)
+                nonlinearity_stage.set_output(x)
+            stage.set_output(x)
+        return x, premerge_idx
+
     def forward(self, x):
-        x = self.energy(x)
-        x,_ = self.nonlinearity(x)
+        x,_ = self.encode(x)
         return x
 
+    def topk(self, x:torch.Tensor, k:int):
+        """
+        exact top-k components by energy (before the nonlinearity) for each datapoint, without scoring every component (see HNetComponentIndex)
+
+        Inputs
+        ======
+        x - n_pts x n_nodes (Tensor) binary node activations
+        k - (int) number of components to return per datapoint (at most n_cmp)
+
+        Returns
+        =======
+        energies - n_pts x k (Tensor[single]) sorted descending; equal to the corresponding entries of self.energy(x) if the bank is calibrated (see calibrate_energy_offsets), else normalized with an offset of 0 (ranks are the same either way)
+        idx      - n_pts x k (Tensor[int64]) component index of each energy; ties go to the lowest index
+        """
+        if self.untranslated_energy is not None:
+            raise Exception("topk() doesn't support translation invariant banks (see set_translation_invariance)")
+        if self.component_index is None:
+            self.component_index = HNetComponentIndex(self.learned_edge_states, self.edge_endnode_idx, self.edge_type_filter, self.energy_mode)
+        n_matches, idx = self.component_index.query(x, k, self.dense_n_matches if self.energy_mode in ("bitpacked","boolweights") else None) # (the other modes' energies are slower than the index's own packed scoring)
+        energies = n_matches.to(torch.float)
+        if self.energy.is_distance: # hamiltonian: raw energy = number of learned (non-null) edges that don't match
+            energies = self.learned_edge_states.shape[1] - energies
+        offset = 0.0 if self.energy.energy_offset is None else self.energy.energy_offset
+        if self.energy.is_distance:
+            return offset - energies, idx
+        return energies - offset, idx
+
+    def dense_n_matches(self, x:torch.Tensor) -> torch.Tensor:
+        """every component's count of matching edges (see HNetComponentIndex), from this bank's own energy, for when the index can't prune enough to pay"""
+        energies = self.energy.raw_energies(x)
+        if self.energy.is_distance:
+            energies = self.learned_edge_states.shape[1] - energies
+        return torch.round(energies).to(torch.int64)
+
 
 class HNetModel(nn.Module):
     """HNet Model"""
-    def __init__(self, model_info:dict, energy_mode:str):
+    def __init__(self, model_info:dict, energy_mode:str, cmp_chunk_size:int=64):
         super().__init__()
         self.links = model_info["links"]
 
         compbanks = [[]]*len(model_info["layout"])
         for i in range(len(model_info["layout"])): # for each component bank
             # convert dict into HNetComponentBank(nn.Module)
-            name                = model_info["layout"][i]["name"]
-            h                   = torch.Tensor(model_info["layout"][i]["h"])
-            k                   = torch.Tensor(model_info["layout"][i]["k"])
-            learned_edge_states = torch.Tensor(model_info["layout"][i]["learned_edge_states"]).to(torch.int64)
-            edge_endnode_idx    = torch.Tensor(model_info["layout"][i]["edge_endnode_idx"]).to(torch.int64)
-            edge_type_filter    = torch.Tensor(model_info["layout"][i]["edge_type_filter"]).to(torch.int64)
-            nonlinearity_mode   = model_info["layout"][i]["nonlinearity_mode"]
-            n_winners           = model_info["layout"][i]["n_winners"]
-            compbanks[i] = HNetComponentBank(energy_mode, name, h, k, learned_edge_states, edge_endnode_idx, edge_type_filter, nonlinearity_mode, n_winners)
-
-        if re.search("sense-->\w*,\w*-->out", self.links) is not None: # 1-tier architecture layout
-            assert len(compbanks) == 1
-            self.tier1 = compbanks[0]
-        elif re.search("sense-->\w*,\w*-->\w*,\w*-->out", self.links) is not None: # 2-tier feed-forward architecture layout
-            assert len(compbanks) == 2
-            self.tier1 = compbanks[0]
-            self.tier2 = compbanks[1]
-        else:
-            raise Exception("unexpected layout")
+            compbank_info       = _complete_compbank_info(model_info["layout"][i], energy_mode == "hamiltonian")
+            name                = compbank_info["name"]
+            h                   = _load_h(compbank_info)
+            k                   = torch.as_tensor(compbank_info["k"], dtype=torch.float)
+            learned_edge_states = torch.as_tensor(compbank_info["learned_edge_states"], dtype=torch.int64)
+            edge_endnode_idx    = torch.as_tensor(compbank_info["edge_endnode_idx"], dtype=torch.int64)
+            edge_type_filter    = torch.as_tensor(compbank_info["edge_type_filter"], dtype=torch.int64)
+            nonlinearity_mode   = compbank_info["nonlinearity_mode"]
+            n_winners           = compbank_info["n_winners"]
+            compbanks[i] = HNetComponentBank(energy_mode, name, h, k, learned_edge_states, edge_endnode_idx, edge_type_filter, nonlinearity_mode, n_winners, cmp_chunk_size)
+
+        self.compbanks = nn.ModuleList(compbanks) # in layout order
+        self.plan, self.out_idx = _compile_links(self.links, [compbank.name for compbank in compbanks]) # parsed once, here
+        self.compbank_order:list = [self.compbanks[dst] for dst,_ in self.plan] # list of HNetComponentBank, in the order forward() runs them (topological; each bank's input is upstream of it)
+        self.n_nodes:int = self.compbank_order[0].n_nodes # (int) number of sensory input nodes (the first bank in the plan reads sense), or None if unknown
+
+        # for each bank, the last plan step that reads its output (so forward() can free it afterwards)
+        self.last_use:list = [-1]*len(compbanks)
+        for step, (dst, src) in enumerate(self.plan):
+            if src >= 0:
+                self.last_use[src] = step
+        self.profiler:HNetProfiler = None # (HNetProfiler) if set, records each call (see set_profiler)
+        self.readout:HNetLinearReadout = None # (HNetLinearReadout) if set, forward() returns its class scores instead of the output energies (see set_readout)
+        self.row_cache:HNetRowCache = None # (HNetRowCache) if set, forward() evaluates each distinct input row once (see set_row_cache)
+
+    def compbank_input(self, x, i:int):
+        """returns the input to compbank_order[i], computed by running only the banks on its path from the sensory input"""
+        path = []
+        src = self.plan[i][1]
+        while src >= 0:
+            path.insert(0, src)
+            src = next(upstream_src for dst, upstream_src in self.plan if dst == src)
+        for idx in path:
+            x = self.compbanks[idx](x)
+        return x
+
+    def forward(self, x, return_all:bool=False):
+        """
+        Inputs
+        ======
+        x          - n_pts x n_nodes (Tensor[single]) sensory input
+        return_all - OPTIONAL (bool) if true, return every bank's output (like Encode.m) instead of just the model's output
+
+        Returns
+        =======
+        if return_all is false: n_pts x n_out (Tensor) the output of the bank linked to "out" (if several banks link to "out", their outputs are concatenated in link order), always dense
+                                or n_pts x n_classes (Tensor[single]) the readout's class scores, if a readout is set (see set_readout)
+        if return_all is true: (compcode, premerge_idx), each a dict of bank name --> n_pts x n_cmp (Tensor), sparse for "kwta" banks
+        if a row cache is set (see set_row_cache), only the distinct rows of x not already cached are evaluated (return_all is never cached)
+        """
+        if self.row_cache is not None and not return_all and not torch.compiler.is_compiling():
+            return self.row_cache.get_or_compute(self, x)
+        return self.forward_rows(x, return_all)
+
+    def forward_rows(self, x, return_all:bool=False):
+        """forward(), evaluating every row of x"""
+        compcode = [None]*len(self.compbanks)
+        premerge_idx = [None]*len(self.compbanks)
+        with _profile(self.profiler, "forward", x, "model"):
+            for step, (dst, src) in enumerate(self.plan):
+                compcode[dst], premerge_idx[dst] = self.compbanks[dst].encode(x if src < 0 else compcode[src])
+                if not return_all and src >= 0 and self.last_use[src] == step and src not in self.out_idx:
+                    compcode[src] = None # no longer needed
+                    premerge_idx[src] = None
+                if not return_all:
+                    premerge_idx[dst] = None
+
+        if return_all:
+            names = [compbank.name for compbank in self.compbanks]
+            return ({names[dst]:compcode[dst] for dst,_ in self.plan}, {names[dst]:premerge_idx[dst] for dst,_ in self.plan})
+        outputs = [compcode[idx].to_dense() if compcode[idx].is_sparse else compcode[idx] for idx in self.out_idx] # (e.g. from HNetKWTA)
+        output = outputs[0] if len(outputs) == 1 else torch.cat(outputs, dim=1)
+        if self.readout is not None:
+            return self.readout(output)
+        return output
+
+
+class HNetLinearReadout(nn.Module):
+    """
+    a one-vs-rest linear classifier on a model's output energies: scores = output @ weight.T + bias, predicted class = classes[argmax(scores)]
+    fit in closed form (ridge regression onto one-hot class indicators, on standardized features) from streamed sufficient statistics, see fit_linear_readout()
+    """
+    def __init__(self, weight:torch.Tensor, bias:torch.Tensor, classes:torch.Tensor):
+        super().__init__()
+        self.register_buffer("weight", weight.to(torch.float).contiguous()) # n_classes x n_features (Tensor[single]) (feature standardization folded in)
+        self.register_buffer("bias", bias.to(torch.float)) # n_classes (Tensor[single])
+        self.register_buffer("classes", classes) # n_classes (Tensor) label value of each class, sorted
+
+    def forward(self, x:torch.Tensor) -> torch.Tensor:
+        """x: n_pts x n_features (Tensor) model output; returns n_pts x n_classes (Tensor[single]) class scores"""
+        return torch.addmm(self.bias, x.to(torch.float), self.weight.T)
+
+    def predict(self, scores:torch.Tensor) -> torch.Tensor:
+        """scores: n_pts x n_classes (Tensor) from forward(); returns n_pts (Tensor) predicted label values"""
+        return self.classes[torch.argmax(scores, dim=1)]
+
+
+class HNetCompiledModel(nn.Module):
+    """a model compiled by export_compiled_model() and loaded by load_compiled_model(); forward(x) returns the same as the HNetModel's (only its final output)"""
+    def __init__(self, runner, hnet_info:dict):
+        super().__init__()
+        self.runner = runner # (callable) the compiled program
+        self.hnet_info:dict = hnet_info # (dict) names, links, energy_mode, n_nodes, is_calibrated, classes (None if no readout), torch_version
+        self.n_nodes:int = int(hnet_info["n_nodes"]) # (int) number of sensory input nodes
 
     def forward(self, x):
-        if re.search("sense-->\w*,\w*-->out", self.links) is not None: # 1-tier architecture layout
-            x = self.tier1(x)
-        elif re.search("sense-->\w*,\w*-->\w*,\w*-->out", self.links) is not None: # 2-tier feed-forward architecture layout
-            x = self.tier1(x)
-            x = self.tier2(x)
+        """x: n_pts x n_nodes (Tensor[single]) sensory input (sparse input is densified; the compiled graph is dense only)"""
+        if x.is_sparse:
+            x = x.to_dense()
+        return self.runner(x.to(torch.float).contiguous())
+
+
+class HNetComponentIndex:
+    """
+    index over a component bank's learned edge states, for exact top-k retrieval without scoring every component (see HNetComponentBank.topk)
+    each energy mode's raw energy is a count of matching edges (for hamiltonian, the number of edges minus that count), and every edge adds 0 or 1 to it, so a component can't match more (or fewer) edges than a reference state vector does, plus (minus) the number of edges where the two differ
+    components are clustered, and each cluster's centroid (its most common state on each edge) is the reference: per datapoint, scoring only the centroids bounds every component's count, and only components whose upper bound reaches the k-th best lower bound are scored exactly
+    all datapoints are bounded at once (a few first, to check that pruning pays); where clustering doesn't separate the components (e.g. unstructured data), too many candidates remain, and every component is scored densely instead
+    """
+    def __init__(self, learned_edge_states:torch.Tensor, edge_endnode_idx:torch.Tensor, edge_type_filter:torch.Tensor, energy_mode:str, do_include_null:bool=False, cluster_size:int=64, max_candidate_fraction:float=None, max_chunk_numel:int=2**22):
+        """
+        Inputs
+        ======
+        learned_edge_states    - n_cmp x n_edges (Tensor) EDG enum
+        edge_endnode_idx       - n_edges x 2 (Tensor[int64])
+        edge_type_filter       - ? x 1 (Tensor[int64])
+        energy_mode            - (char) which energy's count to rank by: "boolweights" only counts non-null matches (plus null-null matches if do_include_null), everything else also counts learned null edges as matches
+        do_include_null        - OPTIONAL (bool) see HNetEnergyViaBoolWeights
+        cluster_size           - OPTIONAL (int) average number of components per cluster (every datapoint is scored on every centroid)
+        max_candidate_fraction - OPTIONAL (float) if more than this fraction of (datapoint, component) pairs are candidates, all components are scored densely (default depends on how fast energy_mode's dense scoring is)
+        max_chunk_numel        - OPTIONAL (int) max number of elements in the n_pts x n_cmp intermediates of one chunk of datapoints
+        """
+        learned_edge_states = torch.as_tensor(learned_edge_states).to(torch.int64)
+        n_cmp, n_edges = learned_edge_states.shape
+        self.edge_endnode_idx:torch.Tensor = torch.as_tensor(edge_endnode_idx).to(torch.int64) # n_edges x 2 (Tensor[int64])
+        self.edge_state_lut:tuple = _edge_state_lut(torch.as_tensor(edge_type_filter).to(torch.int64)) # 4 (tuple of int)
+        self.packed_learned_edge_states:torch.Tensor = _pack_edge_states(learned_edge_states) # n_cmp x 4 x n_words (Tensor[int64])
+        self.packed_learned_edge_states_are_null:torch.Tensor = _pack_bits(learned_edge_states == EDG_NULL) # n_cmp x n_words (Tensor[int64]) padding bits are 0
+        self.is_edge:torch.Tensor = _pack_bits(torch.ones(n_edges, dtype=torch.bool)) # n_words (Tensor[int64]) padding bits are 0
+        self.is_null_a_match:bool = (energy_mode != "boolweights") # (bool) if true, a learned null edge matches anything
+        self.do_include_null:bool = bool(do_include_null) # (bool) if true (and not is_null_a_match), a learned null edge matches an input null edge
+        if max_candidate_fraction is None:
+            max_candidate_fraction = {"boolweights":0.02, "bitpacked":0.4}.get(energy_mode, 0.8) # relative to the bank's dense scoring (boolweights' is a gemm, much faster per pair than gathering candidates; see HNetComponentBank.topk)
+        self.max_candidate_fraction:float = float(max_candidate_fraction) # (float)
+        self.max_chunk_numel:int = int(max_chunk_numel) # (int)
+        self.n_probe:int = 8 # (int) number of datapoints per chunk bounded first, to check whether pruning pays before bounding the rest
+        self.n_edges:int = int(n_edges) # (int)
+        self.n_scored:int = 0 # (int) number of components (or centroids) scored on all edges so far, just for reporting
+        self.n_queried:int = 0 # (int) number of datapoints queried so far, just for reporting
+
+        codes = _edge_state_codes(learned_edge_states) # n_cmp x n_edges (Tensor[uint8])
+        n_clusters = max(1, -(-n_cmp // max(1, int(cluster_size))))
+        self.cluster_idx:torch.Tensor = _cluster_edge_state_codes(codes, n_clusters) # n_cmp (Tensor[int64]) cluster of each component
+        centroid_codes = _cluster_modes(codes, self.cluster_idx, n_clusters) # n_clusters x n_edges, each cluster's most common state per edge
+        centroid_edge_states = torch.tensor([EDG_NULL,EDG_NOR,EDG_NCONV,EDG_NIMPL,EDG_AND,EDG_T], dtype=torch.int64)[centroid_codes.to(torch.int64)] # (EDG_T stands in for any state without a bit-plane)
+        self.packed_centroids:torch.Tensor = _pack_edge_states(centroid_edge_states) # n_clusters x 4 x n_words (Tensor[int64])
+        self.packed_centroids_are_null:torch.Tensor = _pack_bits(centroid_codes == 0) # n_clusters x n_words (Tensor[int64])
+        self.radius:torch.Tensor = torch.sum(codes != centroid_codes[self.cluster_idx], dim=1) # n_cmp (Tensor[int64]) number of edges where each component differs from its centroid
+
+    def n_matches(self, learned:torch.Tensor, learned_are_null:torch.Tensor, packed_edge_states:torch.Tensor) -> torch.Tensor:
+        """
+        Inputs
+        ======
+        learned            - ... x 4 x n_words (Tensor[int64]) packed learned (or centroid) edge states
+        learned_are_null   - ... x n_words (Tensor[int64]) their null edges
+        packed_edge_states - ... x 5 x n_words (Tensor[int64]) datapoints' bit-planes (see _pack_edge_states), then their null edges; broadcast against learned
+
+        Returns
+        =======
+        n_matches - ... (Tensor[int64]) number of matching edges
+        """
+        matches = learned[...,0,:] & packed_edge_states[...,0,:]
+        for j in range(1, 4): # edge states are one-hot, so at most one plane matches per edge
+            matches = matches | (learned[...,j,:] & packed_edge_states[...,j,:])
+        if self.is_null_a_match:
+            matches = matches | learned_are_null
+        elif self.do_include_null:
+            matches = matches | (learned_are_null & packed_edge_states[...,4,:])
+        return _popcount(matches)
+
+    def n_matches_of_pairs(self, pt_idx:torch.Tensor, cmp_idx:torch.Tensor, packed_edge_states:torch.Tensor) -> torch.Tensor:
+        """number of matching edges of each (datapoint, component) pair, gathered in batches that stay small"""
+        n_words = self.is_edge.shape[0]
+        n_matches = torch.zeros(pt_idx.shape, dtype=torch.int64)
+        batch_sz = max(1, self.max_chunk_numel // (16 * max(1, n_words)))
+        for i in range(0, pt_idx.shape[0], batch_sz):
+            cmp = cmp_idx[i:i+batch_sz]
+            n_matches[i:i+batch_sz] = self.n_matches(self.packed_learned_edge_states[cmp], self.packed_learned_edge_states_are_null[cmp], packed_edge_states[pt_idx[i:i+batch_sz]])
+        return n_matches
+
+    def candidates(self, packed_edge_states:torch.Tensor, k:int) -> torch.Tensor:
+        """
+        bounds every component by its centroid's count, then fully scores the most promising few, so the k-th best of them (or of the lower bounds) is a lower bound on the final k-th best
+
+        Inputs
+        ======
+        packed_edge_states - n_pts x 5 x n_words (Tensor[int64]) datapoints' bit-planes, then their null edges
+        k                  - (int) number of components that will be returned per datapoint
+
+        Returns
+        =======
+        is_candidate - n_pts x n_cmp (Tensor[bool]) includes every component that can reach the k-th best (and at least k of them)
+        """
+        n_pts = packed_edge_states.shape[0]
+        n_cmp = self.packed_learned_edge_states.shape[0]
+        n_seeds = min(n_cmp, max(2*k, 16))
+        centroid_n_matches = self.n_matches(self.packed_centroids[None,:,:,:], self.packed_centroids_are_null[None,:,:], packed_edge_states[:,None,:,:]) # n_pts x n_clusters
+        centroid_n_matches = centroid_n_matches[:,self.cluster_idx] # n_pts x n_cmp
+        upper = centroid_n_matches + self.radius
+        seeds = torch.topk(upper, n_seeds, dim=1, sorted=False).indices # n_pts x n_seeds
+        seed_n_matches = self.n_matches_of_pairs(torch.arange(n_pts).repeat_interleave(n_seeds), seeds.reshape(-1), packed_edge_states).reshape(n_pts, n_seeds)
+        threshold = torch.maximum(torch.topk(seed_n_matches, k, dim=1, sorted=False).values.min(dim=1).values, torch.topk(centroid_n_matches - self.radius, k, dim=1, sorted=False).values.min(dim=1).values)
+        self.n_scored += n_pts * (self.packed_centroids.shape[0] + n_seeds)
+        return (upper >= threshold[:,None])
+
+    def query(self, x:torch.Tensor, k:int, dense_n_matches=None):
+        """
+        Inputs
+        ======
+        x               - n_pts x n_nodes (Tensor) binary node activations
+        k               - (int) number of components to return per datapoint
+        dense_n_matches - OPTIONAL (callable) maps node activations to their n_pts x n_cmp (Tensor[int64]) counts for every component; used instead of scoring candidates once too many remain (default = score all packed components)
+
+        Returns
+        =======
+        n_matches - n_pts x k (Tensor[int64]) sorted descending; ties go to the lowest component index
+        idx       - n_pts x k (Tensor[int64]) component index
+        """
+        n_cmp = self.packed_learned_edge_states.shape[0]
+        k = min(int(k), n_cmp)
+        assert k > 0
+        n_matches = torch.zeros((x.shape[0],k), dtype=torch.int64)
+        idx = torch.zeros((x.shape[0],k), dtype=torch.int64)
+        tiebreak = torch.arange(n_cmp-1, -1, -1) # (the key n_matches*n_cmp + tiebreak ranks ties by lowest index)
+        chunk_sz = max(1, self.max_chunk_numel // max(1, n_cmp)) # number of datapoints per chunk
+        for i0 in range(0, x.shape[0], chunk_sz):
+            xi = x[i0:i0+chunk_sz]
+            n_pts = xi.shape[0]
+            packed_edge_states = _get_packed_edge_states(xi, self.edge_endnode_idx, self.edge_state_lut) # n_pts x 4 x n_words
+            packed_edge_states_are_null = ~(packed_edge_states[:,0,:] | packed_edge_states[:,1,:] | packed_edge_states[:,2,:] | packed_edge_states[:,3,:]) & self.is_edge
+            packed_edge_states = torch.cat((packed_edge_states, packed_edge_states_are_null[:,None,:]), dim=1) # n_pts x 5 x n_words
+
+            # bound a few datapoints first, and only bound the rest if pruning pays for them
+            n_probe = min(n_pts, self.n_probe)
+            is_candidate = self.candidates(packed_edge_states[:n_probe], k)
+            is_pruning = (int(torch.sum(is_candidate)) <= self.max_candidate_fraction * n_probe * n_cmp)
+            if is_pruning and n_probe < n_pts:
+                is_candidate = torch.cat((is_candidate, self.candidates(packed_edge_states[n_probe:], k)), dim=0)
+            n_candidates = int(torch.sum(is_candidate))
+
+            if not is_pruning or n_candidates > self.max_candidate_fraction * n_pts * n_cmp:
+                if dense_n_matches is None:
+                    counts = self.n_matches_of_pairs(torch.arange(n_pts).repeat_interleave(n_cmp), torch.arange(n_cmp).repeat(n_pts), packed_edge_states).reshape(n_pts, n_cmp)
+                else:
+                    counts = dense_n_matches(xi)
+                self.n_scored += n_pts * n_cmp
+            else:
+                pt_idx, cmp_idx = torch.nonzero(is_candidate, as_tuple=True)
+                counts = torch.full((n_pts,n_cmp), -1, dtype=torch.int64)
+                counts[pt_idx,cmp_idx] = self.n_matches_of_pairs(pt_idx, cmp_idx, packed_edge_states)
+                self.n_scored += n_candidates
+            best = torch.topk(counts * n_cmp + tiebreak, k, dim=1).indices
+            n_matches[i0:i0+n_pts,:] = torch.gather(counts, 1, best)
+            idx[i0:i0+n_pts,:] = best
+        self.n_queried += x.shape[0]
+        return n_matches, idx
+
+    def fraction_scored(self) -> float:
+        """number of components (and centroids) that queries so far scored on all edges, as a fraction of scoring every component (1 = no pruning)"""
+        if self.n_queried == 0:
+            return 0.0
+        return self.n_scored / (self.n_queried * self.packed_learned_edge_states.shape[0])
+
+
+class HNetEdgeFeatureCache:
+    """
+    content-addressed on-disk cache of encoded edge features (edge states, packed bit-planes or one-hot edges), shared by every model and process that points at the same directory
+    each entry is keyed by a hash of the node activations, the graph (edge_endnode_idx), the edge type filter and the kind of encoding, so it's reused whenever the same data is scored by a model with the same graph and filter
+    the least recently used entries are evicted once the directory exceeds max_bytes
+    """
+    def __init__(self, cache_dir:str, max_bytes:int=2**30):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir:str = str(cache_dir) # (char) directory holding one file per entry
+        self.max_bytes:int = int(max_bytes) # (int) max total size of all entries
+        self.n_hits:int = 0 # (int) just for reporting
+        self.n_misses:int = 0 # (int) just for reporting
+
+    def key(self, kind:str, node_activations:torch.Tensor) -> str:
+        """
+        Inputs
+        ======
+        kind             - (char) encoding name + hash of the graph and filter (see HNetEnergy.edge_features)
+        node_activations - n_pts x n_nodes (Tensor) binary
+
+        Returns
+        =======
+        key - (char) hex digest
+        """
+        if node_activations.is_sparse: # hashing the active nodes' coordinates avoids densifying
+            node_activations = node_activations.coalesce()
+            bits = node_activations.indices()[:,node_activations.values() != 0].numpy()
+            kind = kind + "sparse"
         else:
-            raise Exception("unexpected layout")
-        
+            bits = np.packbits(node_activations.detach().cpu().numpy() != 0, axis=1) # canonical regardless of dtype
+        digest = hashlib.blake2b(kind.encode(), digest_size=20)
+        digest.update(np.array(node_activations.shape, dtype=np.int64).tobytes())
+        digest.update(bits.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key:str) -> torch.Tensor:
+        """returns the cached entry, or None"""
+        path = os.path.join(self.cache_dir, key)
+        try:
+            if os.path.exists(path + ".npz"): # bool, bit-packed
+                with np.load(path + ".npz") as f:
+                    shape = tuple(f["shape"])
+                    x = np.unpackbits(f["bits"], count=int(np.prod(shape))).reshape(shape).astype(bool)
+                path = path + ".npz"
+            else:
+                x = np.load(path + ".npy")
+                path = path + ".npy"
+        except (FileNotFoundError, ValueError, OSError): # missing, or evicted/being replaced by another process
+            return None
+        try:
+            os.utime(path) # mark as recently used
+        except OSError:
+            pass
+        return torch.from_numpy(x)
+
+    def put(self, key:str, x:torch.Tensor) -> None:
+        """adds an entry (atomically, so concurrent readers never see a partial file), then evicts the least recently used entries if over max_bytes"""
+        x = x.detach().cpu().numpy()
+        ext = ".npz" if x.dtype == bool else ".npy"
+        path = os.path.join(self.cache_dir, key + ext)
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "wb") as f:
+            if x.dtype == bool:
+                np.savez(f, bits=np.packbits(x.ravel()), shape=np.array(x.shape, dtype=np.int64))
+            else:
+                np.save(f, x)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def get_or_compute(self, kind:str, node_activations:torch.Tensor, compute) -> torch.Tensor:
+        """returns the cached encoding of node_activations, or computes (and caches) it as compute(node_activations)"""
+        key = self.key(kind, node_activations)
+        x = self.get(key)
+        if x is not None:
+            self.n_hits += 1
+            return x
+        self.n_misses += 1
+        x = compute(node_activations)
+        self.put(key, x)
         return x
 
+    def evict(self) -> None:
+        """deletes the least recently used entries until the total size is at most max_bytes"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy") or entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self) -> None:
+        """deletes every entry"""
+        max_bytes = self.max_bytes
+        self.max_bytes = -1
+        self.evict()
+        self.max_bytes = max_bytes
+
+
+class HNetRowCache:
+    """
+    in-memory memoization of a model's output for each distinct (binary) input row (see set_row_cache)
+    each call evaluates only the distinct rows of its minibatch and scatters their outputs back to the duplicates; this is exact for any model, since duplicate rows don't change a batch's normalization offsets
+    once every bank is calibrated (see calibrate_energy_offsets), so that a row's output no longer depends on the rest of its batch, the outputs of up to max_rows rows are also kept across calls, evicting the least recently used
+    rows are keyed by their bit-packed node activations (exact, not a digest); cached outputs are dropped whenever the model's offsets, readout or energy modules change
+    """
+    def __init__(self, max_rows:int=2**16):
+        self.max_rows:int = int(max_rows) # (int) max number of cached rows; 0 = only deduplicate within each call
+        self.entries:collections.OrderedDict = collections.OrderedDict() # (OrderedDict) packed row (bytes) --> output row (Tensor), least recently used first
+        self.state:tuple = None # (tuple) what the cached outputs were computed with (see model_state); holds references to the modules, so they can't be collected and have their ids reused
+        self.n_rows:int = 0 # (int) number of rows evaluated through the cache, just for reporting
+        self.n_duplicates:int = 0 # (int) number of rows that repeated an earlier row of the same call, just for reporting
+        self.n_hits:int = 0 # (int) number of distinct rows found in the cache, just for reporting
+        self.n_misses:int = 0 # (int) number of distinct rows the model evaluated, just for reporting
+        self.n_evictions:int = 0 # (int) just for reporting
+        assert self.max_rows >= 0
+
+    def hit_rate(self) -> float:
+        """fraction of rows that weren't evaluated by the model (in-call duplicates + cache hits)"""
+        return (self.n_rows - self.n_misses) / max(1, self.n_rows)
+
+    def summary(self) -> str:
+        """one line of counters"""
+        return "{} rows: {} in-call duplicates, {} cache hits, {} evaluated ({:.1%} not evaluated), {} cached, {} evicted".format(self.n_rows, self.n_duplicates, self.n_hits, self.n_misses, self.hit_rate(), len(self.entries), self.n_evictions)
+
+    def clear(self) -> None:
+        """drops every cached row (the counters are kept)"""
+        self.entries.clear()
+
+    @staticmethod
+    def model_state(model:"HNetModel") -> tuple:
+        """identifies everything besides the input row that a model's output depends on; None if some bank normalizes by its own batch"""
+        offsets = tuple(compbank.energy.energy_offset for compbank in model.compbank_order)
+        if any(offset is None for offset in offsets):
+            return None
+        return (offsets, tuple(compbank.energy for compbank in model.compbank_order), model.readout) # (the modules themselves, not their id()s, which python reuses once they're garbage collected)
+
+    @staticmethod
+    def is_same_state(state1:tuple, state2:tuple) -> bool:
+        """true if two model_state()s are equal: the same offsets, and the very same energy and readout modules"""
+        if state1 is None or state2 is None:
+            return state1 is state2
+        offsets1, energies1, readout1 = state1
+        offsets2, energies2, readout2 = state2
+        return offsets1 == offsets2 and len(energies1) == len(energies2) and all(e1 is e2 for e1, e2 in zip(energies1, energies2)) and readout1 is readout2
+
+    def get_or_compute(self, model:"HNetModel", x:torch.Tensor) -> torch.Tensor:
+        """
+        Inputs
+        ======
+        model - (HNetModel)
+        x     - n_pts x n_nodes (Tensor[single]) dense or sparse COO binary sensory input
+
+        Returns
+        =======
+        output - n_pts x n_out (Tensor[single]) same as model.forward_rows(x)
+        """
+        if x.shape[0] == 0:
+            return model.forward_rows(x)
+        keys = _packed_row_keys(x)
+        _, uniq_idx, inverse = np.unique(keys, return_index=True, return_inverse=True) # distinct rows (by first occurrence)
+        inverse = torch.as_tensor(inverse.reshape(-1), dtype=torch.int64)
+        uniq_idx = torch.as_tensor(uniq_idx, dtype=torch.int64)
+        self.n_rows += x.shape[0]
+        self.n_duplicates += x.shape[0] - uniq_idx.shape[0]
+
+        state = self.model_state(model) if self.max_rows > 0 else None
+        if not self.is_same_state(state, self.state):
+            self.entries.clear()
+            self.state = state
+        if state is None: # batch-dependent outputs: deduplicate only
+            self.n_misses += uniq_idx.shape[0]
+            return model.forward_rows(x.index_select(0, uniq_idx))[inverse]
+
+        uniq_keys = [keys[i].tobytes() for i in uniq_idx.tolist()]
+        rows = [self.entries.get(key) for key in uniq_keys]
+        miss = [i for i, row in enumerate(rows) if row is None]
+        self.n_hits += len(rows) - len(miss)
+        self.n_misses += len(miss)
+        for key, row in zip(uniq_keys, rows):
+            if row is not None:
+                self.entries.move_to_end(key)
+        if len(miss) > 0:
+            output = model.forward_rows(x.index_select(0, uniq_idx[miss]))
+            for i, row in zip(miss, output):
+                rows[i] = row.clone() # (not a view of the whole minibatch's output)
+                self.entries[uniq_keys[i]] = rows[i]
+            while len(self.entries) > self.max_rows:
+                self.entries.popitem(last=False)
+                self.n_evictions += 1
+        return torch.stack(rows)[inverse]
+
+
+class HNetProfiler:
+    """
+    opt-in instrumentation of a model's calls (see set_profiler): wall time, throughput, tensor sizes and peak memory of each component bank's stages
+    stages are "bank" (all of one bank's work), and within it "energy" (scoring, including "edges" = edge extraction, for the edge-based energy modes), "normalization" and "nonlinearity"; "forward" (bank "model") is a whole call to the model, and "calibration" is one minibatch of calibrate_energy_offsets() for one bank
+    also labels each stage for torch.profiler, and can write a trace file viewable in chrome://tracing or https://ui.perfetto.dev (see write_trace)
+    records calls made in this process and thread only (not by evaluate_parallel's workers)
+    """
+    def __init__(self, max_events:int=10**6):
+        self.max_events:int = int(max_events) # (int) max trace events kept (the stats keep counting after that)
+        self.reset()
+
+    def reset(self) -> None:
+        """discards everything recorded so far"""
+        self.totals:dict = {} # (bank, stage) --> dict of totals over all calls
+        self.events:list = [] # trace events (chrome trace event format)
+        self.n_dropped_events:int = 0 # (int) events not kept because of max_events
+        self.stack:list = [] # list of _HNetProfilerStage currently open, innermost last
+        self.t0:float = time.perf_counter() # (float) trace time 0
+
+    def stage(self, stage:str, x, bank:str=None):
+        """returns a context manager that records one stage; bank defaults to that of the enclosing stage"""
+        return _HNetProfilerStage(self, stage, x, bank)
+
+    def stats(self) -> dict:
+        """
+        Returns
+        =======
+        stats - dict of bank name --> dict of stage --> dict with:
+            n_calls               - (int)
+            n_datapoints          - (int) total over calls
+            seconds               - (float) total wall time
+            self_seconds          - (float) total wall time not spent in a nested stage (e.g. "energy" minus "edges")
+            datapoints_per_second - (float)
+            input_bytes           - (int) total size of the inputs
+            output_bytes          - (int) total size of the outputs (for stages that report them)
+            max_input_shape       - (list) shape of the largest input
+            peak_rss_mb           - (float) the process's peak resident memory as of the end of the stage (max over calls)
+            peak_rss_growth_mb    - (float) total amount by which the stage raised the process's peak resident memory
+        """
+        stats = {}
+        for (bank, stage), total in self.totals.items():
+            stats.setdefault(bank, {})[stage] = dict(total, datapoints_per_second=total["n_datapoints"] / max(total["seconds"], 1e-9))
+        return stats
+
+    def summary(self) -> str:
+        """returns a table of the stats, slowest (by self time) first"""
+        lines = ["{:<24} {:<14} {:>8} {:>12} {:>12} {:>14} {:>10}".format("bank", "stage", "calls", "seconds", "self_sec", "datapoints/s", "peak_mb")]
+        for (bank, stage), total in sorted(self.totals.items(), key=lambda item: -item[1]["self_seconds"]):
+            lines.append("{:<24} {:<14} {:>8} {:>12.4f} {:>12.4f} {:>14.0f} {:>10.1f}".format(bank, stage, total["n_calls"], total["seconds"], total["self_seconds"],
+                         total["n_datapoints"] / max(total["seconds"], 1e-9), total["peak_rss_mb"]))
+        return "\n".join(lines)
+
+    def write_trace(self, filename:str) -> None:
+        """writes the recorded stages as a chrome trace event file (json), viewable in chrome://tracing or https://ui.perfetto.dev"""
+        with open(filename, "w") as f:
+            json.dump({"traceEvents":self.events, "displayTimeUnit":"ms", "otherData":{"n_dropped_events":self.n_dropped_events}}, f)
+
+    def record(self, stage) -> None:
+        """adds a finished _HNetProfilerStage to the totals and the trace"""
+        key = (stage.bank, stage.stage)
+        if key not in self.totals:
+            self.totals[key] = dict(n_calls=0, n_datapoints=0, seconds=0.0, self_seconds=0.0, input_bytes=0, output_bytes=0, max_input_shape=[], peak_rss_mb=0.0, peak_rss_growth_mb=0.0)
+        total = self.totals[key]
+        total["n_calls"] += 1
+        total["n_datapoints"] += stage.n_pts
+        total["seconds"] += stage.seconds
+        total["self_seconds"] += stage.seconds - stage.child_seconds
+        total["input_bytes"] += stage.input_bytes
+        total["output_bytes"] += stage.output_bytes
+        if np.prod(stage.input_shape) >= np.prod(total["max_input_shape"]) or len(total["max_input_shape"]) == 0:
+            total["max_input_shape"] = stage.input_shape
+        total["peak_rss_mb"] = max(total["peak_rss_mb"], stage.peak_rss_mb)
+        total["peak_rss_growth_mb"] += stage.peak_rss_growth_mb
+        if len(self.events) < self.max_events:
+            self.events.append({"name":stage.bank + ":" + stage.stage, "cat":stage.stage, "ph":"X", "pid":os.getpid(), "tid":threading.get_ident(),
+                                "ts":(stage.start - self.t0) * 1e6, "dur":stage.seconds * 1e6, # microseconds
+                                "args":{"n_pts":stage.n_pts, "input_shape":stage.input_shape, "input_bytes":stage.input_bytes, "output_bytes":stage.output_bytes, "peak_rss_mb":stage.peak_rss_mb}})
+        else:
+            self.n_dropped_events += 1
+
+
+class _HNetProfilerStage:
+    """one stage being recorded by an HNetProfiler (or, if profiler is None, a no-op)"""
+    def __init__(self, profiler:HNetProfiler, stage:str, x, bank:str=None):
+        self.profiler:HNetProfiler = profiler
+        self.stage:str = stage
+        self.x = x # (Tensor) input, until the stage starts
+        self.bank:str = bank
+
+    def __enter__(self):
+        if self.profiler is None:
+            return self
+        if self.bank is None:
+            self.bank = self.profiler.stack[-1].bank if len(self.profiler.stack) > 0 else "model"
+        self.n_pts:int = int(self.x.shape[0])
+        self.input_shape:list = list(self.x.shape)
+        self.input_bytes:int = _tensor_bytes(self.x)
+        self.output_bytes:int = 0
+        self.child_seconds:float = 0.0
+        self.x = None
+        self.peak_rss_mb:float = _peak_rss_mb()
+        self.torch_label = torch.autograd.profiler.record_function(self.bank + ":" + self.stage) # (shows up in torch.profiler traces too)
+        self.torch_label.__enter__()
+        self.profiler.stack.append(self)
+        self.start:float = time.perf_counter()
+        return self
+
+    def set_output(self, y) -> None:
+        if self.profiler is not None:
+            self.output_bytes = _tensor_bytes(y)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler is None:
+            return False
+        self.seconds:float = time.perf_counter() - self.start
+        self.profiler.stack.pop()
+        self.torch_label.__exit__(exc_type, exc_value, traceback)
+        if len(self.profiler.stack) > 0:
+            self.profiler.stack[-1].child_seconds += self.seconds
+        peak_rss_mb = _peak_rss_mb()
+        self.peak_rss_growth_mb:float = peak_rss_mb - self.peak_rss_mb
+        self.peak_rss_mb = peak_rss_mb
+        self.profiler.record(self)
+        return False
+
+
+_NULL_PROFILER_STAGE = _HNetProfilerStage(None, "", None) # (shared, so an unprofiled call costs one attribute check per stage)
+
 
 # === FILE-PRIVATE FUNCTIONS ===
 
@@ -327,7 +1347,7 @@ def _load_dataset(filename:str):
 
     Inputs
     ======
-    filename - (str) full file name including path, for a file exported from training, ending in ".dataset.json" or similar
+    filename - (str) full file name including path, for a file exported from training, ending in ".dataset.json" (or ".dataset.bin", see convert_json_to_bin)
         format: {
             "comment": "<text notes>",
             "name": "<name of dataset>",
@@ -337,119 +1357,879 @@ def _load_dataset(filename:str):
             <other metadata, depending on dataset>
         }
     """
-    assert filename.endswith(".dataset.json")
+    assert filename.endswith(".dataset.json") or filename.endswith(".dataset.bin")
     assert os.path.exists(filename), "file " + filename + " must exist"
-    with open(filename, "r") as f:
-        dataset = json.load(f)
+    if filename.endswith(".dataset.bin"):
+        dataset = _read_bin(filename)
+    else:
+        with open(filename, "r") as f:
+            dataset = json.load(f)
     assert type(dataset["comment"]) is str
     assert type(dataset["name"]) is str
     assert type(dataset["split"]) is str
-    data = np.array(dataset["data"], np.single)
+    if filename.endswith(".dataset.bin") and "data_packbits" in dataset: # bit-packed rows (see pytorch_hnet_data.write_dataset_bin)
+        data = np.unpackbits(dataset["data_packbits"], axis=1, count=dataset["n_nodes"], bitorder="little").view(bool)
+    elif filename.endswith(".dataset.bin"):
+        data = dataset["data"] # memory-mapped, not copied (it's converted to single one minibatch at a time by evaluate_streaming)
+    else:
+        data = np.array(dataset["data"], np.single)
     label_idx = np.array(dataset["label_idx"], np.single)
     return data, label_idx
 
 
-def _filter_edge_type(edgestates:torch.Tensor, edge_type_filter:torch.Tensor):
+def _load_h(compbank_info:dict) -> torch.Tensor:
     """
-    filter edges, setting all to n/a except those listed in edgeTypeFilter
-    modifies edgestates
-    INPUTS
-        edgestates - ? x n_edges (Tensor[int64]) ...
-        edge_type_filter - ? x 1 (Tensor[int64]) ...
+    loads the composite Hamiltonians of one component bank from a model file's dict, preferring the sparse "h_coo" field if present
+
+    Inputs
+    ======
+    compbank_info - (dict) one entry of the model file's "layout" list
+
+    Returns
+    =======
+    h - n_cmp x n_nodes x n_nodes (Tensor) sparse COO if loaded from h_coo, else dense
     """
-    # e.g. with fully connected, there are SOOO many NCONV and NIMPL edges, so we just do AND
-    if edge_type_filter.shape[0] > 0:
-        mask = torch.zeros(edgestates.shape, dtype=torch.bool)
-        for i in range(edge_type_filter.shape[0]):
-            mask = mask | (edgestates == edge_type_filter[i])
-        edgestates[torch.logical_not(mask)] = EDG_NULL
+    if not _is_h_coo(compbank_info):
+        return torch.as_tensor(compbank_info["h"], dtype=torch.float)
+    n_cmp = len(compbank_info["k"])
+    n_nodes = int(compbank_info["n_nodes"])
+    h_coo = torch.reshape(torch.as_tensor(compbank_info["h_coo"], dtype=torch.int64), (-1,4)) # (a single nonzero is exported by matlab as a flat list)
+    return torch.sparse_coo_tensor(h_coo[:,0:3].T, h_coo[:,3].to(torch.float), (n_cmp,n_nodes,n_nodes), check_invariants=True)
+
+
+def _is_h_coo(compbank_info:dict) -> bool:
+    """true if a bank's composite Hamiltonians are stored in its "h_coo" field: a non-empty one, or an empty one (with n_nodes) instead of a dense h, which Export2JSON.m writes for a bank whose every H is all zeros"""
+    return len(compbank_info.get("h_coo", [])) > 0 or ("h_coo" in compbank_info and "n_nodes" in compbank_info and len(compbank_info.get("h", [])) == 0)
+
 
+def _has_h(compbank_info:dict) -> bool:
+    """true if a bank's dict carries its composite Hamiltonians (as a non-empty dense h, or as h_coo, see _is_h_coo)"""
+    return len(compbank_info.get("h", [])) > 0 or _is_h_coo(compbank_info)
 
-def _get_edge_states(data:torch.Tensor, didx:torch.Tensor, edge_type_filter:torch.Tensor) -> torch.Tensor:
+
+def _complete_compbank_info(compbank_info:dict, is_h_needed:bool) -> dict:
+    """returns the bank's dict as is, or for a compact model file, with the fields derived from its graph metadata filled in (see pytorch_hnet_graph.complete_compbank_info)"""
+    if all(key in compbank_info for key in ("h","k","edge_endnode_idx")) and (_has_h(compbank_info) or not is_h_needed):
+        return compbank_info
+    import pytorch_hnet_graph # (here rather than at the top, since it imports this module)
+    return pytorch_hnet_graph.complete_compbank_info(compbank_info, is_h_needed)
+
+
+def _write_bin(filename:str, info:dict) -> None:
     """
-    ...
+    writes a dict to our binary container format: a small json header followed by raw, 64-byte-aligned arrays
+        magic (8 bytes) | header length (uint64, little-endian) | json header | padding | arrays
+    any ndarray in info (at any depth of nested dicts/lists) is stored as raw bytes and replaced in the header by {"__array__": {"dtype", "shape", "offset"}}, offset relative to the first array
 
     Inputs
     ======
-    data             - n x n_nodes (Tensor[bool]) node activations
-    didx             - n_edges x 2 (Tensor[int64]) numeric index
-    edge_type_filter - ? x 1 (Tensor[int64])
-    
-    Returns
-    =======
-    edgestates - n x n_edges (EDG enum)
+    filename - (str)
+    info     - (dict) json-compatible, except that it may contain ndarrays
     """
-    n = data.shape[0]
-    n_edges = didx.shape[0]
-    assert torch.all((data == 0) | (data == 1))
-    
-    temp = torch.multiply(data[:,didx[:,0]], 2) + data[:,didx[:,1]]
-    edgestates = torch.zeros((n,n_edges), dtype=torch.uint8)
-    
-    edgestates[temp == 0] = EDG_NOR
-    edgestates[temp == 1] = EDG_NCONV
-    edgestates[temp == 2] = EDG_NIMPL
-    edgestates[temp == 3] = EDG_AND
+    arrays = []
+    def replace_arrays(x):
+        if isinstance(x, np.ndarray):
+            offset = sum(_align_bin(arr.nbytes) for arr in arrays)
+            arrays.append(np.ascontiguousarray(x))
+            return {"__array__": {"dtype": x.dtype.str, "shape": list(x.shape), "offset": offset}}
+        elif isinstance(x, dict):
+            return {key: replace_arrays(val) for key, val in x.items()}
+        elif isinstance(x, list):
+            return [replace_arrays(val) for val in x]
+        return x
+    header_bytes = json.dumps(replace_arrays(info)).encode("utf-8")
+    data_start = _align_bin(16 + len(header_bytes))
 
-    _filter_edge_type(edgestates, edge_type_filter)
-    return edgestates
+    with open(filename, "wb") as f:
+        f.write(_BIN_MAGIC)
+        f.write(np.uint64(len(header_bytes)).astype("<u8").tobytes())
+        f.write(header_bytes)
+        f.write(b"\0" * (data_start - 16 - len(header_bytes)))
+        for arr in arrays:
+            f.write(arr.tobytes())
+            f.write(b"\0" * (_align_bin(arr.nbytes) - arr.nbytes))
 
 
-def _edge_to_logical(x:torch.Tensor, do_include_null:bool, do_include_all_16:bool) -> torch.Tensor:
+def _read_bin(filename:str) -> dict:
     """
-    ...
+    reads a file written by _write_bin(); arrays are memory-mapped copy-on-write (zero-copy, paged in lazily by the OS, never written back)
 
     Inputs
     ======
-    x                 - n_pts x n_edges (categorical Tensor[int64]) ...
-    do_include_null   - OPTIONAL scalar (bool) ...
-    do_include_all_16 - OPTIONAL scalar (bool) ...
+    filename - (str)
 
     Returns
     =======
-    y - n_pts x n_edges*const (Tensor[bool])
+    info - (dict) with each array as an np.memmap (or an empty ndarray)
     """
-    n_pts, n_edges = x.shape
-
-    if do_include_all_16 and do_include_null:
-        n_edge_types = len(UNIQ_EDGE_TYPES)
-    elif do_include_all_16 and not do_include_null:
-        n_edge_types = len(UNIQ_EDGE_TYPES)-1
-    elif not do_include_all_16 and do_include_null:
-        n_edge_types = 5
-    elif not do_include_all_16 and not do_include_null:
-        n_edge_types = 4
-
-    y = torch.zeros((n_edge_types,n_pts,n_edges), dtype=torch.bool)
-
-    if do_include_all_16 and do_include_null:
-        for i in range(len(UNIQ_EDGE_TYPES)):
-            y[i,:,:] = (x == UNIQ_EDGE_TYPES[i])
-    elif do_include_all_16 and not do_include_null:
-        for i in range(1, len(UNIQ_EDGE_TYPES)): # skip EDG_NULL
-            y[i-1,:,:] = (x == UNIQ_EDGE_TYPES[i])
-    elif not do_include_all_16 and do_include_null:
-        y[0,:,:] = (x == EDG_NULL)
-        y[1,:,:] = (x == EDG_NOR)
-        y[2,:,:] = (x == EDG_NCONV)
-        y[3,:,:] = (x == EDG_NIMPL)
-        y[4,:,:] = (x == EDG_AND)
-    elif not do_include_all_16 and not do_include_null:
-        y[0,:,:] = (x == EDG_NOR)
-        y[1,:,:] = (x == EDG_NCONV)
-        y[2,:,:] = (x == EDG_NIMPL)
-        y[3,:,:] = (x == EDG_AND)
-    
-    y = torch.permute(y, [1,0,2]) # TODO correct permutation???
-    y = torch.reshape(y, (n_pts,n_edge_types*n_edges))
-    return y
+    with open(filename, "rb") as f:
+        assert f.read(8) == _BIN_MAGIC, "file " + filename + " is not an hnet binary file"
+        header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    data_start = _align_bin(16 + header_len)
+    def load_arrays(x):
+        if isinstance(x, dict):
+            if "__array__" in x:
+                dtype = np.dtype(x["__array__"]["dtype"])
+                shape = tuple(x["__array__"]["shape"])
+                if np.prod(shape) == 0: # can't memmap zero bytes
+                    return np.zeros(shape, dtype)
+                return np.memmap(filename, dtype=dtype, mode="c", offset=data_start+x["__array__"]["offset"], shape=shape)
+            return {key: load_arrays(val) for key, val in x.items()}
+        elif isinstance(x, list):
+            return [load_arrays(val) for val in x]
+        return x
+    return load_arrays(header)
 
 
-# === CALLABLE FUNCTIONS ===
+def _align_bin(n_bytes:int) -> int:
+    return (n_bytes + _BIN_ALIGNMENT - 1) // _BIN_ALIGNMENT * _BIN_ALIGNMENT
 
 
-def construct_hnet_model_from_json(filename:str, energy_mode:str) -> HNetModel:
-    """
+def _validate_model_info(model_info:dict) -> dict:
+    """validates a model dict loaded from file (lists or ndarrays are accepted wherever the json has lists), and corrects typos"""
+    # validate file validity
+    assert type(model_info["comment"]) is str
+    assert type(model_info["layout"]) is list
+    assert type(model_info["links"]) is str
+    for compbank in model_info["layout"]:
+        assert type(compbank["name"]) is str
+        assert isinstance(compbank.get("h", []), (list,np.ndarray))
+        assert isinstance(compbank.get("h_coo", []), (list,np.ndarray))
+        assert isinstance(compbank.get("k", []), (list,np.ndarray))
+        assert isinstance(compbank["learned_edge_states"], (list,np.ndarray))
+        assert isinstance(compbank.get("edge_endnode_idx", []), (list,np.ndarray))
+        assert "graph_type" in compbank or all(key in compbank for key in ("h","k","edge_endnode_idx")) # (compact model files have graph metadata instead; see pytorch_hnet_graph.py)
+        assert isinstance(compbank["edge_type_filter"], (list,np.ndarray))
+        assert type(compbank["nonlinearity_mode"]) is str
+        assert type(compbank["n_winners"]) is int
+
+    # correct types and typos
+    model_info["links"] = _remove_whitespace(model_info["links"].lower())
+    for i in range(len(model_info["layout"])):
+        model_info["layout"][i]["name"] = _remove_whitespace(model_info["layout"][i]["name"].lower())
+        model_info["layout"][i]["nonlinearity_mode"] = _remove_whitespace(model_info["layout"][i]["nonlinearity_mode"].lower())
+        if model_info["layout"][i]["nonlinearity_mode"] == "wta": # as exported by Export2JSON.m
+            model_info["layout"][i]["nonlinearity_mode"] = "kwta"
+    return model_info
+
+
+def _compile_links(links:str, names:list) -> tuple:
+    """
+    parses a model's links (e.g. "sense-->tier1,tier1-->meta,meta-->out") into an execution plan
+    as in Model.m, each component bank has exactly one input; banks may fan out to any number of downstream banks
+
+    Inputs
+    ======
+    links - (char) comma-separated list of src-->dst, where src and dst are "sense", "out", a bank name, or an index into the layout list
+    names - list of (char) bank names, in layout order
+
+    Returns
+    =======
+    plan    - list of (dst, src) bank indices in topological order (src = -1 for the sensory input); banks not downstream of "sense" are not run
+    out_idx - list of (int) indices of the banks linked to "out", in link order
+    """
+    def resolve(token:str) -> int:
+        if token == "sense":
+            return -1
+        if token in names:
+            return names.index(token)
+        if token.isdigit() and int(token) < len(names):
+            return int(token)
+        raise Exception("unexpected component bank in links: " + token)
+
+    input_of = {} # bank idx --> src idx
+    out_idx = []
+    for link in links.split(","):
+        if link == "":
+            continue
+        srcdst = link.split("-->")
+        if len(srcdst) != 2 or srcdst[0] == "out" or srcdst[1] == "sense":
+            raise Exception("unexpected link: " + link)
+        src = resolve(srcdst[0])
+        if srcdst[1] == "out":
+            if src < 0:
+                raise Exception("the sensory input can't be linked directly to out")
+            out_idx.append(src)
+            continue
+        dst = resolve(srcdst[1])
+        if dst in input_of:
+            raise Exception("only one input per component bank is supported: " + names[dst])
+        input_of[dst] = src
+
+    plan = []
+    frontier = [-1]
+    while len(frontier) > 0: # breadth-first from the sensory input (with one input per bank, anything reachable is acyclic)
+        src = frontier.pop(0)
+        for dst in sorted(input_of.keys()):
+            if input_of[dst] == src:
+                plan.append((dst, src))
+                frontier.append(dst)
+    if len(out_idx) == 0:
+        raise Exception("no component bank is linked to out")
+    for idx in out_idx:
+        if idx not in [dst for dst,_ in plan]:
+            raise Exception("component bank linked to out isn't downstream of sense: " + names[idx])
+    return (plan, out_idx)
+
+
+def _iter_batches(data, batch_size:int):
+    """
+    splits data into minibatches of (at most) batch_size datapoints, without ever densifying more than one minibatch
+
+    Inputs
+    ======
+    data       - (ndarray|Tensor|np.memmap|scipy.sparse matrix) n_pts x n_nodes, or an iterable of ? x n_nodes minibatches (re-chunked to batch_size)
+    batch_size - (int)
+
+    Returns
+    =======
+    generator of n x n_nodes (Tensor[single]) sparse COO if data is sparse, else dense (see _as_node_activations)
+    """
+    assert batch_size > 0
+    if isinstance(data, torch.Tensor) and data.layout != torch.strided: # torch sparse: convert once, then slice
+        data = _as_node_activations(data)
+        for i in range(0, data.shape[0], batch_size):
+            yield _row_range(data, i, min(i+batch_size, data.shape[0]))
+        return
+    if hasattr(data, "shape") and len(data.shape) == 2: # array-like: slice it
+        for i in range(0, data.shape[0], batch_size):
+            yield _as_node_activations(data[i:i+batch_size])
+        return
+    buffer = []
+    n_buffered = 0
+    for x in data: # iterable of minibatches
+        x = _as_node_activations(x)
+        buffer.append(x)
+        n_buffered += x.shape[0]
+        while n_buffered >= batch_size:
+            x = torch.cat(buffer, dim=0)
+            yield _row_range(x, 0, batch_size)
+            buffer = [_row_range(x, batch_size, x.shape[0])]
+            n_buffered -= batch_size
+    if n_buffered > 0:
+        yield torch.cat(buffer, dim=0)
+
+
+def _as_node_activations(x) -> torch.Tensor:
+    """
+    converts one minibatch of node activations to the model's input type
+    sparse input (scipy.sparse, or torch sparse COO / CSR / CSC) stays sparse, so the energy modules can skip inactive nodes (see _get_edge_codes, HNetEnergyViaHamiltonian)
+
+    Inputs
+    ======
+    x - n x n_nodes (ndarray|Tensor|np.memmap|scipy.sparse matrix)
+
+    Returns
+    =======
+    x - n x n_nodes (Tensor[single]) coalesced sparse COO without explicit zeros if x was sparse, else dense
+    """
+    if hasattr(x, "tocoo"): # scipy.sparse: canonical CSR (sorted, no duplicates, no zeros) is already in coalesced COO order, so skip torch's coalesce()
+        x = scipy.sparse.csr_matrix(x, dtype=np.single, copy=True)
+        x.sum_duplicates()
+        x.eliminate_zeros()
+        x = x.tocoo()
+        return torch.sparse_coo_tensor(torch.as_tensor(np.vstack((x.row, x.col)), dtype=torch.int64), torch.as_tensor(x.data), x.shape, is_coalesced=True)
+    if isinstance(x, torch.Tensor) and x.layout != torch.strided:
+        x = x.to_sparse_coo()
+    else:
+        return torch.as_tensor(np.asarray(x), dtype=torch.float)
+    x = x.coalesce()
+    is_nonzero = x.values() != 0
+    return torch.sparse_coo_tensor(x.indices()[:,is_nonzero], x.values()[is_nonzero].to(torch.float), x.shape, is_coalesced=True)
+
+
+def _row_range(x:torch.Tensor, start:int, stop:int) -> torch.Tensor:
+    """x[start:stop], for dense or sparse COO x"""
+    if x.is_sparse:
+        return x.narrow_copy(0, start, stop - start)
+    return x[start:stop]
+
+
+def _profile(profiler:HNetProfiler, stage:str, x, bank:str=None):
+    """returns a context manager recording one stage with profiler (see HNetProfiler), or a no-op one if profiler is None"""
+    if profiler is None:
+        return _NULL_PROFILER_STAGE
+    return profiler.stage(stage, x, bank)
+
+
+def _tensor_bytes(x) -> int:
+    """size of a (dense or sparse COO) tensor's data, in bytes; 0 for anything else"""
+    if not isinstance(x, torch.Tensor):
+        return 0
+    if x.is_sparse:
+        return x._indices().numel() * x._indices().element_size() + x._values().numel() * x._values().element_size()
+    return x.numel() * x.element_size()
+
+
+def _peak_rss_mb() -> float:
+    """peak resident memory of this process so far, in MB (0 where the resource module isn't available)"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10 # bytes on mac, KB on linux
+
+
+def _hash_tensors(*tensors:torch.Tensor) -> str:
+    """returns a hex digest of the tensors' dtypes, shapes and contents"""
+    digest = hashlib.blake2b(digest_size=20)
+    for x in tensors:
+        x = x.detach().cpu().contiguous()
+        digest.update((str(x.dtype) + str(tuple(x.shape))).encode())
+        digest.update(x.numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _share_memory(model:nn.Module) -> None:
+    """moves every tensor held by the model (including plain tensor attributes, not just parameters and buffers) into shared memory, in place"""
+    model.share_memory() # parameters and buffers
+    for module in model.modules():
+        for val in vars(module).values():
+            if isinstance(val, torch.Tensor):
+                val.share_memory_()
+
+
+# worker process state for evaluate_parallel()
+_worker_model:HNetModel = None
+_worker_data = None # (Tensor|scipy.sparse.csr_matrix)
+
+
+def _parallel_worker_init(model:HNetModel, data, n_threads:int) -> None:
+    global _worker_model, _worker_data
+    torch.set_num_threads(n_threads)
+    torch.set_float32_matmul_precision("high")
+    _worker_model = model
+    _worker_data = data
+
+
+def _parallel_worker_set_offsets(offsets:list) -> None:
+    """sets the first len(offsets) banks' energy offsets, and leaves the rest per-batch"""
+    for i, compbank in enumerate(_worker_model.compbank_order):
+        compbank.energy.energy_offset = offsets[i] if i < len(offsets) else None
+
+
+def _parallel_worker_offset(task:tuple) -> float:
+    """returns the raw energy offset of bank len(offsets) over datapoints start:stop"""
+    start, stop, offsets, batch_size = task
+    _parallel_worker_set_offsets(offsets)
+    compbank = _worker_model.compbank_order[len(offsets)]
+    shard_offsets = []
+    with torch.no_grad():
+        for x in _iter_batches(_worker_data[start:stop], batch_size):
+            x = _worker_model.compbank_input(x, len(offsets))
+            shard_offsets.append(compbank.energy.batch_offset(compbank.energy.raw_energies(x)))
+    return float(compbank.energy.batch_offset(torch.stack(shard_offsets)))
+
+
+def _parallel_worker_evaluate(task:tuple) -> np.ndarray:
+    """returns the model's output for datapoints start:stop"""
+    start, stop, offsets, batch_size = task
+    _parallel_worker_set_offsets(offsets)
+    with torch.no_grad():
+        outputs = [_worker_model(x).cpu().numpy() for x in _iter_batches(_worker_data[start:stop], batch_size)]
+    return np.concatenate(outputs, axis=0)
+
+
+def _filter_edge_type(edgestates:torch.Tensor, edge_type_filter:torch.Tensor):
+    """
+    filter edges, setting all to n/a except those listed in edgeTypeFilter
+    modifies edgestates
+    INPUTS
+        edgestates - ? x n_edges (Tensor[int64]) ...
+        edge_type_filter - ? x 1 (Tensor[int64]) ...
+    """
+    # e.g. with fully connected, there are SOOO many NCONV and NIMPL edges, so we just do AND
+    if edge_type_filter.shape[0] > 0:
+        mask = torch.zeros(edgestates.shape, dtype=torch.bool)
+        for i in range(edge_type_filter.shape[0]):
+            mask = mask | (edgestates == edge_type_filter[i])
+        edgestates[torch.logical_not(mask)] = EDG_NULL
+
+
+def _edge_state_lut(edge_type_filter:torch.Tensor) -> tuple:
+    """
+    precomputes the lookup table from a 2-bit node pair (2*src + dst activation) to its filtered edge state
+
+    Inputs
+    ======
+    edge_type_filter - ? x 1 (Tensor[int64])
+
+    Returns
+    =======
+    lut - 4 (tuple of int) EDG enum; plain ints, so branches on it are constant when compiling (see export_compiled_model)
+    """
+    lut = torch.tensor([EDG_NOR,EDG_NCONV,EDG_NIMPL,EDG_AND], dtype=torch.uint8) # 00, 01, 10, 11
+    _filter_edge_type(lut, edge_type_filter)
+    return tuple(int(state) for state in lut)
+
+
+def _grid_edge_coords(didx:torch.Tensor, img_sz:tuple):
+    """
+    locates each edge of a GRF_GRID2D or GRF_GRID2DMULTICHAN graph (see NeighborPairs.m; nodes are pixels in column-major order, then channels)
+
+    Inputs
+    ======
+    didx   - n_edges x 2 (Tensor[int64]) numeric index; any subset of the grid's edges, in any order
+    img_sz - 3 (tuple of int) n_rows, n_cols, n_chan
+
+    Returns
+    =======
+    chan     - n_edges x 1 (Tensor[int64]) channel of each edge
+    is_right - n_edges x 1 (Tensor[bool]) true for edges to the right neighbor, false for edges to the neighbor below
+    row      - n_edges x 1 (Tensor[int64]) row of each edge's first (top or left) node
+    col      - n_edges x 1 (Tensor[int64]) column of each edge's first (top or left) node
+    """
+    n_rows, n_cols, n_chan = img_sz
+    src = torch.minimum(didx[:,0], didx[:,1])
+    dst = torch.maximum(didx[:,0], didx[:,1])
+    chan = torch.div(src, n_rows * n_cols, rounding_mode="floor")
+    row = src % n_rows
+    col = torch.div(src % (n_rows * n_cols), n_rows, rounding_mode="floor")
+    is_right = (dst - src == n_rows) & (col < n_cols - 1)
+    is_down = (dst - src == 1) & (row < n_rows - 1)
+    if not torch.all((is_right | is_down) & (dst < n_rows * n_cols * n_chan)):
+        raise Exception("edge_endnode_idx is not a grid graph of size img_sz")
+    return chan, is_right, row, col
+
+
+def _packed_row_keys(x:torch.Tensor) -> np.ndarray:
+    """
+    Inputs
+    ======
+    x - n x n_nodes (Tensor) dense, or sparse COO with only ones stored (see _as_node_activations)
+
+    Returns
+    =======
+    keys - n (ndarray[void]) each row's node activations, bit-packed into one comparable / hashable value (identical for dense and sparse x)
+    """
+    n_bytes = (x.shape[1] + 7) // 8
+    if x.is_sparse:
+        x = x.coalesce()
+        assert torch.all(x.values() == 1)
+        rows, cols = x.indices().numpy()
+        packed = np.zeros(x.shape[0] * n_bytes, dtype=np.uint8)
+        np.add.at(packed, rows * n_bytes + cols // 8, np.left_shift(1, 7 - cols % 8).astype(np.uint8)) # (each bit is set once, so adding = or-ing; same bit order as np.packbits)
+        packed = packed.reshape(x.shape[0], n_bytes)
+    else:
+        _assert_binary(x)
+        packed = np.packbits(x.detach().cpu().numpy() != 0, axis=1)
+    return np.ascontiguousarray(packed).view(np.dtype((np.void, n_bytes))).reshape(-1)
+
+
+def _assert_binary(data:torch.Tensor) -> None:
+    """checks that every node activation is 0 or 1 (skipped while compiling or exporting, where it would be a data-dependent branch)"""
+    if not torch.compiler.is_compiling():
+        assert torch.all((data == 0) | (data == 1))
+
+
+def _sparse_rows(x:torch.Tensor):
+    """
+    converts a sparse COO matrix to a padded per-row list of its nonzeros
+
+    Inputs
+    ======
+    x - n x m (sparse COO Tensor)
+
+    Returns
+    =======
+    idx - n x max_nnz_per_row (Tensor[int64]) column of each nonzero (padding = 0)
+    val - n x max_nnz_per_row (Tensor) value of each nonzero (padding = 0)
+    """
+    x = x.coalesce() # (sorted by row, then column)
+    rows, cols = x.indices()
+    n_per_row = torch.bincount(rows, minlength=x.shape[0])
+    pos = torch.arange(rows.shape[0]) - (torch.cumsum(n_per_row, dim=0) - n_per_row)[rows] # position of each nonzero within its row
+    max_n = int(torch.max(n_per_row)) if rows.shape[0] > 0 else 0
+    idx = torch.zeros((x.shape[0],max_n), dtype=torch.int64)
+    val = torch.zeros((x.shape[0],max_n), dtype=x.values().dtype)
+    idx[rows,pos] = cols
+    val[rows,pos] = x.values()
+    return idx, val
+
+
+def _get_edge_codes(data:torch.Tensor, didx:torch.Tensor) -> torch.Tensor:
+    """
+    Inputs
+    ======
+    data - n x n_nodes (Tensor[bool]) node activations
+    didx - n_edges x 2 (Tensor[int64]) numeric index
+
+    Returns
+    =======
+    codes - n x n_edges (Tensor[uint8]) 2*src + dst node activation, in 0:3
+    """
+    if data.is_sparse and data._nnz() > _SPARSE_MAX_DENSITY * data.shape[0] * data.shape[1]:
+        data = data.to_dense()
+    if data.is_sparse: # e.g. from HNetKWTA: start from all 00, then set the src / dst bit of each active node's edges
+        data = data.coalesce()
+        assert torch.all(data.values() == 1)
+        pt_idx, node_idx = data.indices()
+        codes = torch.zeros((data.shape[0],didx.shape[0]), dtype=torch.uint8)
+        for endnode, bit in [(0,2), (1,1)]:
+            edge_order = torch.argsort(didx[:,endnode], stable=True) # edges grouped by this endnode
+            ptr = torch.searchsorted(didx[edge_order,endnode], torch.arange(data.shape[1]+1)) # node i's edges are edge_order[ptr[i]:ptr[i+1]]
+            n_edges_per_active = ptr[node_idx+1] - ptr[node_idx]
+            offsets = torch.arange(int(torch.sum(n_edges_per_active))) - torch.repeat_interleave(torch.cumsum(n_edges_per_active, dim=0) - n_edges_per_active, n_edges_per_active)
+            edge_idx = edge_order[torch.repeat_interleave(ptr[node_idx], n_edges_per_active) + offsets]
+            codes[torch.repeat_interleave(pt_idx, n_edges_per_active),edge_idx] += bit # (each edge has one endnode of each kind, so no duplicates)
+        return codes
+    _assert_binary(data)
+    x = data.to(torch.uint8) # n x n_nodes (small, unlike anything n x n_edges)
+    codes = x[:,didx[:,0]]
+    codes.mul_(2).add_(x[:,didx[:,1]])
+    return codes
+
+
+def _get_edge_states(data:torch.Tensor, didx:torch.Tensor, edge_state_lut:tuple) -> torch.Tensor:
+    """
+    ...
+
+    Inputs
+    ======
+    data           - n x n_nodes (Tensor[bool]) node activations
+    didx           - n_edges x 2 (Tensor[int64]) numeric index
+    edge_state_lut - 4 (tuple of int) see _edge_state_lut()
+    
+    Returns
+    =======
+    edgestates - n x n_edges (EDG enum)
+    """
+    return torch.tensor(edge_state_lut, dtype=torch.uint8)[_get_edge_codes(data, didx).to(torch.int32)]
+
+
+def _get_packed_edge_states(data:torch.Tensor, didx:torch.Tensor, edge_state_lut:tuple) -> torch.Tensor:
+    """
+    same as _pack_edge_states(_get_edge_states(data, didx, edge_state_lut)), but computes the bit-planes with bitwise ops on packed words of the two endnodes' activations
+
+    Inputs
+    ======
+    data           - n x n_nodes (Tensor[bool]) node activations
+    didx           - n_edges x 2 (Tensor[int64]) numeric index
+    edge_state_lut - 4 (tuple of int) see _edge_state_lut()
+
+    Returns
+    =======
+    y - n x 4 x ceil(n_edges/64) (Tensor[int64]) bit-planes for EDG_NOR, EDG_NCONV, EDG_NIMPL, EDG_AND
+    """
+    if data.is_sparse:
+        codes = _get_edge_codes(data, didx)
+        src = _pack_bits(codes >= 2) # n x n_words
+        dst = _pack_bits((codes & 1) == 1)
+    else:
+        _assert_binary(data)
+        x = data.to(torch.bool)
+        src = _pack_bits(x[:,didx[:,0]]) # n x n_words
+        dst = _pack_bits(x[:,didx[:,1]])
+    is_edge = _pack_bits(torch.ones(didx.shape[0], dtype=torch.bool)) # n_words (padding bits are 0)
+    minterms = (~src & ~dst & is_edge, ~src & dst, src & ~dst, src & dst) # indexed by 2-bit node pair
+    y = torch.zeros((data.shape[0],4,src.shape[1]), dtype=torch.int64)
+    for code in range(4):
+        for j, state in enumerate([EDG_NOR,EDG_NCONV,EDG_NIMPL,EDG_AND]):
+            if edge_state_lut[code] == state:
+                y[:,j,:] |= minterms[code]
+    return y
+
+
+def _get_logical_edge_states(data:torch.Tensor, didx:torch.Tensor, edge_state_lut:tuple, do_include_null:bool, do_include_all_16:bool) -> torch.Tensor:
+    """
+    same as _edge_to_logical(_get_edge_states(data, didx, edge_state_lut), do_include_null, do_include_all_16), without the intermediate n_edge_types x n x n_edges tensor or its permutation
+
+    Inputs
+    ======
+    data              - n x n_nodes (Tensor[bool]) node activations
+    didx              - n_edges x 2 (Tensor[int64]) numeric index
+    edge_state_lut    - 4 (tuple of int) see _edge_state_lut()
+    do_include_null   - scalar (bool) ...
+    do_include_all_16 - scalar (bool) ...
+
+    Returns
+    =======
+    y - n x n_edges*const (Tensor[bool])
+    """
+    codes = _get_edge_codes(data, didx)
+    edge_types = _logical_edge_types(do_include_null, do_include_all_16)
+    y = torch.zeros((codes.shape[0],len(edge_types),codes.shape[1]), dtype=torch.bool)
+    for code in range(4):
+        state = edge_state_lut[code]
+        if state in edge_types:
+            y[:,edge_types.index(state),:] |= (codes == code)
+    return torch.reshape(y, (codes.shape[0],len(edge_types)*codes.shape[1]))
+
+
+def _identity_premerge_idx(x:torch.Tensor) -> torch.Tensor:
+    """premerge_idx of a nonlinearity that doesn't merge anything: n_pts x n (Tensor[int64]) each output's own index (a broadcast view, not a copy)"""
+    return torch.arange(x.shape[1], device=x.device).expand(x.shape[0], -1)
+
+
+def _group_members(learned_edge_states:torch.Tensor):
+    """
+    precomputes, for each component, the (ascending) list of its non-null edges, padded to a common length
+    used by the max and maxabs nonlinearities, where each component groups the edges (input nodes) it's connected to
+
+    Inputs
+    ======
+    learned_edge_states - n_cmp x n_edges (Tensor) EDG enum
+
+    Returns
+    =======
+    member_idx  - n_cmp x max_n_members (Tensor[int64]) edge index of each group member (padding = 0)
+    member_mask - n_cmp x max_n_members (Tensor[bool]) false for padding
+    """
+    is_member = torch.Tensor(learned_edge_states) != EDG_NULL # n_cmp x n_edges
+    n_members = torch.sum(is_member, dim=1) # n_cmp x 1
+    max_n_members = max(1, int(torch.max(n_members))) if is_member.numel() > 0 else 1
+    member_idx = torch.argsort(torch.logical_not(is_member).to(torch.uint8), dim=1, stable=True)[:,:max_n_members] # members first, in ascending order
+    member_mask = torch.arange(max_n_members)[None,:] < n_members[:,None]
+    member_idx = member_idx.masked_fill(torch.logical_not(member_mask), 0)
+    return member_idx, member_mask
+
+
+def _group_values(x:torch.Tensor, member_idx:torch.Tensor) -> torch.Tensor:
+    """
+    Inputs
+    ======
+    x          - n_pts x n_edges (Tensor)
+    member_idx - n_cmp x max_n_members (Tensor[int64]) from _group_members()
+
+    Returns
+    =======
+    vals - n_pts x n_cmp x max_n_members (Tensor[floating point]) value of each group member
+    """
+    if not torch.is_floating_point(x):
+        x = x.to(torch.float)
+    return x[:,member_idx]
+
+
+def _group_output(newCompCode:torch.Tensor, best:torch.Tensor, member_idx:torch.Tensor, member_mask:torch.Tensor):
+    """
+    maps the position of the winner within each group back to the full list, and zeros out empty groups
+
+    Inputs
+    ======
+    newCompCode - n_pts x n_cmp (Tensor) value of each group's winner
+    best        - n_pts x n_cmp (Tensor[int64]) position of the winner within its group
+    member_idx  - n_cmp x max_n_members (Tensor[int64]) from _group_members()
+    member_mask - n_cmp x max_n_members (Tensor[bool]) from _group_members()
+
+    Returns
+    =======
+    newCompCode  - n_pts x n_cmp (Tensor[single])
+    premerge_idx - n_pts x n_cmp (Tensor[int64])
+    """
+    is_empty = torch.logical_not(member_mask[:,0])[None,:] # 1 x n_cmp
+    premerge_idx = torch.gather(member_idx[None,:,:].expand(best.shape[0],-1,-1), 2, best[:,:,None])[:,:,0]
+    premerge_idx = premerge_idx.masked_fill(is_empty, -1)
+    newCompCode = newCompCode.masked_fill(is_empty, 0).to(torch.float)
+    return newCompCode, premerge_idx
+
+
+def _int8_matmul(a:torch.Tensor, b:torch.Tensor) -> torch.Tensor:
+    """
+    matrix product of two int8 matrices, accumulated in int32 (exact)
+    uses torch's int8 GEMM kernel where available, else a float32 GEMM (also exact, as long as every sum is < 2**24)
+
+    Inputs
+    ======
+    a - n x m (Tensor[int8])
+    b - m x p (Tensor[int8])
+
+    Returns
+    =======
+    c - n x p (Tensor[int32])
+    """
+    if hasattr(torch, "_int_mm"):
+        try:
+            return torch._int_mm(a, b)
+        except RuntimeError: # unsupported device or shape
+            pass
+    assert a.shape[1] < 2**24
+    return torch.matmul(a.to(torch.float), b.to(torch.float)).to(torch.int32)
+
+
+def _pack_bits(x:torch.Tensor) -> torch.Tensor:
+    """
+    packs the last dimension of a boolean tensor into 64-bit words
+
+    Inputs
+    ======
+    x - ... x n_bits (Tensor[bool])
+
+    Returns
+    =======
+    y - ... x ceil(n_bits/64) (Tensor[int64]) zero-padded
+    """
+    n_bits = x.shape[-1]
+    n_words = (n_bits + 63) // 64
+    x = torch.nn.functional.pad(x.to(torch.uint8), (0,n_words*64-n_bits))
+    x = torch.reshape(x, x.shape[:-1] + (n_words*8,8))
+    bit_weights = torch.tensor([1,2,4,8,16,32,64,128], dtype=torch.uint8)
+    y = torch.sum(x * bit_weights, dim=-1, dtype=torch.uint8) # ... x n_words*8 (bytes)
+    return y.contiguous().view(torch.int64)
+
+
+def _pack_edge_states(x:torch.Tensor) -> torch.Tensor:
+    """
+    one-hot encodes edge states into packed bit-planes, one per non-null edge state
+    null edges (and any edge state other than the four below) have no bits set
+
+    Inputs
+    ======
+    x - n x n_edges (categorical Tensor) EDG enum
+
+    Returns
+    =======
+    y - n x 4 x ceil(n_edges/64) (Tensor[int64]) bit-planes for EDG_NOR, EDG_NCONV, EDG_NIMPL, EDG_AND
+    """
+    return _pack_bits(torch.stack((x == EDG_NOR, x == EDG_NCONV, x == EDG_NIMPL, x == EDG_AND), dim=1))
+
+
+def _edge_state_codes(x:torch.Tensor) -> torch.Tensor:
+    """
+    Inputs
+    ======
+    x - n x n_edges (categorical Tensor) EDG enum
+
+    Returns
+    =======
+    y - n x n_edges (Tensor[uint8]) 0 for null, 1 + the edge state's bit-plane in _pack_edge_states() for the four states that have one, else 5
+    """
+    lut = torch.full((len(UNIQ_EDGE_TYPES),), 5, dtype=torch.uint8)
+    lut[EDG_NULL] = 0
+    for j, state in enumerate([EDG_NOR,EDG_NCONV,EDG_NIMPL,EDG_AND]):
+        lut[state] = j + 1
+    return lut[x.to(torch.int64)]
+
+
+def _cluster_edge_state_codes(codes:torch.Tensor, n_clusters:int, n_features:int=256, n_iter:int=4, n_samples_per_cluster:int=16) -> torch.Tensor:
+    """
+    clusters rows of edge state codes with k-means on the one-hot codes of the most variable edges, fit to a sample of the rows (see HNetComponentIndex, which only needs similar rows to share a cluster, not an optimal clustering)
+
+    Inputs
+    ======
+    codes      - n x n_edges (Tensor[uint8]) see _edge_state_codes()
+    n_clusters - (int)
+    n_features - OPTIONAL (int) number of edges to cluster on
+    n_iter     - OPTIONAL (int) number of k-means iterations
+    n_samples_per_cluster - OPTIONAL (int) size of the sample the centroids are fit to, per cluster
+
+    Returns
+    =======
+    cluster_idx - n (Tensor[int64]) cluster of each row, 0 --> n_clusters-1
+    """
+    n = codes.shape[0]
+    if n_clusters <= 1 or n == 0:
+        return torch.zeros(n, dtype=torch.int64)
+    rng = torch.Generator().manual_seed(0) # (deterministic, so an index is the same every time it's built)
+    sample = torch.randperm(n, generator=rng)[:max(n_clusters, n_samples_per_cluster*n_clusters)]
+    n_edges = codes.shape[1]
+    freqs = torch.bincount((torch.arange(n_edges) * 6 + codes[sample]).reshape(-1), minlength=n_edges*6).reshape(n_edges, 6)
+    feature_edges = torch.argsort(torch.max(freqs, dim=1).values, stable=True)[:n_features] # edges whose most common state is least common
+    is_used = (freqs[feature_edges,:] > 0).reshape(-1) # (one-hot columns that are never set don't separate anything)
+    features = lambda rows: torch.zeros((rows.shape[0],feature_edges.shape[0]*6)).scatter_(1, torch.arange(feature_edges.shape[0]) * 6 + codes[rows][:,feature_edges], 1.0)[:,is_used] # one-hot codes
+
+    sample_features = features(sample)
+    centroids = sample_features[:n_clusters] # (sample is in random order)
+    for _ in range(n_iter):
+        cluster_idx = torch.argmax(sample_features @ centroids.T - 0.5 * torch.sum(centroids * centroids, dim=1), dim=1) # nearest centroid (every row's one-hot features have the same norm)
+        sums = torch.zeros_like(centroids).index_add_(0, cluster_idx, sample_features)
+        n_members = torch.bincount(cluster_idx, minlength=n_clusters)
+        is_nonempty = (n_members > 0)
+        centroids[is_nonempty] = sums[is_nonempty] / n_members[is_nonempty,None]
+
+    cluster_idx = torch.zeros(n, dtype=torch.int64)
+    bias = 0.5 * torch.sum(centroids * centroids, dim=1)
+    chunk_sz = max(1, 2**22 // max(1, centroids.shape[1]))
+    for i in range(0, n, chunk_sz):
+        rows = torch.arange(i, min(i+chunk_sz, n))
+        cluster_idx[rows] = torch.argmax(features(rows) @ centroids.T - bias, dim=1)
+    return cluster_idx
+
+
+def _cluster_modes(codes:torch.Tensor, cluster_idx:torch.Tensor, n_clusters:int) -> torch.Tensor:
+    """
+    Inputs
+    ======
+    codes       - n x n_edges (Tensor[uint8]) see _edge_state_codes()
+    cluster_idx - n (Tensor[int64])
+    n_clusters  - (int)
+
+    Returns
+    =======
+    modes - n_clusters x n_edges (Tensor[uint8]) most common code per edge in each cluster (0 in empty clusters)
+    """
+    n, n_edges = codes.shape
+    counts = torch.zeros(n_clusters * n_edges * 6, dtype=torch.int32)
+    chunk_sz = max(1, 2**22 // max(1, n_edges))
+    for i in range(0, n, chunk_sz):
+        keys = ((cluster_idx[i:i+chunk_sz,None] * n_edges + torch.arange(n_edges)) * 6).add_(codes[i:i+chunk_sz]) # (cluster, edge, code) flat index
+        counts.add_(torch.bincount(keys.reshape(-1), minlength=counts.shape[0]).to(torch.int32))
+    return torch.argmax(counts.reshape(n_clusters, n_edges, 6), dim=2).to(torch.uint8)
+
+
+def _popcount(x:torch.Tensor) -> torch.Tensor:
+    """
+    counts set bits (SWAR popcount; the masks make arithmetic right shifts of negative words safe)
+    overwrites x
+
+    Inputs
+    ======
+    x - ... x n_words (Tensor[int64])
+
+    Returns
+    =======
+    y - ... (Tensor[int64]) total number of set bits across the last dimension
+    """
+    x.sub_((x >> 1) & 0x5555555555555555)
+    x = (x & 0x3333333333333333).add_((x >> 2) & 0x3333333333333333)
+    x.add_(x >> 4).bitwise_and_(0x0F0F0F0F0F0F0F0F) # each byte now holds the number of bits that were set in it
+    x.mul_(0x0101010101010101).bitwise_right_shift_(56) # sum the bytes into the top byte (the multiply is allowed to wrap)
+    return torch.sum(x, dim=-1)
+
+
+def _logical_edge_types(do_include_null:bool, do_include_all_16:bool) -> list:
+    """returns the list of EDG enum values that _edge_to_logical() one-hot encodes, in order"""
+    if do_include_all_16 and do_include_null:
+        return list(UNIQ_EDGE_TYPES)
+    elif do_include_all_16 and not do_include_null:
+        return UNIQ_EDGE_TYPES[1:] # skip EDG_NULL
+    elif not do_include_all_16 and do_include_null:
+        return [EDG_NULL,EDG_NOR,EDG_NCONV,EDG_NIMPL,EDG_AND]
+    else:
+        return [EDG_NOR,EDG_NCONV,EDG_NIMPL,EDG_AND]
+
+
+def _edge_to_logical(x:torch.Tensor, do_include_null:bool, do_include_all_16:bool) -> torch.Tensor:
+    """
+    ...
+
+    Inputs
+    ======
+    x                 - n_pts x n_edges (categorical Tensor[int64]) ...
+    do_include_null   - OPTIONAL scalar (bool) ...
+    do_include_all_16 - OPTIONAL scalar (bool) ...
+
+    Returns
+    =======
+    y - n_pts x n_edges*const (Tensor[bool])
+    """
+    n_pts, n_edges = x.shape
+    edge_types = _logical_edge_types(do_include_null, do_include_all_16)
+    n_edge_types = len(edge_types)
+
+    y = torch.zeros((n_edge_types,n_pts,n_edges), dtype=torch.bool)
+    for i in range(n_edge_types):
+        y[i,:,:] = (x == edge_types[i])
+    
+    y = torch.permute(y, [1,0,2]) # TODO correct permutation???
+    y = torch.reshape(y, (n_pts,n_edge_types*n_edges))
+    return y
+
+
+# === CALLABLE FUNCTIONS ===
+
+
+def construct_hnet_model_from_json(filename:str, energy_mode:str, cmp_chunk_size:int=64) -> HNetModel:
+    """
     ...
 
     Inputs
@@ -462,7 +2242,11 @@ def construct_hnet_model_from_json(filename:str, energy_mode:str) -> HNetModel:
             "layout": [
                 {
                     "name": "<arbitrary component bank name>",
+                    "graph_type": <OPTIONAL int, GRF enum; if present, h, h_coo, k and edge_endnode_idx may be omitted and are derived from it (see pytorch_hnet_graph.py)>,
+                    "img_sz": [<OPTIONAL n_rows,n_cols,n_chan, required if graph_type is a grid and edge_endnode_idx is omitted>],
                     "h": [<list of numbers, n_cmp x n_nodes x n_nodes or empty list>],
+                    "h_coo": [<OPTIONAL list of numbers, nnz x 4, each row [cmp,row,col,val] (0-based) of a sparse h, used instead of h when present>],
+                    "n_nodes": <OPTIONAL int, required if h_coo is present, or if graph_type is not a grid and edge_endnode_idx is omitted>,
                     "k": [<list of numbers, n_cmp x 1 or empty list>],
                     "learned_edge_states": [<list of numbers, ? x ? or empty list>],
                     "edge_endnode_idx": [...],
@@ -472,36 +2256,145 @@ def construct_hnet_model_from_json(filename:str, energy_mode:str) -> HNetModel:
                 }, { ... }, ...
             ]
         }
-    energy_mode - (str) "hamiltonian" | "edgematch" | "boolweights"
+    energy_mode    - (str) "hamiltonian" | "edgematch" | "bitpacked" | "boolweights"
+    cmp_chunk_size - OPTIONAL (int) number of components scored at once in hamiltonian mode (trades speed for peak memory)
     """
     assert filename.endswith(".hnetmodel.json")
 
     # load file to dict
     with open(filename, "r") as f:
         model_info = json.load(f)
+    model_info = _validate_model_info(model_info)
 
-    # validate file validity
-    assert type(model_info["comment"]) is str
-    assert type(model_info["layout"]) is list
-    assert type(model_info["links"]) is str
-    for compbank in model_info["layout"]:
-        assert type(compbank["name"]) is str
-        assert type(compbank["h"]) is list
-        assert type(compbank["k"]) is list
-        assert type(compbank["learned_edge_states"]) is list
-        assert type(compbank["edge_endnode_idx"]) is list
-        assert type(compbank["edge_type_filter"]) is list
-        assert type(compbank["nonlinearity_mode"]) is str
-        assert type(compbank["n_winners"]) is int
+    # create & return nn.Module
+    return HNetModel(model_info, energy_mode, cmp_chunk_size)
 
-    # correct types and typos
-    model_info["links"] = _remove_whitespace(model_info["links"].lower())
-    for i in range(len(model_info["layout"])):
-        model_info["layout"][i]["name"] = _remove_whitespace(model_info["layout"][i]["name"].lower())
-        model_info["layout"][i]["nonlinearity_mode"] = _remove_whitespace(model_info["layout"][i]["nonlinearity_mode"].lower())
 
-    # create & return nn.Module
-    return HNetModel(model_info, energy_mode)
+def construct_hnet_model_from_bin(filename:str, energy_mode:str, cmp_chunk_size:int=64) -> HNetModel:
+    """
+    like construct_hnet_model_from_json(), but loads a ".hnetmodel.bin" file (see convert_json_to_bin), memory-mapping its arrays instead of parsing them
+
+    Inputs
+    ======
+    filename       - (str) full file name including path, ending in ".hnetmodel.bin"
+    energy_mode    - (str) "hamiltonian" | "edgematch" | "bitpacked" | "boolweights"
+    cmp_chunk_size - OPTIONAL (int) number of components scored at once in hamiltonian mode (trades speed for peak memory)
+    """
+    assert filename.endswith(".hnetmodel.bin")
+    model_info = _validate_model_info(_read_bin(filename))
+    return HNetModel(model_info, energy_mode, cmp_chunk_size)
+
+
+def convert_json_to_bin(filename:str) -> str:
+    """
+    converts a ".hnetmodel.json" or ".dataset.json" file exported by Export2JSON.m into the equivalent binary file (".hnetmodel.bin" or ".dataset.bin", in the same folder)
+    the binary file is a small json header (links, names, nonlinearity modes, etc.) followed by typed arrays, which load via np.memmap with zero copies
+
+    Inputs
+    ======
+    filename - (str) full file name including path
+
+    Returns
+    =======
+    bin_filename - (str) full file name of the new file
+    """
+    assert filename.endswith(".hnetmodel.json") or filename.endswith(".dataset.json")
+    with open(filename, "r") as f:
+        info = json.load(f)
+    if filename.endswith(".hnetmodel.json"):
+        info = _validate_model_info(info)
+        for compbank in info["layout"]:
+            for key, dtype in _BIN_MODEL_DTYPES.items():
+                if key in compbank:
+                    arr = np.array(compbank[key])
+                    assert np.array_equal(arr.astype(dtype), arr), key + " doesn't fit in " + np.dtype(dtype).name
+                    compbank[key] = arr.astype(dtype)
+    else:
+        data = np.array(info["data"], np.single)
+        info["data"] = data.astype(bool) if np.all((data == 0) | (data == 1)) else data # node activations are usually binary
+        info["label_idx"] = np.array(info["label_idx"], np.single)
+    bin_filename = filename[:-len(".json")] + ".bin"
+    _write_bin(bin_filename, info)
+    return bin_filename
+
+
+def export_compiled_model(model:HNetModel, filename:str, n_nodes:int=None, is_native:bool=True) -> None:
+    """
+    compiles the model's forward pass, for any number of datapoints, into a self-contained ".hnetmodel.pt2" file with the model's tensors embedded
+    loading it (see load_compiled_model) skips the json parsing and module construction of construct_hnet_model_from_json, and running it skips forward()'s python-level dispatch
+    the energy offsets are baked in as they are now: calibrate first (see calibrate_energy_offsets) so outputs don't depend on how datapoints are batched
+    the compiled graph runs on dense tensors only (HNetKWTA passes a dense compcode to the next bank, with the same values), and without a profiler or edge feature cache
+    if a readout is set (see set_readout), it's compiled in: the compiled model returns class scores, and its hnet_info["classes"] lists the label values (see classify)
+
+    Inputs
+    ======
+    model     - (HNetModel)
+    filename  - (str) full file name including path, ending in ".hnetmodel.pt2"
+    n_nodes   - OPTIONAL (int) number of sensory input nodes (default = model.n_nodes, from the model file)
+    is_native - OPTIONAL (bool) if true, compile to native code with AOTInductor (needs a C++ compiler here, but not where it's loaded; the code targets this machine's CPU instruction set)
+                                if false, save the traced graph only (a torch.export program, run by torch's interpreter; portable, but per-call overhead isn't lower than HNetModel's)
+    """
+    assert filename.endswith(".hnetmodel.pt2")
+    if n_nodes is None:
+        n_nodes = model.n_nodes
+    if n_nodes is None:
+        raise Exception("the model file doesn't say how many input nodes the model has; pass n_nodes")
+    model = model.to(torch.device("cpu"))
+    detached = [(module, module.profiler, module.edge_feature_cache if isinstance(module, HNetEnergy) else None) for module in model.modules() if hasattr(module, "profiler")]
+    for module,_,_ in detached: # (python side effects can't be compiled)
+        module.profiler = None
+        if isinstance(module, HNetEnergy):
+            module.edge_feature_cache = None
+    try:
+        n_pts = torch.export.Dim("n_pts", min=1)
+        with torch.no_grad():
+            program = torch.export.export(model, (torch.zeros((2,n_nodes)),), dynamic_shapes=({0:n_pts},))
+    finally:
+        for module, profiler, cache in detached:
+            module.profiler = profiler
+            if isinstance(module, HNetEnergy):
+                module.edge_feature_cache = cache
+    info = json.dumps({
+        "names": [compbank.name for compbank in model.compbanks],
+        "links": model.links,
+        "energy_mode": model.compbank_order[0].energy_mode,
+        "n_nodes": int(n_nodes),
+        "is_calibrated": all(compbank.energy.energy_offset is not None for compbank in model.compbank_order),
+        "classes": model.readout.classes.tolist() if model.readout is not None else None,
+        "torch_version": torch.__version__,
+    })
+    if is_native:
+        from torch._inductor import aoti_compile_and_package # (slow to import, so only when needed)
+        aoti_compile_and_package(program, package_path=filename, inductor_configs={"aot_inductor.metadata":{_COMPILED_INFO_FILENAME:info}})
+    else:
+        torch.export.save(program, filename, extra_files={_COMPILED_INFO_FILENAME:info})
+
+
+def load_compiled_model(filename:str) -> HNetCompiledModel:
+    """
+    loads a model compiled by export_compiled_model(); call it like an HNetModel (model(x), or evaluate(model, data))
+
+    Inputs
+    ======
+    filename - (str) full file name including path, ending in ".hnetmodel.pt2"
+
+    Returns
+    =======
+    model - (HNetCompiledModel)
+    """
+    assert filename.endswith(".hnetmodel.pt2")
+    assert os.path.exists(filename), "file " + filename + " must exist"
+    with zipfile.ZipFile(filename) as f:
+        is_native = any("/data/aotinductor/" in name for name in f.namelist())
+    if is_native:
+        from torch._inductor import aoti_load_package # (slow to import, so only when needed)
+        runner = aoti_load_package(filename)
+        info = runner.get_metadata()[_COMPILED_INFO_FILENAME]
+    else:
+        extra_files = {_COMPILED_INFO_FILENAME:""}
+        runner = torch.export.load(filename, extra_files=extra_files).module()
+        info = extra_files[_COMPILED_INFO_FILENAME]
+    return HNetCompiledModel(runner, json.loads(info))
 
 
 def evaluate(model:HNetModel, data) -> np.ndarray:
@@ -511,7 +2404,7 @@ def evaluate(model:HNetModel, data) -> np.ndarray:
     Inputs
     ======
     model - (HNetModel) ...
-    data  - (ndarray|Tensor) ...
+    data  - (ndarray|Tensor|scipy.sparse matrix) ... sparse input (scipy.sparse or torch sparse) is kept sparse end-to-end
 
     Returns
     =======
@@ -522,11 +2415,347 @@ def evaluate(model:HNetModel, data) -> np.ndarray:
     # device = torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu")
     model = model.to(device)
     with torch.no_grad():
-        output = model(torch.Tensor(data).to(device))
+        output = model(_as_node_activations(data).to(device))
     output = output.cpu().numpy()
     return output
 
 
+def calibrate_energy_offsets(model:HNetModel, data, batch_size:int=1024) -> None:
+    """
+    sets each component bank's energy normalization offset to its value over the whole dataset, so that subsequent calls (on any subset or chunk of the data) normalize identically to one unchunked call on all of it
+    requires one pass over the data per component bank (a bank's offset depends on the already-calibrated banks upstream of it, which come earlier in compbank_order)
+
+    Inputs
+    ======
+    model      - (HNetModel) modified in place
+    data       - (ndarray|Tensor|scipy.sparse matrix) n_pts x n_nodes, or a re-iterable collection of such minibatches
+    batch_size - OPTIONAL (int) number of datapoints per minibatch
+    """
+    reset_energy_offsets(model)
+    with torch.no_grad():
+        for i, compbank in enumerate(model.compbank_order):
+            offsets = []
+            for x in _iter_batches(data, batch_size):
+                with _profile(model.profiler, "calibration", x, compbank.name):
+                    x = model.compbank_input(x, i)
+                    offsets.append(compbank.energy.batch_offset(compbank.energy.raw_energies(x)))
+            compbank.energy.energy_offset = float(compbank.energy.batch_offset(torch.stack(offsets)))
+
+
+def reset_energy_offsets(model:HNetModel) -> None:
+    """undoes calibrate_energy_offsets(): each call to the model is again normalized by its own batch"""
+    for compbank in model.compbank_order:
+        compbank.energy.energy_offset = None
+
+
+def set_edge_feature_cache(model:HNetModel, cache:HNetEdgeFeatureCache) -> None:
+    """
+    makes the model's edge-based energy modules (edgematch, bitpacked, boolweights) reuse encoded edge features from an on-disk cache, so scoring the same data again (with this or any other model with the same graph and edge type filter) skips the edge encoding entirely
+    the cache is keyed by the content of each minibatch, so it's hit by repeated calls with the same data and (for streaming) the same batch_size
+
+    Inputs
+    ======
+    model - (HNetModel) modified in place
+    cache - (HNetEdgeFeatureCache) or None to stop using a cache
+    """
+    for module in model.modules():
+        if isinstance(module, HNetEnergy):
+            module.edge_feature_cache = cache
+
+
+def set_profiler(model:HNetModel, profiler:HNetProfiler) -> None:
+    """
+    makes every subsequent call to the model record per-bank, per-stage timings and sizes into profiler (see HNetProfiler), e.g.
+        profiler = HNetProfiler()
+        set_profiler(model, profiler)
+        evaluate(model, data)
+        print(profiler.summary())
+        profiler.write_trace("trace.json")
+
+    Inputs
+    ======
+    model    - (HNetModel) modified in place
+    profiler - (HNetProfiler) or None to stop profiling
+    """
+    for module in model.modules():
+        if isinstance(module, (HNetModel, HNetComponentBank, HNetEnergy)):
+            module.profiler = profiler
+
+
+def set_row_cache(model:HNetModel, cache:HNetRowCache) -> None:
+    """
+    makes the model evaluate each distinct input row once per call, and (once calibrated, see calibrate_energy_offsets) reuse outputs of rows seen in earlier calls, e.g.
+        cache = HNetRowCache(max_rows=100000)
+        set_row_cache(model, cache)
+        evaluate(model, data)
+        print(cache.summary())
+    applies to forward() (and so evaluate, evaluate_streaming, ..., classify), not to return_all or export_compiled_model
+
+    Inputs
+    ======
+    model - (HNetModel) modified in place
+    cache - (HNetRowCache) or None to evaluate every row again
+    """
+    model.row_cache = cache
+
+
+def set_translation_invariance(model:HNetModel, img_sz:list, max_translation_delta:int=None, cmp_chunk_size:int=64) -> None:
+    """
+    makes each component bank that reads the sensory input (a GRF_GRID2D or GRF_GRID2DMULTICHAN graph) score every component at every translation, keeping its best energy (see HNetTranslatedEnergy)
+    a replacement for materializing shifted copies of the components (TranslateAndRotate.m without rotation, e.g. the "connectedpart.transl.2" pipeline), on a model trained without them
+    resets the banks' energy offsets (see calibrate_energy_offsets); use match_translations() to also get the best translation of each component
+
+    Inputs
+    ======
+    model                 - (HNetModel) modified in place; its sensory banks must use an edge-based energy mode (edgematch, bitpacked, or boolweights)
+    img_sz                - [n_rows,n_cols] or [n_rows,n_cols,n_chan] (list of int) shape of the sensory grid, or None to undo set_translation_invariance()
+    max_translation_delta - OPTIONAL (int) max shift in rows and in columns, as in TranslateAndRotate.m; if None, every shift that keeps all of a component's edges on the grid
+    cmp_chunk_size        - OPTIONAL (int) number of components correlated at once
+    """
+    for compbank, (_, src) in zip(model.compbank_order, model.plan):
+        if src >= 0: # (not on the sensory grid)
+            continue
+        if compbank.untranslated_energy is not None:
+            compbank.energy = compbank.untranslated_energy
+            compbank.untranslated_energy = None
+        if img_sz is not None:
+            energy = HNetTranslatedEnergy(compbank.learned_edge_states, compbank.edge_endnode_idx, compbank.edge_type_filter, compbank.energy_mode, img_sz, max_translation_delta, cmp_chunk_size)
+            energy.edge_feature_cache = compbank.energy.edge_feature_cache
+            energy.profiler = compbank.energy.profiler
+            compbank.untranslated_energy = compbank.energy
+            compbank.energy = energy
+        compbank.energy.energy_offset = None
+
+
+def match_translations(model:HNetModel, data, bank_name:str, batch_size:int=1024):
+    """
+    best energy and translation of each component of a translation invariant bank (see set_translation_invariance)
+
+    Inputs
+    ======
+    model      - (HNetModel) ...
+    data       - (ndarray|Tensor|np.memmap|scipy.sparse matrix) n_pts x n_nodes, or an iterable of minibatches (see evaluate_streaming)
+    bank_name  - (char) name of the bank
+    batch_size - OPTIONAL (int)
+
+    Returns
+    =======
+    energies - n_pts x n_cmp (ndarray[single]) normalized energies, same as the bank's output before its nonlinearity
+    offsets  - n_pts x n_cmp x 2 (ndarray[int64]) (row, col) translation of each component with that energy (the smallest one, if tied)
+    """
+    compbank = next((compbank for compbank in model.compbanks if compbank.name == bank_name), None)
+    if compbank is None or compbank.untranslated_energy is None:
+        raise Exception("no translation invariant bank named " + bank_name)
+    energies = []
+    offsets = []
+    with torch.no_grad():
+        for x in _iter_batches(data, batch_size):
+            raw_energies, offset_idx = compbank.energy.best_translations(x)
+            energies.append(compbank.energy.normalize(raw_energies).numpy())
+            offsets.append(compbank.energy.offsets[offset_idx].numpy())
+    return np.concatenate(energies), np.concatenate(offsets)
+
+
+def fit_linear_readout(model:HNetModel, data, label_idx, l2_reg:float=1e-3, batch_size:int=1024) -> HNetLinearReadout:
+    """
+    fits a one-vs-rest linear classifier on the model's output energies (a scalable replacement for an svm backend)
+    one streamed pass accumulates the outputs' mean, covariance, and per-class sums in double (never holding all outputs), then one n_features x n_features linear solve gives the ridge regression onto one-hot class indicators
+    time is linear in the number of datapoints; memory is n_features^2 (for the covariance) regardless of it
+
+    Inputs
+    ======
+    model      - (HNetModel) calibrated, unless data is re-iterable (see evaluate_streaming); any readout already set is ignored
+    data       - (ndarray|Tensor|np.memmap|scipy.sparse matrix) n_pts x n_nodes, or an iterable of minibatches (see evaluate_streaming)
+    label_idx  - n_pts (ndarray|Tensor) class label of each datapoint, in data's order
+    l2_reg     - OPTIONAL (float) ridge penalty, per datapoint, on the standardized features
+    batch_size - OPTIONAL (int)
+
+    Returns
+    =======
+    readout - (HNetLinearReadout) pass to set_readout() to attach it to the model
+    """
+    assert l2_reg >= 0
+    label_idx = torch.as_tensor(np.asarray(label_idx)).reshape(-1)
+    classes, label_class = torch.unique(label_idx, sorted=True, return_inverse=True)
+    n_classes = classes.shape[0]
+    readout = model.readout
+    model.readout = None # (fit on the raw outputs)
+    try:
+        n = 0
+        for output in evaluate_streaming(model, data, batch_size):
+            x = torch.as_tensor(output, dtype=torch.double)
+            if n == 0:
+                feature_sum = torch.zeros(x.shape[1], dtype=torch.double)
+                xtx = torch.zeros((x.shape[1],x.shape[1]), dtype=torch.double)
+                class_feature_sum = torch.zeros((n_classes,x.shape[1]), dtype=torch.double) # = X' Y for one-hot Y
+            feature_sum += x.sum(dim=0)
+            xtx.addmm_(x.T, x)
+            class_feature_sum.index_add_(0, label_class[n:n+x.shape[0]], x)
+            n += x.shape[0]
+    finally:
+        model.readout = readout
+    assert n == label_idx.shape[0], "label_idx must have one label per datapoint"
+
+    # standardize (centered, unit variance) so the penalty treats features alike; constant features get weight 0
+    mean = feature_sum / n
+    cov = xtx / n - torch.outer(mean, mean)
+    scale = torch.sqrt(torch.clamp(torch.diagonal(cov), min=0))
+    keep = scale > 1e-12 * torch.clamp(scale.max(), min=1) # non-constant features
+    scale = scale[keep]
+    class_frac = torch.bincount(label_class, minlength=n_classes).to(torch.double) / n
+    cross_cov = class_feature_sum.T[keep] / n - torch.outer(mean[keep], class_frac) # n_kept x n_classes
+    z_cov = cov[keep][:,keep] / torch.outer(scale, scale)
+    z_cov.diagonal().add_(l2_reg)
+    w = torch.zeros((mean.shape[0],n_classes), dtype=torch.double)
+    w[keep] = torch.linalg.solve(z_cov, cross_cov / scale[:,None]) / scale[:,None]
+    bias = class_frac - mean @ w
+    return HNetLinearReadout(w.T, bias, classes)
+
+
+def set_readout(model:HNetModel, readout:HNetLinearReadout) -> None:
+    """
+    makes the model's forward() (and so evaluate, evaluate_streaming, ..., and export_compiled_model) return the readout's class scores instead of the output energies
+
+    Inputs
+    ======
+    model   - (HNetModel) modified in place
+    readout - (HNetLinearReadout) see fit_linear_readout(), or None to return the output energies again
+    """
+    model.readout = readout
+
+
+def classify(model:HNetModel, data, batch_size:int=1024) -> np.ndarray:
+    """
+    predicts each datapoint's class label, streaming (see evaluate_streaming)
+
+    Inputs
+    ======
+    model      - (HNetModel) with a readout set (see set_readout), or an HNetCompiledModel exported with one
+    data       - (ndarray|Tensor|np.memmap|scipy.sparse matrix) n_pts x n_nodes, or an iterable of minibatches
+    batch_size - OPTIONAL (int)
+
+    Returns
+    =======
+    label_idx - n_pts (ndarray) predicted label values
+    """
+    if isinstance(model, HNetCompiledModel):
+        if model.hnet_info.get("classes") is None:
+            raise Exception("the compiled model was exported without a readout")
+        classes = np.asarray(model.hnet_info["classes"])
+        outputs = (model(x).numpy() for x in _iter_batches(data, batch_size)) # (its outputs never require grad)
+    else:
+        if model.readout is None:
+            raise Exception("the model has no readout; see fit_linear_readout and set_readout")
+        classes = model.readout.classes.numpy()
+        outputs = evaluate_streaming(model, data, batch_size)
+    predictions = [classes[np.argmax(scores, axis=1)] for scores in outputs]
+    if len(predictions) == 0:
+        return classes[0:0]
+    return np.concatenate(predictions)
+
+
+def evaluate_streaming(model:HNetModel, data, batch_size:int=1024):
+    """
+    like evaluate(), but processes the data in fixed-size minibatches and yields each minibatch's output as soon as it's ready
+    peak memory is bounded by batch_size (not by the number of datapoints)
+    if the model hasn't been calibrated (see calibrate_energy_offsets), it's first calibrated on this data (and reset afterwards), so the concatenated outputs equal evaluate(model, data)
+
+    Inputs
+    ======
+    model      - (HNetModel) ...
+    data       - (ndarray|Tensor|np.memmap|scipy.sparse matrix) n_pts x n_nodes, or an iterable of minibatches (which must be re-iterable unless the model is calibrated)
+    batch_size - OPTIONAL (int) number of datapoints per minibatch
+
+    Returns
+    =======
+    output - generator of n x ... (ndarray), one per minibatch, in order
+    """
+    torch.set_float32_matmul_precision("high")
+    model = model.to(torch.device("cpu"))
+    is_calibrated = all(compbank.energy.energy_offset is not None for compbank in model.compbank_order)
+    if not is_calibrated:
+        if iter(data) is data:
+            raise Exception("a one-shot iterator can only be streamed through a calibrated model (see calibrate_energy_offsets)")
+        calibrate_energy_offsets(model, data, batch_size)
+    try:
+        for x in _iter_batches(data, batch_size):
+            with torch.no_grad():
+                output = model(x)
+            yield output.cpu().numpy()
+    finally:
+        if not is_calibrated:
+            reset_energy_offsets(model)
+
+
+def evaluate_into(model:HNetModel, data, out, batch_size:int=1024):
+    """
+    like evaluate(), but writes the output into a preallocated (e.g. memory-mapped) array one minibatch at a time; see evaluate_streaming()
+
+    Inputs
+    ======
+    model      - (HNetModel) ...
+    data       - (ndarray|Tensor|np.memmap|scipy.sparse matrix|iterable of minibatches) n_pts x n_nodes
+    out        - n_pts x n_out (ndarray|np.memmap|anything supporting slice assignment)
+    batch_size - OPTIONAL (int) number of datapoints per minibatch
+
+    Returns
+    =======
+    out - the same array, filled in
+    """
+    count = 0
+    for output in evaluate_streaming(model, data, batch_size):
+        out[count:count+output.shape[0]] = output
+        count += output.shape[0]
+    assert count == out.shape[0], "out has the wrong number of rows"
+    return out
+
+
+def evaluate_parallel(model:HNetModel, data, n_workers:int=None, n_threads_per_worker:int=1, batch_size:int=1024) -> np.ndarray:
+    """
+    like evaluate(), but shards the datapoints across a pool of CPU worker processes
+    the model's tensors and the data are moved to shared memory once and shared read-only by all workers (not pickled copies)
+    if the model isn't calibrated (see calibrate_energy_offsets), the workers first compute the energy offsets of the whole dataset (one parallel pass per component bank), so the output equals evaluate(model, data)
+
+    Inputs
+    ======
+    model                - (HNetModel) ...
+    data                 - (ndarray|Tensor|np.memmap|scipy.sparse matrix) n_pts x n_nodes
+    n_workers            - OPTIONAL (int) number of worker processes (default = number of cores)
+    n_threads_per_worker - OPTIONAL (int) number of intra-op (torch) threads per worker
+    batch_size           - OPTIONAL (int) number of datapoints per task sent to a worker
+
+    Returns
+    =======
+    output - n_pts x ... (ndarray) same as evaluate(model, data)
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    assert n_workers > 0 and n_threads_per_worker > 0
+    if isinstance(data, torch.Tensor) and data.layout != torch.strided: # torch sparse --> scipy.sparse, which slices by row
+        data = _as_node_activations(data)
+        data = scipy.sparse.csr_matrix((data.values().numpy(), data.indices().numpy()), shape=tuple(data.shape))
+    if hasattr(data, "tocsr"): # scipy.sparse: stays sparse (sent to each worker, not shared)
+        data = data.tocsr()
+    else:
+        data = torch.as_tensor(np.asarray(data)) # keeps data's dtype (e.g. bool); converted to single one minibatch at a time
+        data.share_memory_()
+    n_pts = data.shape[0]
+    shards = [(i, min(i+batch_size, n_pts)) for i in range(0, n_pts, batch_size)]
+
+    model = model.to(torch.device("cpu"))
+    _share_memory(model)
+    offsets = [compbank.energy.energy_offset for compbank in model.compbank_order]
+    ctx = torch.multiprocessing.get_context("spawn") # fork is unsafe once torch's thread pools exist
+    with ctx.Pool(n_workers, initializer=_parallel_worker_init, initargs=(model, data, n_threads_per_worker)) as pool:
+        if any(offset is None for offset in offsets):
+            offsets = []
+            for i, compbank in enumerate(model.compbank_order): # calibrate (see calibrate_energy_offsets)
+                shard_offsets = pool.map(_parallel_worker_offset, [(start, stop, offsets, batch_size) for start, stop in shards])
+                offsets.append(float(compbank.energy.batch_offset(torch.tensor(shard_offsets, dtype=torch.double))))
+        outputs = pool.map(_parallel_worker_evaluate, [(start, stop, offsets, batch_size) for start, stop in shards])
+    return np.concatenate(outputs, axis=0)
+
+
 def main():
     """main function, if you just want to test things out (otherwise call evaluate from your own code)"""
     output_path = "D:\Projects/output_matlab/" # must end with "/"
@@ -546,7 +2775,6 @@ def main():
     tst_data, tst_label_idx = _load_dataset(tst_dataset_filename)
 
     model = construct_hnet_model_from_json(model_filename, "hamiltonian")
-    output_trn = evaluate(model, trn_data)
     output_tst = evaluate(model, tst_data)
 
     model = construct_hnet_model_from_json(model_filename, "edgematch")
@@ -563,16 +2791,17 @@ def main():
         classifier.fit(trn_data, trn_label_idx)
         svm_pred = classifier.predict(tst_data)
 
-        # SVM backend
-        classifier = sklearn.svm.SVC()
-        classifier.fit(output_trn, trn_label_idx)
-        hnetsvm_pred = classifier.predict(output_tst)
+        # linear readout backend (streamed; scales linearly with the number of datapoints, unlike an svm)
+        model = construct_hnet_model_from_json(model_filename, "hamiltonian")
+        calibrate_energy_offsets(model, trn_data)
+        set_readout(model, fit_linear_readout(model, trn_data, trn_label_idx))
+        hnetlinear_pred = classify(model, tst_data)
 
         n_tst_datapoints = len(tst_label_idx)
         n_svm_correct = np.sum(svm_pred == tst_label_idx)
-        n_hnetsvm_correct = np.sum(hnetsvm_pred == tst_label_idx)
-        print("raw svm accuracy  = {}/{} ({:.0f}%)".format(n_svm_correct, n_tst_datapoints, 100. * n_svm_correct / n_tst_datapoints))
-        print("hnet svm accuracy = {}/{} ({:.0f}%)".format(n_hnetsvm_correct, n_tst_datapoints, 100. * n_hnetsvm_correct / n_tst_datapoints))
+        n_hnetlinear_correct = np.sum(hnetlinear_pred == tst_label_idx)
+        print("raw svm accuracy     = {}/{} ({:.0f}%)".format(n_svm_correct, n_tst_datapoints, 100. * n_svm_correct / n_tst_datapoints))
+        print("hnet linear accuracy = {}/{} ({:.0f}%)".format(n_hnetlinear_correct, n_tst_datapoints, 100. * n_hnetlinear_correct / n_tst_datapoints))
     else:
         raise Exception("we currently only support datasets with categorical labels, one per datapoint")
 
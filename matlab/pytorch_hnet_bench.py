@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+# Benchmarks for the pytorch-based HNet inference engine (pytorch_hnet.py), on synthetic models and datasets shaped like the real ones
+# Copyright Brain Engineering Lab at Dartmouth. All rights reserved.
+# Please feel free to use this code for any non-commercial purpose under the CC Attribution-NonCommercial-ShareAlike license: https://creativecommons.org/licenses/by-nc-sa/4.0/
+#   Rodriguez A, Bowen EFW, Granger R (2022) https://github.com/DartmouthGrangerLab/hnet
+#   Bowen, EFW, Granger, R, Rodriguez, A (2023). A logical re-conception of neural networks: Hamiltonian bitwise part-whole architecture. Presented at AAAI EDGeS 2023.
+"""
+CALLABLE FUNCTIONS:
+    synthetic_model_info(scenario:str, n_cmp:int, img_sz:list=None, n_nodes:int=None, seed:int=0, is_dense_h:bool=False) -> dict
+    synthetic_data(scenario:str, n_pts:int, img_sz:list=None, n_nodes:int=None, seed:int=0) -> np.ndarray
+    run_benchmarks(scenarios:list=None, energy_modes:list=None, nonlinearity_modes:list=None, is_quick:bool=False, ...) -> dict
+    compare_results(old_filename:str, new_filename:str) -> list
+    main() -> None
+
+USAGE:
+    python pytorch_hnet_bench.py --out bench.json [--scenarios credit mnist clevr] [--energy-modes hamiltonian bitpacked] [--nonlinearity-modes max] [--quick] [--compare old_bench.json]
+"""
+import os
+import time
+import json
+import argparse
+import platform
+import numpy as np
+import torch
+import torch.multiprocessing
+import pytorch_hnet as hnet
+import pytorch_hnet_graph as hgraph
+
+
+# shapes of the real datasets and layouts (see Dataset.m and Layout.m); density = approx fraction of active nodes
+SCENARIOS = {
+    "credit": dict(graph_type=hnet.GRF_FULL,            img_sz=None,       n_nodes=64,  edge_type_filter=[hnet.EDG_NCONV,hnet.EDG_NIMPL,hnet.EDG_AND], density=0.3),  # binarized uci credit, "basiccred"
+    "mnist":  dict(graph_type=hnet.GRF_GRID2D,          img_sz=[28,28,1],  n_nodes=784, edge_type_filter=[hnet.EDG_NCONV,hnet.EDG_NIMPL],              density=0.19), # "basicimg"
+    "clevr":  dict(graph_type=hnet.GRF_GRID2DMULTICHAN, img_sz=[20,30,24], n_nodes=None, edge_type_filter=[hnet.EDG_NCONV,hnet.EDG_NIMPL],             density=0.05), # 80x120x24 downsampled 4x
+}
+
+# each sweep varies one parameter away from the defaults
+DEFAULT_N_PTS = 1000
+DEFAULT_N_CMP = 100
+SWEEPS = {
+    "n_pts": [100, 1000, 10000],
+    "n_cmp": [10, 100, 1000],
+    "n_nodes": {"credit":[16,64,256], "mnist":[[14,14,1],[28,28,1],[56,56,1]], "clevr":[[10,15,24],[20,30,24],[40,60,24]]},
+}
+QUICK_SWEEPS = {
+    "n_pts": [100, 1000],
+    "n_cmp": [10, 100],
+    "n_nodes": {"credit":[16,64], "mnist":[[14,14,1],[28,28,1]], "clevr":[[10,15,24],[20,30,24]]},
+}
+ENERGY_MODES = ["hamiltonian", "hamiltoniandense", "edgematch", "bitpacked", "boolweights"] # "hamiltoniandense" = hamiltonian with dense h
+NONLINEARITY_MODES = ["none", "max", "maxabs", "kwta", "nonzero"]
+
+
+# === FILE-PRIVATE FUNCTIONS ===
+
+
+def _scenario_shape(scenario:str, img_sz:list, n_nodes:int):
+    """returns (img_sz, n_nodes), filling in the scenario's defaults"""
+    info = SCENARIOS[scenario]
+    if info["img_sz"] is None:
+        return None, int(n_nodes if n_nodes is not None else info["n_nodes"])
+    img_sz = list(img_sz if img_sz is not None else info["img_sz"])
+    return img_sz, int(np.prod(img_sz))
+
+
+def _group_edge_states(n_groups:int, n_in:int, seed:int) -> torch.Tensor:
+    """returns the learned edge states of a GRF_SELF group bank that randomly partitions n_in inputs among n_groups components (see HNetMax)"""
+    rng = np.random.default_rng(seed)
+    learned_edge_states = np.zeros((n_groups,n_in), dtype=np.int64)
+    learned_edge_states[rng.integers(0, n_groups, n_in),np.arange(n_in)] = hnet.EDG_AND
+    return torch.as_tensor(learned_edge_states)
+
+
+def _time_calls(fn, x:torch.Tensor, n_repeats:int, max_seconds:float) -> list:
+    """calls fn(x) once to warm up, then up to n_repeats more times (stopping early once max_seconds have elapsed); returns each timed call's latency in seconds"""
+    t = time.perf_counter()
+    with torch.no_grad():
+        fn(x)
+        if time.perf_counter() - t > max_seconds: # too slow to repeat; report the warmup call
+            return [time.perf_counter() - t]
+        latencies = []
+        t_start = time.perf_counter()
+        for _ in range(n_repeats):
+            t = time.perf_counter()
+            fn(x)
+            latencies.append(time.perf_counter() - t)
+            if t - t_start > max_seconds:
+                break
+    return latencies
+
+
+def _run_case(case:dict) -> dict:
+    """runs one benchmark case (see run_benchmarks) and returns its result"""
+    torch.set_num_threads(case["n_threads"])
+    torch.set_float32_matmul_precision("high")
+    result = dict(case)
+    img_sz, n_nodes = _scenario_shape(case["scenario"], case["img_sz"], case["n_nodes"])
+    result["img_sz"] = img_sz
+    result["n_nodes"] = n_nodes
+    try:
+        if case["kind"] == "energy":
+            h_numel = case["n_cmp"] * n_nodes * n_nodes
+            if case["mode"] == "hamiltoniandense" and h_numel * 4 > case["max_dense_h_bytes"]:
+                result["error"] = "skipped: dense h would need {:.0f} MB".format(h_numel * 4 / 2**20)
+                return result
+            model_info = synthetic_model_info(case["scenario"], case["n_cmp"], img_sz, n_nodes, case["seed"], is_dense_h=(case["mode"] == "hamiltoniandense"))
+            energy_mode = "hamiltonian" if case["mode"] == "hamiltoniandense" else case["mode"]
+            model = hnet.HNetModel(hnet._validate_model_info(model_info), energy_mode)
+            result["n_edges"] = len(model_info["layout"][0]["edge_endnode_idx"])
+            fn = model
+            x = torch.as_tensor(synthetic_data(case["scenario"], case["n_pts"], img_sz, n_nodes, case["seed"]+1), dtype=torch.float)
+        else: # nonlinearity, on the energies of a bank of n_cmp*10 components grouped into n_cmp groups
+            n_in = case["n_cmp"] * 10
+            group_edge_states = _group_edge_states(case["n_cmp"], n_in, case["seed"])
+            if case["mode"] == "none":
+                fn = hnet.HNetNoNonlinearity()
+            elif case["mode"] == "max":
+                fn = hnet.HNetMax(group_edge_states)
+            elif case["mode"] == "maxabs":
+                fn = hnet.HNetMaxAbs(group_edge_states)
+            elif case["mode"] == "kwta":
+                fn = hnet.HNetKWTA(max(1, case["n_cmp"] // 5))
+            elif case["mode"] == "nonzero":
+                fn = hnet.HNetNonzero()
+            else:
+                raise Exception("unexpected nonlinearity mode")
+            x = torch.as_tensor(np.random.default_rng(case["seed"]+1).standard_normal((case["n_pts"],n_in)), dtype=torch.float)
+        rss_before = hnet._peak_rss_mb()
+        latencies = np.array(_time_calls(fn, x, case["n_repeats"], case["max_seconds"]))
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        return result
+    result["n_calls"] = int(latencies.shape[0])
+    result["throughput_pts_per_sec"] = float(case["n_pts"] * latencies.shape[0] / np.sum(latencies))
+    result["latency_ms"] = {name:float(val*1000) for name,val in [("mean",np.mean(latencies)), ("min",np.min(latencies)), ("p50",np.percentile(latencies, 50)), ("p90",np.percentile(latencies, 90)), ("p99",np.percentile(latencies, 99)), ("max",np.max(latencies))]}
+    result["peak_rss_mb"] = hnet._peak_rss_mb()
+    result["peak_rss_mb_before_timing"] = rss_before
+    result["error"] = None
+    return result
+
+
+def _make_cases(scenarios:list, energy_modes:list, nonlinearity_modes:list, sweeps:dict, n_repeats:int, max_seconds:float, n_threads:int, max_dense_h_bytes:int) -> list:
+    """returns the list of benchmark cases: each (scenario, mode) is run at the default size and along each sweep"""
+    cases = []
+    for scenario in scenarios:
+        default_shape = SCENARIOS[scenario]["img_sz"] if SCENARIOS[scenario]["img_sz"] is not None else SCENARIOS[scenario]["n_nodes"]
+        sizes = [("default",DEFAULT_N_PTS,DEFAULT_N_CMP,default_shape)]
+        sizes += [("n_pts",n_pts,DEFAULT_N_CMP,default_shape) for n_pts in sweeps["n_pts"] if n_pts != DEFAULT_N_PTS]
+        sizes += [("n_cmp",DEFAULT_N_PTS,n_cmp,default_shape) for n_cmp in sweeps["n_cmp"] if n_cmp != DEFAULT_N_CMP]
+        sizes += [("n_nodes",DEFAULT_N_PTS,DEFAULT_N_CMP,shape) for shape in sweeps["n_nodes"][scenario] if shape != default_shape]
+        for kind, modes in [("energy",energy_modes), ("nonlinearity",nonlinearity_modes)]:
+            for mode in modes:
+                for sweep, n_pts, n_cmp, shape in sizes:
+                    if kind == "nonlinearity" and sweep == "n_nodes":
+                        continue # nonlinearities don't see the input graph
+                    is_img = isinstance(shape, list)
+                    cases.append(dict(scenario=scenario, kind=kind, mode=mode, sweep=sweep, n_pts=n_pts, n_cmp=n_cmp, img_sz=shape if is_img else None, n_nodes=None if is_img else shape,
+                                      seed=len(cases), n_repeats=n_repeats, max_seconds=max_seconds, n_threads=n_threads, max_dense_h_bytes=max_dense_h_bytes))
+    return cases
+
+
+def _case_key(result:dict) -> tuple:
+    return (result["scenario"], result["kind"], result["mode"], result["n_pts"], result["n_cmp"], result["n_nodes"])
+
+
+# === CALLABLE FUNCTIONS ===
+
+
+def synthetic_model_info(scenario:str, n_cmp:int, img_sz:list=None, n_nodes:int=None, seed:int=0, is_dense_h:bool=False) -> dict:
+    """
+    generates a 1-tier model in the format of construct_hnet_model_from_json(), shaped like the scenario's real model
+    each component memorizes the (filtered) edge states of one random datapoint, as in training with "memorize"
+
+    Inputs
+    ======
+    scenario   - (char) a key of SCENARIOS
+    n_cmp      - (int) number of components
+    img_sz     - OPTIONAL [n_rows,n_cols,n_chan] image size (image scenarios only; default = the scenario's)
+    n_nodes    - OPTIONAL (int) number of nodes (non-image scenarios only; default = the scenario's)
+    seed       - OPTIONAL (int) random seed
+    is_dense_h - OPTIONAL (bool) if true, export h as a dense n_cmp x n_nodes x n_nodes list instead of h_coo
+
+    Returns
+    =======
+    model_info - (dict)
+    """
+    info = SCENARIOS[scenario]
+    img_sz, n_nodes = _scenario_shape(scenario, img_sz, n_nodes)
+    didx = hgraph.neighbor_pairs(info["graph_type"], n_nodes, img_sz)
+    edge_type_filter = np.array(info["edge_type_filter"], dtype=np.int64)
+    pts = torch.as_tensor(synthetic_data(scenario, n_cmp, img_sz, n_nodes, seed))
+    learned_edge_states = hnet._get_edge_states(pts, torch.as_tensor(didx), hnet._edge_state_lut(torch.as_tensor(edge_type_filter))).numpy().astype(np.int64)
+    h_coo, k = hgraph.composite_h_coo(learned_edge_states, didx, n_nodes)
+    compbank = dict(name="tier1", k=k, learned_edge_states=learned_edge_states, edge_endnode_idx=didx, edge_type_filter=edge_type_filter, nonlinearity_mode="none", n_winners=0, n_nodes=n_nodes)
+    if is_dense_h:
+        h = np.zeros((n_cmp,n_nodes,n_nodes), dtype=np.single)
+        h[h_coo[:,0],h_coo[:,1],h_coo[:,2]] = h_coo[:,3]
+        compbank["h"] = h
+    else:
+        compbank["h"] = np.zeros(0)
+        compbank["h_coo"] = h_coo
+    return {"comment":"synthetic " + scenario + " model (pytorch_hnet_bench.py)", "layout":[compbank], "links":"sense-->tier1,tier1-->out"}
+
+
+def synthetic_data(scenario:str, n_pts:int, img_sz:list=None, n_nodes:int=None, seed:int=0) -> np.ndarray:
+    """
+    Inputs
+    ======
+    scenario - (char) a key of SCENARIOS
+    n_pts    - (int) number of datapoints
+    img_sz   - OPTIONAL see synthetic_model_info()
+    n_nodes  - OPTIONAL see synthetic_model_info()
+    seed     - OPTIONAL (int) random seed
+
+    Returns
+    =======
+    data - n_pts x n_nodes (ndarray[bool]) random binary node activations, at the scenario's density
+    """
+    _, n_nodes = _scenario_shape(scenario, img_sz, n_nodes)
+    return np.random.default_rng(seed).random((n_pts,n_nodes)) < SCENARIOS[scenario]["density"]
+
+
+def run_benchmarks(scenarios:list=None, energy_modes:list=None, nonlinearity_modes:list=None, is_quick:bool=False, n_repeats:int=10, max_seconds:float=10.0, n_threads:int=1, max_dense_h_bytes:int=2**30, is_isolated:bool=True) -> dict:
+    """
+    times each energy mode (a whole 1-tier model) and each nonlinearity, per scenario, at the default size and along the n_pts, n_cmp and n_nodes sweeps
+
+    Inputs
+    ======
+    scenarios          - OPTIONAL list of (char) keys of SCENARIOS (default = all)
+    energy_modes       - OPTIONAL list of (char) see ENERGY_MODES (default = all)
+    nonlinearity_modes - OPTIONAL list of (char) see NONLINEARITY_MODES (default = all)
+    is_quick           - OPTIONAL (bool) if true, use the smaller QUICK_SWEEPS
+    n_repeats          - OPTIONAL (int) max number of timed calls per case
+    max_seconds        - OPTIONAL (float) time budget per case (at least one call is always timed)
+    n_threads          - OPTIONAL (int) number of torch intra-op threads
+    max_dense_h_bytes  - OPTIONAL (int) "hamiltoniandense" cases whose h would be bigger than this are skipped
+    is_isolated        - OPTIONAL (bool) if true, run each case in a fresh process, so peak_rss_mb is per case (rather than the max so far)
+
+    Returns
+    =======
+    results - (dict) {"meta":{...}, "results":[one dict per case]}, json-serializable
+    """
+    scenarios = list(SCENARIOS.keys()) if scenarios is None else scenarios
+    energy_modes = ENERGY_MODES if energy_modes is None else energy_modes
+    nonlinearity_modes = NONLINEARITY_MODES if nonlinearity_modes is None else nonlinearity_modes
+    cases = _make_cases(scenarios, energy_modes, nonlinearity_modes, QUICK_SWEEPS if is_quick else SWEEPS, n_repeats, max_seconds, n_threads, max_dense_h_bytes)
+
+    results = []
+    for i, case in enumerate(cases):
+        if is_isolated:
+            ctx = torch.multiprocessing.get_context("spawn")
+            with ctx.Pool(1, maxtasksperchild=1) as pool:
+                result = pool.apply(_run_case, (case,))
+        else:
+            result = _run_case(case)
+        results.append(result)
+        if result["error"] is None:
+            print("[{}/{}] {} {} {} n_pts={} n_cmp={} n_nodes={}: {:.0f} pts/sec, p50 {:.2f} ms".format(i+1, len(cases), result["scenario"], result["kind"], result["mode"], result["n_pts"], result["n_cmp"], result["n_nodes"], result["throughput_pts_per_sec"], result["latency_ms"]["p50"]))
+        else:
+            print("[{}/{}] {} {} {} n_pts={} n_cmp={} n_nodes={}: {}".format(i+1, len(cases), result["scenario"], result["kind"], result["mode"], result["n_pts"], result["n_cmp"], result["n_nodes"], result["error"]))
+
+    meta = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "n_threads": n_threads,
+        "is_quick": is_quick,
+        "is_isolated": is_isolated,
+    }
+    return {"meta":meta, "results":results}
+
+
+def compare_results(old_filename:str, new_filename:str) -> list:
+    """
+    matches up the cases of two results files written by main() and prints the throughput ratio (new / old) of each
+
+    Returns
+    =======
+    ratios - list of (case key tuple, float ratio)
+    """
+    with open(old_filename, "r") as f:
+        old = {_case_key(result):result for result in json.load(f)["results"] if result["error"] is None}
+    with open(new_filename, "r") as f:
+        new = [result for result in json.load(f)["results"] if result["error"] is None]
+    ratios = []
+    for result in new:
+        key = _case_key(result)
+        if key in old:
+            ratio = result["throughput_pts_per_sec"] / old[key]["throughput_pts_per_sec"]
+            ratios.append((key, ratio))
+            print("{:<60} {:6.2f}x".format(" ".join(str(k) for k in key), ratio))
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks pytorch_hnet energy modes and nonlinearities on synthetic models shaped like the real ones")
+    parser.add_argument("--out", type=str, default="pytorch_hnet_bench.json", help="results file (json)")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS.keys()), default=None)
+    parser.add_argument("--energy-modes", nargs="*", choices=ENERGY_MODES, default=None)
+    parser.add_argument("--nonlinearity-modes", nargs="*", choices=NONLINEARITY_MODES, default=None)
+    parser.add_argument("--quick", action="store_true", help="smaller sweeps")
+    parser.add_argument("--repeats", type=int, default=10, help="max timed calls per case")
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="time budget per case")
+    parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads")
+    parser.add_argument("--not-isolated", action="store_true", help="run all cases in this process (faster, but peak rss is cumulative)")
+    parser.add_argument("--compare", type=str, default=None, help="an older results file to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scenarios, args.energy_modes, args.nonlinearity_modes, args.quick, args.repeats, args.max_seconds, args.threads, is_isolated=not args.not_isolated)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=1)
+    print("wrote " + args.out)
+    if args.compare is not None:
+        compare_results(args.compare, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,649 @@
+#!/usr/bin/python3
+# Native python dataset loaders for the pytorch-based HNet inference engine (pytorch_hnet.py): binarizes CLEVR and UCI credit data the way the matlab frontends do, without a matlab export step
+# Copyright Brain Engineering Lab at Dartmouth. All rights reserved.
+# Please feel free to use this code for any non-commercial purpose under the CC Attribution-NonCommercial-ShareAlike license: https://creativecommons.org/licenses/by-nc-sa/4.0/
+#   Rodriguez A, Bowen EFW, Granger R (2022) https://github.com/DartmouthGrangerLab/hnet
+#   Bowen, EFW, Granger, R, Rodriguez, A (2023). A logical re-conception of neural networks: Hamiltonian bitwise part-whole architecture. Presented at AAAI EDGeS 2023.
+"""
+CALLABLE FUNCTIONS:
+    load_clevr(scenes_filename:str, image_dir:str=None, downsample:int=4, n_workers:int=None, use_processes:bool=True) -> dict
+    iter_clevr(scenes_filename:str, image_dir:str=None, batch_size:int=64, downsample:int=4, n_workers:int=None, use_processes:bool=True, prefetch:int=2, chan_max:np.ndarray=None) -> generator of np.ndarray
+    load_clevr_positions(config_filename:str) -> dict
+    load_german_credit(is_trn:bool, path:str=None, seed:int=77) -> dict
+    write_dataset_bin(filename:str, dataset:dict) -> None
+    read_dataset_bin(filename:str) -> dict
+    iter_dataset_bin(filename:str, batch_size:int=1024, prefetch:int=2) -> generator of np.ndarray
+    cached_dataset(filename:str, load_fn, *args, **kwargs) -> dict
+    main() -> None
+
+DATASETS:
+    every loader returns a dict in the format Export2JSON.m writes (and hnet._load_dataset reads):
+        {"comment":, "name": <frontend spec>, "split":, "data": n_pts x n_nodes (ndarray[bool]), "label_idx": n_pts (ndarray, 1-based class, or empty), <other metadata>}
+    node order matches the matlab frontends (matlab's column-major reshape of each datapoint), so models trained in matlab apply directly
+
+USAGE:
+    python pytorch_hnet_data.py ucicreditgerman --split trn --out ucicreditgerman_trn.dataset.bin
+    python pytorch_hnet_data.py clevr --scenes ../datasets/custom_clevr/customclevr_trnsimple_scenes.json --out clevr_trn.dataset.bin [--n-workers 8]
+    python pytorch_hnet_data.py clevrpossimple --config ../datasets/custom_clevr/customclevr_trnsimple_config.json --out clevrpos_trn.dataset.bin
+    then: hnet.evaluate_streaming(model, iter_dataset_bin("clevr_trn.dataset.bin"))
+"""
+import os
+import json
+import zlib
+import queue
+import struct
+import argparse
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+import pytorch_hnet as hnet
+
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets")
+CLEVR_CHAN_NAMES = ["red", "green", "blue", "yellow", "magenta", "cyan"] # color-opponent channels, see _clevr_color_channels()
+CLEVR_CHAN_DIRS = ["left", "right", "top", "bottom"] # edge direction channels, see _binarize_clevr_image()
+CLEVR_THRESH = 0.45 # min (normalized) color similarity for a pixel to count as its best color
+CLEVR_EXCLUDED_COLORS = ["gray", "brown"] # images containing an object of these colors are dropped (as in LoadAndBinarizeCLEVR.m)
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+_PNG_CHANNELS = {0:1, 2:3, 4:2, 6:4} # color type --> n channels (gray, rgb, gray+alpha, rgba)
+
+
+# === FILE-PRIVATE FUNCTIONS ===
+
+
+def _read_png(filename:str) -> np.ndarray:
+    """
+    decodes a non-interlaced 8-bit png (gray, gray+alpha, rgb, or rgba) with zlib and numpy only
+
+    Inputs
+    ======
+    filename - (str)
+
+    Returns
+    =======
+    img - height x width x n_channels (ndarray[uint8])
+    """
+    with open(filename, "rb") as f:
+        buf = f.read()
+    if buf[:8] != _PNG_MAGIC:
+        raise Exception("file " + filename + " is not a png")
+    pos = 8
+    idat = []
+    while pos < len(buf):
+        n_bytes, = struct.unpack(">I", buf[pos:pos+4])
+        chunk_type = buf[pos+4:pos+8]
+        if chunk_type == b"IHDR":
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", buf[pos+8:pos+21])
+        elif chunk_type == b"IDAT":
+            idat.append(buf[pos+8:pos+8+n_bytes])
+        elif chunk_type == b"IEND":
+            break
+        pos += 12 + n_bytes # length, type, data, crc
+    if bit_depth != 8 or color_type not in _PNG_CHANNELS or interlace != 0:
+        raise Exception("unsupported png {} (bit depth {}, color type {}, interlace {})".format(filename, bit_depth, color_type, interlace))
+    n_chan = _PNG_CHANNELS[color_type]
+    raw = np.frombuffer(zlib.decompress(b"".join(idat)), dtype=np.uint8).reshape(height, 1 + width * n_chan)
+    return _png_unfilter(raw[:,0], raw[:,1:].reshape(height, width, n_chan))
+
+
+def _png_unfilter(filter_type:np.ndarray, filtered:np.ndarray) -> np.ndarray:
+    """
+    reverses png's per-row filters
+    each pixel depends on its left, upper, and upper-left neighbors, so pixels on the same anti-diagonal are independent: we sweep the height + width - 1 anti-diagonals, each vectorized over its pixels (and all 5 filter types)
+
+    Inputs
+    ======
+    filter_type - height (ndarray[uint8]) 0=none, 1=sub, 2=up, 3=average, 4=paeth
+    filtered    - height x width x n_channels (ndarray[uint8])
+
+    Returns
+    =======
+    img - height x width x n_channels (ndarray[uint8])
+    """
+    height, width, n_chan = filtered.shape
+    if np.all(filter_type == 0):
+        return filtered.copy()
+    filtered = filtered.astype(np.int16)
+    recon = np.zeros((height + 1, width + 1, n_chan), dtype=np.int16) # padded with a zero row above and a zero column to the left
+    for d in range(height + width - 1):
+        r = np.arange(max(0, d - width + 1), min(height - 1, d) + 1)
+        c = d - r
+        a = recon[r+1,c] # left
+        b = recon[r,c+1] # up
+        ab = recon[r,c] # upper-left
+        p = a + b - ab
+        pa = np.abs(p - a)
+        pb = np.abs(p - b)
+        pc = np.abs(p - ab)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, ab))
+        pred = np.choose(filter_type[r,None].astype(np.intp), [np.zeros_like(a), a, b, (a + b) >> 1, paeth])
+        recon[r+1,c+1] = (filtered[r,c] + pred) & 255
+    return recon[1:,1:].astype(np.uint8)
+
+
+def _load_clevr_scenes(scenes_filename:str, image_dir:str) -> tuple:
+    """
+    reads a CLEVR scenes json, dropping images that contain CLEVR_EXCLUDED_COLORS objects
+
+    Returns
+    =======
+    filenames - n (list of str) full image file names
+    image_idx - n (ndarray[int64]) scene image_index
+    split     - (str)
+    """
+    if image_dir is None:
+        image_dir = os.path.join(os.path.dirname(scenes_filename), "images")
+    with open(scenes_filename, "r") as f:
+        scenes = json.load(f)["scenes"]
+    scenes = [s for s in scenes if not any(obj["color"] in CLEVR_EXCLUDED_COLORS for obj in s["objects"])]
+    filenames = [os.path.join(image_dir, s["image_filename"]) for s in scenes]
+    image_idx = np.array([s["image_index"] for s in scenes], dtype=np.int64)
+    split = scenes[0]["split"] if len(scenes) > 0 else ""
+    return filenames, image_idx, split
+
+
+def _clevr_color_channels(filename:str, downsample:int) -> np.ndarray:
+    """
+    loads one CLEVR image and computes its (not yet normalized) color-opponent channels, as in LoadAndBinarizeCLEVR.m
+    images are shrunk by averaging downsample x downsample blocks (matlab's imresize is bicubic, so values differ slightly from matlab's)
+
+    Returns
+    =======
+    way1img - height/downsample x width/downsample x 6 (ndarray[double]) see CLEVR_CHAN_NAMES
+    """
+    img = _read_png(filename)[:,:,0:3].astype(np.float64) / 255 # im2double, dropping alpha
+    if downsample > 1:
+        height = img.shape[0] // downsample
+        width = img.shape[1] // downsample
+        img = img[0:height*downsample,0:width*downsample].reshape(height, downsample, width, downsample, 3).mean(axis=(1,3))
+    r = img[:,:,0]
+    g = img[:,:,1]
+    b = img[:,:,2]
+    way1img = np.stack([
+        r - (g + b) / 2, # red vs rest
+        g - (r + b) / 2,
+        b - (r + g) / 2,
+        (r + g) / 2 - g, # (sic, as in LoadAndBinarizeCLEVR.m)
+        (r + b) / 2 - g, # hopefully covers "purple"
+        (g + b) / 2 - r], axis=2)
+    return np.maximum(way1img, 0)
+
+
+def _clevr_chan_max_worker(task:tuple) -> np.ndarray:
+    filename, downsample = task
+    return _clevr_color_channels(filename, downsample).max(axis=(0,1))
+
+
+def _clevr_chan_max(executor:concurrent.futures.Executor, filenames:list, downsample:int) -> np.ndarray:
+    """per-channel max of the color-opponent channels over the whole dataset (LoadAndBinarizeCLEVR.m's first normalization), 6 (ndarray[double])"""
+    if len(filenames) == 0:
+        return np.ones(len(CLEVR_CHAN_NAMES))
+    return np.max(np.stack(list(executor.map(_clevr_chan_max_worker, [(fn, downsample) for fn in filenames]))), axis=0)
+
+
+def _binarize_clevr_image(task:tuple) -> np.ndarray:
+    """
+    binarizes one CLEVR image into 24 channels: for each color channel, whether each pixel is the left / right / top / bottom edge of a region of that color
+
+    Inputs
+    ======
+    task - (tuple) filename (str), downsample (int), chan_max (6 ndarray) per-channel max over the whole dataset
+
+    Returns
+    =======
+    pixels - n_nodes (ndarray[bool]) in matlab's column-major order of the height x width x 24 image (channels are CLEVR_CHAN_DIRS-major)
+    """
+    filename, downsample, chan_max = task
+    way1img = _clevr_color_channels(filename, downsample)
+    way1img = way1img / np.where(chan_max > 0, chan_max, 1) # first, normalize each color channel
+    img_max = way1img.max()
+    if img_max > 0:
+        way1img = way1img / img_max # second, normalize each image competitively
+    best = np.argmax(way1img, axis=2) # max because this is similarity
+    temp = (np.arange(way1img.shape[2]) == best[:,:,None]) & (way1img >= CLEVR_THRESH)
+
+    left   = np.zeros_like(temp)
+    right  = np.zeros_like(temp)
+    top    = np.zeros_like(temp)
+    bottom = np.zeros_like(temp)
+    left[:,:-1]   = temp[:,:-1] < temp[:,1:]
+    right[:,:-1]  = temp[:,1:] < temp[:,:-1]
+    top[:-1,:]    = temp[:-1,:] < temp[1:,:]
+    bottom[:-1,:] = temp[1:,:] < temp[:-1,:]
+    img = np.concatenate([left, right, top, bottom], axis=2)
+    return img.transpose(2, 1, 0).reshape(-1) # column-major, like matlab's reshape(img, [], n)
+
+
+def _make_executor(n_workers:int, use_processes:bool) -> concurrent.futures.Executor:
+    if use_processes:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+
+
+def _ordered_map(executor:concurrent.futures.Executor, fn, tasks, max_in_flight:int):
+    """like executor.map(fn, tasks), but submits at most max_in_flight tasks ahead of the consumer (bounded memory for large datasets)"""
+    in_flight = collections.deque()
+    for task in tasks:
+        in_flight.append(executor.submit(fn, task))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+    while len(in_flight) > 0:
+        yield in_flight.popleft().result()
+
+
+def _prefetch(batches, prefetch:int):
+    """
+    runs a generator of minibatches on a background thread, up to prefetch minibatches ahead of the consumer (so i/o and decoding overlap with evaluation)
+    exceptions raised by the generator are re-raised in the consumer
+    """
+    assert prefetch > 0
+    done = object()
+    q = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    def put(x) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(x, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def producer():
+        try:
+            for x in batches:
+                if not put(x):
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+        finally:
+            if hasattr(batches, "close"):
+                batches.close() # (shuts down e.g. iter_clevr's worker pool if the consumer stopped early)
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            x = q.get()
+            if x is done:
+                return
+            if isinstance(x, BaseException):
+                raise x
+            yield x
+    finally:
+        stop.set() # (if the consumer stopped early)
+
+
+def _equalize_n(label_idx:np.ndarray, rng:np.random.Generator) -> np.ndarray:
+    """python port of EqualizeN.m: randomly subsets each class (to the rarest class's N), returning sorted indices"""
+    uniq_labels = np.unique(label_idx)
+    n = min(np.sum(label_idx == label) for label in uniq_labels)
+    idx = [rng.choice(np.flatnonzero(label_idx == label), n, replace=False) for label in uniq_labels]
+    return np.sort(np.concatenate(idx))
+
+
+def _rand_subset_dataset(label_idx:np.ndarray, frac:float, rng:np.random.Generator) -> np.ndarray:
+    """python port of RandSubsetDataset.m: a random frac of each class's datapoints (class by class, unsorted)"""
+    idx = []
+    for label in np.unique(label_idx):
+        cat_idx = np.flatnonzero(label_idx == label)
+        n_keep = int(np.floor(len(cat_idx) * frac + 0.5)) # matlab's round()
+        idx.append(cat_idx[rng.permutation(len(cat_idx))[0:n_keep]])
+    return np.concatenate(idx)
+
+
+def _scalar_to_spatial_spike(x:np.ndarray, n_spatial_stops:int) -> np.ndarray:
+    """
+    python port of encode.TransformScalar2SpatialScalar() followed by encode.TransformScalar2SpikeViaKWTA(data, 1, 2, []): range-normalizes x, then one-hot encodes its nearest gaussian receptive field
+
+    Inputs
+    ======
+    x               - n (ndarray[numeric])
+    n_spatial_stops - (int)
+
+    Returns
+    =======
+    code - n x n_spatial_stops (ndarray[bool])
+    """
+    x = x.astype(np.float64)
+    x_range = x.max() - x.min()
+    x = (x - x.min()) / x_range if x_range > 0 else np.zeros_like(x) # normalize(x, "range")
+    mu = np.arange(1, n_spatial_stops + 1) / n_spatial_stops
+    sigma = mu / 2
+    response = np.exp(-0.5 * ((x[:,None] - mu) / sigma) ** 2) # normpdf(x, mu, sigma) / normpdf(mu, mu, sigma); note there is no detector for scalar=0, by preference
+    return np.arange(n_spatial_stops) == np.argmax(response, axis=1)[:,None]
+
+
+def _pack_rows(data:np.ndarray) -> np.ndarray:
+    return np.packbits(np.asarray(data, dtype=bool), axis=1, bitorder="little")
+
+
+def _unpack_rows(data_packbits:np.ndarray, n_nodes:int) -> np.ndarray:
+    return np.unpackbits(data_packbits, axis=1, count=n_nodes, bitorder="little").view(bool)
+
+
+# === CALLABLE FUNCTIONS ===
+
+
+def load_clevr(scenes_filename:str, image_dir:str=None, downsample:int=4, n_workers:int=None, use_processes:bool=True) -> dict:
+    """
+    loads and binarizes a CLEVR-format dataset (e.g. datasets/custom_clevr), decoding images in a pool of workers
+    equivalent to LoadAndBinarizeCLEVR.m + LoadCLEVR.m (without LoadCLEVR.m's truncation to 100 images, or Dataset.m's foveation)
+
+    Inputs
+    ======
+    scenes_filename - (str) e.g. "../datasets/custom_clevr/customclevr_trnsimple_scenes.json"
+    image_dir       - OPTIONAL (str) default = "images" next to the scenes file
+    downsample      - OPTIONAL (int) images are shrunk by this factor in each dimension (matlab uses 0.25 scale)
+    n_workers       - OPTIONAL (int) default = os.cpu_count()
+    use_processes   - OPTIONAL (bool) if False, decode on threads instead of processes (e.g. when embedded in matlab)
+
+    Returns
+    =======
+    dataset - (dict) see DATASETS in the module docstring, plus:
+        "image_idx"  - n_pts (ndarray[int64])
+        "img_sz"     - [height, width, 24]
+        "chan_color" - 24 (list of str)
+        "chan_dir"   - 24 (list of str)
+        "chan_max"   - 6 (ndarray[double]) per color channel normalization (pass to iter_clevr() to binarize another split the same way)
+    """
+    filenames, image_idx, split = _load_clevr_scenes(scenes_filename, image_dir)
+    with _make_executor(n_workers, use_processes) as executor:
+        chan_max = _clevr_chan_max(executor, filenames, downsample)
+        data = list(executor.map(_binarize_clevr_image, [(fn, downsample, chan_max) for fn in filenames]))
+    n_chan = len(CLEVR_CHAN_DIRS) * len(CLEVR_CHAN_NAMES)
+    img_sz = [0, 0, n_chan]
+    if len(filenames) > 0:
+        height, width = _read_png(filenames[0]).shape[0:2]
+        img_sz = [height // downsample, width // downsample, n_chan]
+    data = np.stack(data) if len(data) > 0 else np.zeros((0, img_sz[0] * img_sz[1] * n_chan), dtype=bool)
+    return {
+        "comment": "binarized by pytorch_hnet_data.load_clevr from " + os.path.basename(scenes_filename),
+        "name": "clevr",
+        "split": split,
+        "data": data,
+        "label_idx": np.zeros(0),
+        "image_idx": image_idx,
+        "img_sz": img_sz,
+        "chan_color": CLEVR_CHAN_NAMES * len(CLEVR_CHAN_DIRS),
+        "chan_dir": [d for d in CLEVR_CHAN_DIRS for _ in CLEVR_CHAN_NAMES],
+        "chan_max": chan_max,
+    }
+
+
+def iter_clevr(scenes_filename:str, image_dir:str=None, batch_size:int=64, downsample:int=4, n_workers:int=None, use_processes:bool=True, prefetch:int=2, chan_max:np.ndarray=None):
+    """
+    like load_clevr(), but streams binarized minibatches (in order) while later images are still being decoded, e.g. into hnet.evaluate_streaming()
+    without chan_max, a first pass over the images computes it (decoding each image twice)
+
+    Inputs
+    ======
+    see load_clevr(), plus:
+    batch_size - OPTIONAL (int) datapoints per yielded minibatch
+    prefetch   - OPTIONAL (int) minibatches decoded ahead of the consumer
+    chan_max   - OPTIONAL 6 (ndarray) per color channel normalization, e.g. load_clevr(...)["chan_max"] of the training split
+
+    Returns
+    =======
+    generator of n x n_nodes (ndarray[bool]) minibatches
+    """
+    assert batch_size > 0
+    filenames, _, _ = _load_clevr_scenes(scenes_filename, image_dir)
+    def batches():
+        with _make_executor(n_workers, use_processes) as executor:
+            curr_chan_max = chan_max
+            if curr_chan_max is None:
+                curr_chan_max = _clevr_chan_max(executor, filenames, downsample)
+            tasks = ((fn, downsample, curr_chan_max) for fn in filenames)
+            batch = []
+            for pixels in _ordered_map(executor, _binarize_clevr_image, tasks, batch_size * prefetch):
+                batch.append(pixels)
+                if len(batch) == batch_size:
+                    yield np.stack(batch)
+                    batch = []
+            if len(batch) > 0:
+                yield np.stack(batch)
+    return _prefetch(batches(), prefetch)
+
+
+def load_clevr_positions(config_filename:str) -> dict:
+    """
+    python port of LoadCLEVRPos.m: for each color, which 10x10-pixel bucket contains an object of that color (from the scene generator's config, no images needed)
+
+    Inputs
+    ======
+    config_filename - (str) e.g. "../datasets/custom_clevr/customclevr_trnsimple_config.json"
+
+    Returns
+    =======
+    dataset - (dict) see DATASETS in the module docstring, plus:
+        "node_name"          - n_nodes (list of str) as in LoadCLEVRPos.m
+        "nodeobjidxstate"    - n_pts x n_nodes (ndarray[int8]) 1-based index of the object at each node, or 0
+        "is_face"            - n_pts (ndarray[bool])
+        "eyes_same_color"    - n_pts (ndarray[bool])
+        "randomized_obj_idx" - n_pts (ndarray[int64])
+        "n_objects"          - (int)
+    """
+    with open(config_filename, "r") as f:
+        s = json.load(f)
+    colors = list(s["colors"].keys())
+    bucketr = np.arange(0, 241, 10) # there are 25 of these
+    bucketc = np.arange(0, 321, 10) # there are 33 of these
+    n_images = int(s["n_images"])
+    n_objects = int(s["n_objects"])
+    pixel_coords_r = np.array(s["pixel_coords_y"]) # n_images x n_objects
+    pixel_coords_c = np.array(s["pixel_coords_x"])
+    r = pixel_coords_r // 10 - 1 # (matlab used floor(coord/10) as a 1-based index)
+    c = pixel_coords_c // 10 - 1
+    assert np.all(r >= 0) and np.all(c >= 0), "objects within 10 pixels of the top or left edge aren't supported (nor were they in matlab)"
+    nodestates = np.zeros((n_images, len(colors), len(bucketc), len(bucketr)), dtype=bool) # (reverse of matlab's dimension order, so a row-major reshape matches matlab's column-major one)
+    nodeobjidxstate = np.zeros(nodestates.shape, dtype=np.int8)
+    for clr_idx, color in enumerate(colors):
+        for img_idx in range(n_images):
+            for obj_idx in range(n_objects):
+                if s["color_name"][img_idx][obj_idx] == color:
+                    nodestates[img_idx,clr_idx,c[img_idx,obj_idx],r[img_idx,obj_idx]] = True
+                    nodeobjidxstate[img_idx,clr_idx,c[img_idx,obj_idx],r[img_idx,obj_idx]] = obj_idx + 1
+    # (LoadCLEVRPos.m builds its bucketr/bucketc metadata with meshgrid(bucketc, bucketr), so names carry the column bucket after "r" and the row bucket after "c")
+    node_name = ["r{}c{}clr{}".format(bucketc[j], bucketr[i], clr_idx + 1) for clr_idx in range(len(colors)) for j in range(len(bucketc)) for i in range(len(bucketr))]
+    return {
+        "comment": "converted by pytorch_hnet_data.load_clevr_positions from " + os.path.basename(config_filename),
+        "name": "clevrpossimple",
+        "split": s["split"],
+        "data": nodestates.reshape(n_images, -1),
+        "label_idx": np.zeros(0),
+        "node_name": node_name,
+        "nodeobjidxstate": nodeobjidxstate.reshape(n_images, -1),
+        "is_face": np.arange(n_images) % 2 == 0, # (odd in matlab's 1-based indexing)
+        "eyes_same_color": np.array(s["eyes_same_color"], dtype=bool),
+        "randomized_obj_idx": np.array(s["randomized_obj_idx"], dtype=np.int64),
+        "n_objects": n_objects,
+    }
+
+
+def load_german_credit(is_trn:bool, path:str=None, seed:int=77) -> dict:
+    """
+    python port of LoadCredit.m for "ucicreditgerman" (with io.LoadCredit): one-hot categorical attributes, integer-valued attributes, and 5-stop spatial codes of the continuous attributes
+    reads german.txt (the categorical version of the dataset, as matlab does); german-numeric.csv's recoding drops the category names
+    the class balancing and 50/50 trn/tst split follow EqualizeN.m and RandSubsetDataset.m, but with numpy's rng, so the split differs from matlab's
+
+    Inputs
+    ======
+    is_trn - (bool)
+    path   - OPTIONAL (str) directory containing german.txt, default = datasets/credit/uci_statlog_german_credit
+    seed   - OPTIONAL (int) for the class balancing and trn/tst split
+
+    Returns
+    =======
+    dataset - (dict) see DATASETS in the module docstring, plus:
+        "node_name"    - n_nodes (list of str) as in LoadCredit.m
+        "uniq_classes" - ["good", "bad"]
+    """
+    if path is None:
+        path = os.path.join(DATASET_DIR, "credit", "uci_statlog_german_credit")
+    var_names = ["a1_idx","a2_duration","a3_idx","a4_idx","a5_creditscore","a6_idx","a7_idx","a8_percent","a9_idx","a10_idx","a11_presentresidencesince","a12_idx","a13_age","a14_idx","a15_idx","a16_ncredits","a17_idx","a18_ndependents","a19_hasphone","a20_isforeign","dv"]
+    with open(os.path.join(path, "german.txt"), "r") as f:
+        rows = [line.split() for line in f if len(line.strip()) > 0]
+    t = {name: [row[j] for row in rows] for j, name in enumerate(var_names)}
+
+    # convert binary vars to logical datatype, and numeric vars to numbers
+    t_bin = collections.OrderedDict() # columns in io.LoadCredit's t_bin order: non-categorical vars, then the binarized categorical vars
+    for name in var_names:
+        if name == "a19_hasphone":
+            t_bin[name] = np.array([x == "A192" for x in t[name]])
+        elif name == "a20_isforeign":
+            t_bin[name] = np.array([x == "A201" for x in t[name]])
+        elif not name.endswith("_idx"):
+            t_bin[name] = np.array(t[name], dtype=np.int64)
+    t_bin["dv"] = t_bin["dv"] - 1 # 1 = good, 2 = bad
+    for i in [1,3,4,6,7,9,10,12,14,15,17]: # binarize categorical vars
+        var_name = "a" + str(i)
+        values = np.array(t[var_name + "_idx"])
+        for uniq_value in sorted(set(values)):
+            t_bin[var_name + "_" + uniq_value] = (values == uniq_value)
+
+    # equalize n, then split trn from tst (keeping dv balanced)
+    rng = np.random.default_rng(seed)
+    idx = _equalize_n(t_bin["dv"], rng)
+    t_bin = collections.OrderedDict((name, col[idx]) for name, col in t_bin.items())
+    idx = _rand_subset_dataset(t_bin["dv"], 0.5, rng)
+    if not is_trn:
+        idx = np.setdiff1d(np.arange(len(t_bin["dv"])), idx)
+    t_bin = collections.OrderedDict((name, col[idx]) for name, col in t_bin.items())
+
+    label_idx = t_bin.pop("dv") + 1
+
+    # logical fields first, then encodings of the non-logical fields
+    node_name = [name for name, col in t_bin.items() if col.dtype == bool]
+    pixels = [t_bin[name][:,None] for name in node_name]
+    n_spatial_stops = 5
+    for var_name, col in t_bin.items():
+        if col.dtype == bool:
+            continue
+        if var_name in ["a8_percent", "a11_presentresidencesince"]: # (LoadCredit.m also lists "16_ncredits" here, which never matches a16_ncredits, so that one gets the spatial code)
+            # integer values 1,2,3,4 - treat as categorical
+            pixels.append(col[:,None] == np.arange(1, 5))
+            node_name.extend(var_name + "_" + str(k) for k in range(1, 5))
+        elif var_name == "a18_ndependents": # takes integer values 1,2 - treat as binary
+            pixels.append(col[:,None] == 2)
+            node_name.append(var_name)
+        else:
+            pixels.append(_scalar_to_spatial_spike(col, n_spatial_stops))
+            node_name.extend(var_name + "_" + str(k) for k in range(1, n_spatial_stops + 1))
+
+    return {
+        "comment": "binarized by pytorch_hnet_data.load_german_credit",
+        "name": "ucicreditgerman",
+        "split": "trn" if is_trn else "tst",
+        "data": np.concatenate(pixels, axis=1),
+        "label_idx": label_idx,
+        "node_name": node_name,
+        "uniq_classes": ["good", "bad"],
+    }
+
+
+def write_dataset_bin(filename:str, dataset:dict) -> None:
+    """
+    writes a dataset to hnet's binary container (see hnet.convert_json_to_bin), with data bit-packed (8 nodes per byte, each row padded to a whole byte)
+    hnet._load_dataset() and read_dataset_bin() read the file back; iter_dataset_bin() streams it
+
+    Inputs
+    ======
+    filename - (str) should end with ".dataset.bin"
+    dataset  - (dict) see DATASETS in the module docstring; data must be binary
+    """
+    data = np.asarray(dataset["data"])
+    assert data.ndim == 2
+    assert np.all((data == 0) | (data == 1)), "data must be binary to be bit-packed"
+    info = {key: (val.tolist() if isinstance(val, np.ndarray) and val.ndim == 0 else val) for key, val in dataset.items() if key != "data"}
+    info["n_nodes"] = int(data.shape[1])
+    info["data_packbits"] = _pack_rows(data)
+    info["label_idx"] = np.asarray(dataset["label_idx"])
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    hnet._write_bin(tmp_filename, info)
+    os.replace(tmp_filename, filename) # (atomic, so concurrent runs never see a partial file)
+
+
+def read_dataset_bin(filename:str) -> dict:
+    """
+    reads a file written by write_dataset_bin()
+
+    Returns
+    =======
+    dataset - (dict) as written, with "data" unpacked to n_pts x n_nodes (ndarray[bool]) and "data_packbits" the memory-mapped packed rows
+    """
+    dataset = hnet._read_bin(filename)
+    assert "data_packbits" in dataset, "file " + filename + " has no bit-packed data (not written by write_dataset_bin)"
+    dataset["data"] = _unpack_rows(dataset["data_packbits"], dataset["n_nodes"])
+    return dataset
+
+
+def iter_dataset_bin(filename:str, batch_size:int=1024, prefetch:int=2):
+    """
+    streams a file written by write_dataset_bin() as unpacked minibatches, unpacking (and paging in) the next minibatches on a background thread while the current one is evaluated
+    e.g. hnet.evaluate_streaming(model, iter_dataset_bin(filename))
+
+    Inputs
+    ======
+    filename   - (str)
+    batch_size - OPTIONAL (int)
+    prefetch   - OPTIONAL (int) minibatches unpacked ahead of the consumer
+
+    Returns
+    =======
+    generator of n x n_nodes (ndarray[bool]) minibatches
+    """
+    assert batch_size > 0
+    dataset = hnet._read_bin(filename)
+    data_packbits = dataset["data_packbits"]
+    n_nodes = dataset["n_nodes"]
+    batches = (_unpack_rows(data_packbits[i:i+batch_size], n_nodes) for i in range(0, data_packbits.shape[0], batch_size))
+    return _prefetch(batches, prefetch)
+
+
+def cached_dataset(filename:str, load_fn, *args, **kwargs) -> dict:
+    """
+    returns read_dataset_bin(filename) if the file exists, else load_fn(*args, **kwargs), after writing it to filename
+    the cache is keyed only by filename: include the loader's parameters in the name, and delete the file when the source data change
+
+    Inputs
+    ======
+    filename - (str) should end with ".dataset.bin"
+    load_fn  - (function) one of the loaders above (or any function returning a dataset dict)
+
+    Returns
+    =======
+    dataset - (dict)
+    """
+    if os.path.isfile(filename):
+        return read_dataset_bin(filename)
+    dataset = load_fn(*args, **kwargs)
+    write_dataset_bin(filename, dataset)
+    return dataset
+
+
+def main():
+    """main function: binarizes a dataset to a bit-packed .dataset.bin file (see USAGE in the module docstring)"""
+    parser = argparse.ArgumentParser(description="binarize a dataset for pytorch_hnet")
+    parser.add_argument("dataset", choices=["ucicreditgerman", "clevr", "clevrpossimple"])
+    parser.add_argument("--out", required=True, help="output file name, ending in .dataset.bin")
+    parser.add_argument("--split", choices=["trn", "tst"], default="trn", help="ucicreditgerman only")
+    parser.add_argument("--scenes", help="clevr only: CLEVR scenes json")
+    parser.add_argument("--image-dir", help="clevr only: default = images next to the scenes json")
+    parser.add_argument("--downsample", type=int, default=4, help="clevr only")
+    parser.add_argument("--n-workers", type=int, default=None, help="clevr only")
+    parser.add_argument("--config", help="clevrpossimple only: custom CLEVR generator config json")
+    args = parser.parse_args()
+
+    if args.dataset == "ucicreditgerman":
+        dataset = load_german_credit(args.split == "trn")
+    elif args.dataset == "clevr":
+        dataset = load_clevr(args.scenes, args.image_dir, args.downsample, args.n_workers)
+    else:
+        dataset = load_clevr_positions(args.config)
+    write_dataset_bin(args.out, dataset)
+    print("wrote {} datapoints x {} nodes to {}".format(dataset["data"].shape[0], dataset["data"].shape[1], args.out))
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/python3
+# Graph builder for the pytorch-based HNet inference engine (pytorch_hnet.py): derives each bank's edges and composite Hamiltonians from its graph metadata and learned edge states, so model files don't need to carry them
+# Copyright Brain Engineering Lab at Dartmouth. All rights reserved.
+# Please feel free to use this code for any non-commercial purpose under the CC Attribution-NonCommercial-ShareAlike license: https://creativecommons.org/licenses/by-nc-sa/4.0/
+#   Rodriguez A, Bowen EFW, Granger R (2022) https://github.com/DartmouthGrangerLab/hnet
+#   Bowen, EFW, Granger, R, Rodriguez, A (2023). A logical re-conception of neural networks: Hamiltonian bitwise part-whole architecture. Presented at AAAI EDGeS 2023.
+"""
+CALLABLE FUNCTIONS:
+    neighbor_pairs(graph_type:int, n_nodes:int, img_sz:list=None) -> np.ndarray
+    identify_graph(edge_endnode_idx:np.ndarray, n_nodes:int) -> (int, list)
+    composite_h_coo(learned_edge_states:np.ndarray, edge_endnode_idx:np.ndarray, n_nodes:int) -> (np.ndarray, np.ndarray)
+    composite_k(learned_edge_states:np.ndarray) -> np.ndarray
+    complete_compbank_info(compbank_info:dict, is_h_needed:bool=True) -> dict
+    compact_model_info(model_info:dict) -> dict
+    main() -> None
+
+COMPACT MODEL FILES:
+    a bank with a "graph_type" field (GRF enum, plus "img_sz" = [n_rows,n_cols,n_chan] for grids, or "n_nodes" otherwise) may omit "edge_endnode_idx", "h", "h_coo" and "k"
+    pytorch_hnet.py fills them in when the model is constructed (see complete_compbank_info), building h only for the hamiltonian energy mode
+
+USAGE:
+    python pytorch_hnet_graph.py model.hnetmodel.json --out model_compact.hnetmodel.bin
+"""
+import json
+import argparse
+import hashlib
+import functools
+import collections
+import numpy as np
+import torch
+import pytorch_hnet as hnet
+
+
+# composite hamiltonian coefficients per edge state (see EDG.m Op): [a, 2b, c, k] for a*src^2 + 2b*src*dst + c*dst^2 + k
+EDG_OP = np.array([[ 0, 0, 0, 0],  # T
+                   [ 1,-1, 1, 0],  # NOR
+                   [ 0, 1,-1, 1],  # NCONV
+                   [ 1, 0, 0, 0],  # NX
+                   [-1, 1, 0, 1],  # NIMPL
+                   [ 0, 0, 1, 0],  # NY
+                   [-1, 2,-1, 1],  # XOR
+                   [ 0, 1, 0, 0],  # NAND
+                   [ 0,-1, 0, 1],  # AND
+                   [ 1,-2, 1, 0],  # NXOR
+                   [ 0, 0,-1, 1],  # Y
+                   [ 1,-1, 0, 0],  # IMPL
+                   [-1, 0, 0, 1],  # X
+                   [ 0,-1, 1, 0],  # CONV
+                   [-1, 1,-1, 1],  # OR
+                   [ 0, 0, 0, 1]]) # F
+
+_H_COO_CACHE_SIZE = 16 # max number of banks' composite hamiltonians kept by composite_h_coo()
+_h_coo_cache = collections.OrderedDict() # hash of (learned_edge_states, edge_endnode_idx, n_nodes) --> (h_coo, k), least recently used first
+
+
+# === FILE-PRIVATE FUNCTIONS ===
+
+
+@functools.lru_cache(maxsize=16)
+def _neighbor_pairs(graph_type:int, n_nodes:int, img_sz:tuple) -> np.ndarray:
+    """neighbor_pairs(), with hashable arguments (cached, so callers must copy the result before changing it)"""
+    if graph_type == hnet.GRF_GRID1D:
+        didx = np.stack((np.arange(n_nodes-1), np.arange(1, n_nodes)), axis=1)
+    elif graph_type == hnet.GRF_GRID2D or graph_type == hnet.GRF_GRID2DMULTICHAN:
+        n_rows, n_cols, n_chan = img_sz
+        assert (n_chan == 1) == (graph_type == hnet.GRF_GRID2D)
+        assert n_nodes == n_rows * n_cols * n_chan
+        idx = np.arange(n_rows*n_cols) # pixels are in column-major order (see PixelRowCol.m)
+        row = idx % n_rows
+        col = idx // n_rows
+        # each node's edge down (+1) sorts before its edge right (+n_rows), so interleaving them keeps NeighborPairs.m's order (by first node, then by second) without sorting
+        candidates = np.stack((np.stack((idx, idx+1), axis=1), np.stack((idx, idx+n_rows), axis=1)), axis=1) # n_pixels x 2 (down, right) x 2
+        is_valid = np.stack((row < n_rows-1, col < n_cols-1), axis=1) # n_pixels x 2
+        didx = candidates[is_valid] # n_edges_per_chan x 2
+        didx = (didx[None,:,:] + (np.arange(n_chan) * (n_rows*n_cols))[:,None,None]).reshape(-1, 2) # not connected across channels
+    elif graph_type == hnet.GRF_FULL:
+        didx = np.stack(np.triu_indices(n_nodes, 1), axis=1)
+    elif graph_type == hnet.GRF_SELF:
+        didx = np.stack((np.arange(n_nodes), np.arange(n_nodes)), axis=1)
+    else:
+        raise Exception("unexpected graph_type")
+    return didx.astype(np.int64)
+
+
+def _n_edges(graph_type:int, n_nodes:int, img_sz:list) -> int:
+    """number of edges neighbor_pairs() would return, without building them"""
+    if graph_type == hnet.GRF_GRID1D:
+        return max(0, n_nodes - 1)
+    elif graph_type == hnet.GRF_GRID2D or graph_type == hnet.GRF_GRID2DMULTICHAN:
+        n_rows, n_cols, n_chan = img_sz
+        return n_chan * ((n_rows - 1) * n_cols + n_rows * (n_cols - 1))
+    elif graph_type == hnet.GRF_FULL:
+        return n_nodes * (n_nodes - 1) // 2
+    elif graph_type == hnet.GRF_SELF:
+        return n_nodes
+    raise Exception("unexpected graph_type")
+
+
+def _is_same_h(h1:torch.Tensor, h2:torch.Tensor) -> bool:
+    """true if two n_cmp x n_nodes x n_nodes hamiltonians (dense or sparse COO) are equal, compared sparsely (a dense copy of a large bank's h may not fit in memory)"""
+    if h1.shape != h2.shape:
+        return False
+    h1 = (h1 if h1.is_sparse else h1.to_sparse()).coalesce()
+    h2 = (h2 if h2.is_sparse else h2.to_sparse()).coalesce()
+    is_nz1 = h1.values() != 0
+    is_nz2 = h2.values() != 0
+    return torch.equal(h1.indices()[:,is_nz1], h2.indices()[:,is_nz2]) and torch.equal(h1.values()[is_nz1], h2.values()[is_nz2])
+
+
+def _graph_n_nodes(compbank_info:dict) -> int:
+    """number of nodes of a bank's graph, from its "img_sz" (grids) or "n_nodes" field"""
+    if int(compbank_info["graph_type"]) in (hnet.GRF_GRID2D, hnet.GRF_GRID2DMULTICHAN):
+        return int(np.prod(compbank_info["img_sz"]))
+    return int(compbank_info["n_nodes"])
+
+
+# === CALLABLE FUNCTIONS ===
+
+
+def neighbor_pairs(graph_type:int, n_nodes:int, img_sz:list=None) -> np.ndarray:
+    """
+    same as NeighborPairs.m (including edge order), but zero-based, and built directly in O(n_edges) instead of from all pairwise pixel distances
+    results are cached
+
+    Inputs
+    ======
+    graph_type - scalar (GRF enum)
+    n_nodes    - scalar (int) number of nodes
+    img_sz     - OPTIONAL unless graph_type is GRF_GRID2D or GRF_GRID2DMULTICHAN; [n_rows,n_cols,n_chan]
+
+    Returns
+    =======
+    didx - n_edges x 2 (ndarray[int64]) node index for each edge
+    """
+    return _neighbor_pairs(int(graph_type), int(n_nodes), None if img_sz is None else tuple(int(x) for x in img_sz)).copy()
+
+
+def identify_graph(edge_endnode_idx:np.ndarray, n_nodes:int):
+    """
+    finds the graph type (and image size) whose neighbor_pairs() are exactly edge_endnode_idx, e.g. to compact a model file (see compact_model_info)
+
+    Inputs
+    ======
+    edge_endnode_idx - n_edges x 2 (ndarray) zero-based node index for each edge
+    n_nodes          - scalar (int) number of nodes
+
+    Returns
+    =======
+    graph_type - scalar (GRF enum) or None if no graph type matches
+    img_sz     - [n_rows,n_cols,n_chan] (list of int) for grids, else None
+    """
+    didx = np.asarray(edge_endnode_idx, dtype=np.int64).reshape(-1, 2)
+    n_nodes = int(n_nodes)
+    candidates = [(hnet.GRF_SELF,None), (hnet.GRF_GRID1D,None), (hnet.GRF_FULL,None)]
+    if didx.shape[0] > 0:
+        n_rows = int(np.max(didx[:,1] - didx[:,0])) # (the edge right of a pixel skips a column of n_rows pixels)
+        if n_rows > 0 and n_nodes % n_rows == 0:
+            for n_chan in range(1, n_nodes // n_rows + 1):
+                if (n_nodes // n_rows) % n_chan == 0:
+                    candidates.append((hnet.GRF_GRID2D if n_chan == 1 else hnet.GRF_GRID2DMULTICHAN, [n_rows, n_nodes // n_rows // n_chan, n_chan]))
+    for graph_type, img_sz in candidates:
+        if _n_edges(graph_type, n_nodes, img_sz) == didx.shape[0] and np.array_equal(neighbor_pairs(graph_type, n_nodes, img_sz), didx):
+            return graph_type, img_sz
+    return None, None
+
+
+def composite_h_coo(learned_edge_states:np.ndarray, edge_endnode_idx:np.ndarray, n_nodes:int):
+    """
+    same as GenerateCompositeH.m for every component of a bank, but returns the nonzeros only (as exported by Export2JSON.m)
+    the results for the last few banks are cached, keyed by their contents
+
+    Inputs
+    ======
+    learned_edge_states - n_cmp x n_edges (ndarray) EDG enum
+    edge_endnode_idx    - n_edges x 2 (ndarray) zero-based node index for each edge
+    n_nodes             - scalar (int)
+
+    Returns
+    =======
+    h_coo - nnz x 4 (ndarray[int32]) [cmp,row,col,val]
+    k     - n_cmp (ndarray[double])
+    """
+    learned_edge_states = np.ascontiguousarray(learned_edge_states, dtype=np.uint8)
+    didx = np.ascontiguousarray(edge_endnode_idx, dtype=np.int64).reshape(-1, 2)
+    n_nodes = int(n_nodes)
+    digest = hashlib.blake2b(np.array(learned_edge_states.shape + (n_nodes,), dtype=np.int64).tobytes(), digest_size=20)
+    digest.update(learned_edge_states.tobytes())
+    digest.update(didx.tobytes())
+    key = digest.digest()
+    if key in _h_coo_cache:
+        _h_coo_cache.move_to_end(key)
+        h_coo, k = _h_coo_cache[key]
+        return h_coo.copy(), k.copy()
+
+    cmp_idx, edge_idx = np.nonzero(learned_edge_states)
+    op = EDG_OP[learned_edge_states[cmp_idx,edge_idx].astype(np.int64)-1] # nnz_edges x 4
+    src = didx[edge_idx,0]
+    dst = didx[edge_idx,1]
+    cmp = np.concatenate((cmp_idx, cmp_idx, cmp_idx))
+    row = np.concatenate((src, src, dst))
+    col = np.concatenate((src, dst, dst))
+    val = np.concatenate((op[:,0], op[:,1], op[:,2]))
+    key_rcv, inverse = np.unique((cmp * n_nodes + row) * n_nodes + col, return_inverse=True) # (sums duplicates, like matlab's sparse())
+    val = np.bincount(inverse.ravel(), weights=val).astype(np.int64)
+    key_rcv = key_rcv[val != 0]
+    val = val[val != 0]
+    h_coo = np.stack((key_rcv // (n_nodes*n_nodes), (key_rcv // n_nodes) % n_nodes, key_rcv % n_nodes, val), axis=1).astype(np.int32)
+    k = composite_k(learned_edge_states)
+
+    _h_coo_cache[key] = (h_coo, k)
+    while len(_h_coo_cache) > _H_COO_CACHE_SIZE:
+        _h_coo_cache.popitem(last=False)
+    return h_coo.copy(), k.copy()
+
+
+def composite_k(learned_edge_states:np.ndarray) -> np.ndarray:
+    """
+    the constant term of each component's composite hamiltonian (see GenerateCompositeH.m), without building h
+
+    Inputs
+    ======
+    learned_edge_states - n_cmp x n_edges (ndarray) EDG enum
+
+    Returns
+    =======
+    k - n_cmp (ndarray[double])
+    """
+    learned_edge_states = np.asarray(learned_edge_states)
+    cmp_idx, edge_idx = np.nonzero(learned_edge_states)
+    op_k = EDG_OP[learned_edge_states[cmp_idx,edge_idx].astype(np.int64)-1,3]
+    return np.bincount(cmp_idx, weights=op_k, minlength=learned_edge_states.shape[0]).astype(np.double)
+
+
+def complete_compbank_info(compbank_info:dict, is_h_needed:bool=True) -> dict:
+    """
+    fills in the fields of one bank of a model file that follow from its graph metadata and learned edge states (see COMPACT MODEL FILES above)
+
+    Inputs
+    ======
+    compbank_info - (dict) one entry of the model file's "layout" list; not modified
+    is_h_needed   - OPTIONAL (bool) if false and the bank has no h, h is left empty (only the hamiltonian energy mode uses it)
+
+    Returns
+    =======
+    compbank_info - (dict) a shallow copy with "edge_endnode_idx", "n_nodes", "k" and ("h_coo" or "h") present
+    """
+    compbank_info = dict(compbank_info)
+    learned_edge_states = np.asarray(compbank_info["learned_edge_states"])
+    if "edge_endnode_idx" not in compbank_info:
+        if "graph_type" not in compbank_info:
+            raise Exception("bank " + str(compbank_info["name"]) + " has neither edge_endnode_idx nor graph_type")
+        compbank_info["n_nodes"] = _graph_n_nodes(compbank_info)
+        compbank_info["edge_endnode_idx"] = neighbor_pairs(compbank_info["graph_type"], compbank_info["n_nodes"], compbank_info.get("img_sz"))
+    elif "n_nodes" not in compbank_info and "graph_type" in compbank_info:
+        compbank_info["n_nodes"] = _graph_n_nodes(compbank_info)
+    has_h = hnet._has_h(compbank_info)
+    if is_h_needed and not has_h:
+        compbank_info["h_coo"], compbank_info["k"] = composite_h_coo(learned_edge_states, compbank_info["edge_endnode_idx"], compbank_info["n_nodes"])
+    elif "k" not in compbank_info:
+        compbank_info["k"] = composite_k(learned_edge_states)
+    if not has_h and not hnet._is_h_coo(compbank_info):
+        compbank_info["h"] = np.zeros((0,compbank_info["n_nodes"],compbank_info["n_nodes"]), dtype=np.single) # (still tells HNetComponentBank the number of nodes)
+    return compbank_info
+
+
+def compact_model_info(model_info:dict) -> dict:
+    """
+    drops every field of each bank that complete_compbank_info() can rebuild exactly: edge_endnode_idx (if it's a standard graph, see identify_graph), and h, h_coo and k (if they're the composite hamiltonians of the learned edge states)
+    banks with non-standard graphs or hamiltonians are kept as they are
+
+    Inputs
+    ======
+    model_info - (dict) as loaded by pytorch_hnet (see hnet._validate_model_info); not modified
+
+    Returns
+    =======
+    model_info - (dict) a copy whose banks have graph metadata ("graph_type", "img_sz" / "n_nodes") instead of the derived fields
+    """
+    model_info = dict(model_info)
+    model_info["layout"] = [dict(compbank_info) for compbank_info in model_info["layout"]]
+    for compbank_info in model_info["layout"]:
+        learned_edge_states = np.asarray(compbank_info["learned_edge_states"])
+        didx = np.asarray(compbank_info["edge_endnode_idx"], dtype=np.int64).reshape(-1, 2)
+        h = hnet._load_h(compbank_info)
+        n_nodes = int(h.shape[1]) if h.dim() == 3 else int(compbank_info.get("n_nodes", int(np.max(didx, initial=-1)) + 1))
+        graph_type, img_sz = identify_graph(didx, n_nodes) # (rather than trusting any graph metadata in the file, since banks can grow nodes after their graph is built)
+        if graph_type is None or not np.array_equal(neighbor_pairs(graph_type, n_nodes, img_sz), didx):
+            continue
+        h_coo, k = composite_h_coo(learned_edge_states, didx, n_nodes)
+        derived_h = hnet._load_h({"h_coo":h_coo, "k":k, "n_nodes":n_nodes})
+        if not (np.array_equal(np.asarray(compbank_info["k"], dtype=np.double).ravel(), k) and (h.shape[0] == 0 or _is_same_h(h, derived_h))):
+            continue
+        for key in ("edge_endnode_idx", "h", "h_coo", "k", "n_nodes"):
+            compbank_info.pop(key, None)
+        compbank_info["graph_type"] = graph_type
+        if img_sz is not None:
+            compbank_info["img_sz"] = [int(x) for x in img_sz]
+        else:
+            compbank_info["n_nodes"] = n_nodes
+    return model_info
+
+
+def main():
+    """writes a compact copy of a model file (see compact_model_info), as json or as the binary format (see hnet.convert_json_to_bin)"""
+    parser = argparse.ArgumentParser(description="drops the fields of a model file that follow from its graphs and learned edge states")
+    parser.add_argument("model", help="a .hnetmodel.json or .hnetmodel.bin file")
+    parser.add_argument("--out", required=True, help="output file, ending in .hnetmodel.json or .hnetmodel.bin")
+    args = parser.parse_args()
+
+    if args.model.endswith(".hnetmodel.bin"):
+        model_info = hnet._validate_model_info(hnet._read_bin(args.model))
+    else:
+        with open(args.model, "r") as f:
+            model_info = hnet._validate_model_info(json.load(f))
+    model_info = compact_model_info(model_info)
+    for compbank_info in model_info["layout"]:
+        print(compbank_info["name"] + ": " + ("compacted" if "graph_type" in compbank_info and "edge_endnode_idx" not in compbank_info else "kept as is (non-standard graph or hamiltonian)"))
+        for key, dtype in hnet._BIN_MODEL_DTYPES.items():
+            if key in compbank_info:
+                compbank_info[key] = np.asarray(compbank_info[key]).astype(dtype)
+    if args.out.endswith(".hnetmodel.bin"):
+        hnet._write_bin(args.out, model_info)
+    else:
+        assert args.out.endswith(".hnetmodel.json")
+        with open(args.out, "w") as f:
+            json.dump(model_info, f, default=lambda x: x.tolist())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+# A long-running local inference server for the pytorch-based HNet inference engine (pytorch_hnet.py), with dynamic micro-batching
+# Copyright Brain Engineering Lab at Dartmouth. All rights reserved.
+# Please feel free to use this code for any non-commercial purpose under the CC Attribution-NonCommercial-ShareAlike license: https://creativecommons.org/licenses/by-nc-sa/4.0/
+#   Rodriguez A, Bowen EFW, Granger R (2022) https://github.com/DartmouthGrangerLab/hnet
+#   Bowen, EFW, Granger, R, Rodriguez, A (2023). A logical re-conception of neural networks: Hamiltonian bitwise part-whole architecture. Presented at AAAI EDGeS 2023.
+"""
+CALLABLE FUNCTIONS:
+    load_model(filename:str, energy_mode:str, calibration_filename:str=None) -> HNetModel|HNetCompiledModel
+    serve(model:HNetModel, host:str="127.0.0.1", port:int=8765, max_batch_size:int=256, max_wait_ms:float=2.0) -> None
+    evaluate_remote(url:str, data) -> np.ndarray
+    main() -> None
+
+USAGE:
+    python pytorch_hnet_server.py --model my.hnetmodel.json --energy-mode bitpacked --calibration-data my_trn.dataset.json [--port 8765] [--max-batch-size 256] [--max-wait-ms 2]
+    python pytorch_hnet_server.py --model my.hnetmodel.pt2 [--port 8765] [--max-batch-size 256] [--max-wait-ms 2]   (compiled and calibrated by hnet.export_compiled_model)
+
+HTTP API:
+    POST /evaluate  body = {"data": [[...], ...]} (application/json) or an .npy file (application/x-npy), n x n_nodes
+                    response = {"output": [[...], ...]} or an .npy file, matching the request's content type
+    GET  /stats     response = {"n_requests":, "n_datapoints":, "n_batches":, "n_errors":, "mean_batch_size":, ...}
+"""
+import io
+import time
+import json
+import queue
+import argparse
+import threading
+import concurrent.futures
+import urllib.request
+import http.server
+import numpy as np
+import torch
+import pytorch_hnet as hnet
+
+
+# === HNET DATA STRUCTURES ===
+
+
+class HNetMicroBatcher:
+    """
+    gathers datapoints submitted concurrently (from any number of threads) into micro-batches, and runs each micro-batch through the model in one call on a single worker thread
+    a micro-batch is run as soon as it holds max_batch_size datapoints, or max_wait_ms after its first request arrived, whichever comes first
+    the model must be calibrated (see hnet.calibrate_energy_offsets), else each datapoint's output would depend on whichever other requests shared its micro-batch
+    """
+    def __init__(self, model:hnet.HNetModel, max_batch_size:int=256, max_wait_ms:float=2.0):
+        assert max_batch_size > 0 and max_wait_ms >= 0
+        if isinstance(model, hnet.HNetCompiledModel):
+            is_calibrated = model.hnet_info["is_calibrated"]
+        else:
+            is_calibrated = all(compbank.energy.energy_offset is not None for compbank in model.compbank_order)
+        if not is_calibrated:
+            raise Exception("the model must be calibrated before serving (see calibrate_energy_offsets), so outputs don't depend on how requests are batched")
+        self.model:hnet.HNetModel = model.to(torch.device("cpu")) # (HNetModel|HNetCompiledModel) calibrated
+        self.max_batch_size:int = int(max_batch_size) # (int) max datapoints per call to the model (a single larger request is run alone)
+        self.max_wait:float = max_wait_ms / 1000 # (float) max seconds a request waits for others to join its micro-batch
+        self.n_nodes:int = model.n_nodes # (int) number of node activations per datapoint, or None if unknown
+        self.requests = queue.Queue() # of (x, future), or None to stop
+        self.pending:list = [] # (x, future) pulled from the queue but deferred to the next micro-batch (different n_nodes)
+        self.lock = threading.Lock() # guards the counters
+        self.n_requests:int = 0
+        self.n_datapoints:int = 0
+        self.n_batches:int = 0
+        self.n_errors:int = 0
+        self.max_batch_size_seen:int = 0
+        self.model_seconds:float = 0.0 # (float) total time spent in the model
+        self.thread = threading.Thread(target=self._run, name="HNetMicroBatcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, x) -> concurrent.futures.Future:
+        """
+        Inputs
+        ======
+        x - n x n_nodes (ndarray|Tensor) one request's datapoints (or n_nodes, for a single datapoint)
+
+        Returns
+        =======
+        future - (concurrent.futures.Future) whose result() is the n x n_out (ndarray) output
+        raises an exception right away if x isn't binary or has the wrong number of nodes, rather than failing the micro-batch it would join
+        """
+        x = torch.as_tensor(np.asarray(x), dtype=torch.float)
+        if x.dim() == 1:
+            x = x.reshape(1, -1)
+        if x.dim() != 2 or x.shape[0] == 0:
+            raise Exception("expected an n x n_nodes array of node activations")
+        if self.n_nodes is not None and x.shape[1] != self.n_nodes:
+            raise Exception("expected " + str(self.n_nodes) + " node activations per datapoint, got " + str(x.shape[1]))
+        if not torch.all((x == 0) | (x == 1)):
+            raise Exception("node activations must be binary (0 or 1)")
+        future = concurrent.futures.Future()
+        self.requests.put((x, future))
+        return future
+
+    def evaluate(self, x) -> np.ndarray:
+        """blocking submit(); equals hnet.evaluate(model, x) for a calibrated model"""
+        return self.submit(x).result()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(n_requests=self.n_requests, n_datapoints=self.n_datapoints, n_batches=self.n_batches, n_errors=self.n_errors,
+                        mean_batch_size=self.n_datapoints / max(1, self.n_batches), max_batch_size_seen=self.max_batch_size_seen,
+                        model_seconds=self.model_seconds, queue_length=self.requests.qsize() + len(self.pending))
+
+    def close(self) -> None:
+        """finishes the requests already submitted, then stops the worker thread"""
+        self.requests.put(None)
+        self.thread.join()
+
+    def _next_request(self, timeout:float):
+        """returns the next (x, future), None to stop, or False if nothing arrived within timeout (None = wait forever)"""
+        if len(self.pending) > 0:
+            return self.pending.pop(0)
+        try:
+            return self.requests.get(timeout=timeout)
+        except queue.Empty:
+            return False
+
+    def _gather(self):
+        """blocks until a micro-batch is ready; returns a list of (x, future), or None to stop"""
+        request = self._next_request(None)
+        if request is None:
+            return None
+        batch = [request]
+        n_pts = request[0].shape[0]
+        deferred = []
+        deadline = time.monotonic() + self.max_wait
+        while n_pts < self.max_batch_size:
+            request = self._next_request(max(0.0, deadline - time.monotonic()))
+            if request is False:
+                break
+            if request is None:
+                self.requests.put(None) # stop after this micro-batch
+                break
+            if request[0].shape[1] != batch[0][0].shape[1]:
+                deferred.append(request) # can't be concatenated with this micro-batch
+            elif n_pts + request[0].shape[0] > self.max_batch_size:
+                deferred.append(request)
+                break
+            else:
+                batch.append(request)
+                n_pts += request[0].shape[0]
+        self.pending = deferred + self.pending
+        return batch
+
+    def _run(self) -> None:
+        torch.set_float32_matmul_precision("high")
+        while True:
+            batch = self._gather()
+            if batch is None:
+                return
+            batch = [(x, future) for x, future in batch if future.set_running_or_notify_cancel()]
+            if len(batch) == 0:
+                continue
+            n_pts = [x.shape[0] for x,_ in batch]
+            t = time.perf_counter()
+            output, error = self._evaluate(torch.cat([x for x,_ in batch], dim=0))
+            if error is None:
+                offsets = np.cumsum([0] + n_pts)
+                results = [(output[offsets[i]:offsets[i+1]], None) for i in range(len(batch))]
+            elif len(batch) > 1: # rerun each request alone, so only the ones that fail get the error (not every valid request that shared their micro-batch)
+                results = [self._evaluate(x) for x,_ in batch]
+            else:
+                results = [(None, error)]
+            t = time.perf_counter() - t
+            with self.lock:
+                self.n_requests += len(batch)
+                self.n_datapoints += sum(n_pts)
+                self.n_batches += 1
+                self.n_errors += sum(error is not None for _,error in results)
+                self.max_batch_size_seen = max(self.max_batch_size_seen, sum(n_pts))
+                self.model_seconds += t
+            for (_, future), (output, error) in zip(batch, results):
+                if error is None:
+                    future.set_result(output)
+                else:
+                    future.set_exception(error)
+
+    def _evaluate(self, x:torch.Tensor):
+        """returns (output, None), or (None, the exception) if the model raised one"""
+        try:
+            with torch.no_grad():
+                return self.model(x).cpu().numpy(), None
+        except Exception as e:
+            return None, e
+
+
+class HNetRequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP front end for an HNetMicroBatcher (set as the server's batcher attribute); each connection gets its own thread, which blocks on its request's future"""
+    protocol_version = "HTTP/1.1" # keep-alive, so clients don't pay a tcp handshake per request
+
+    def do_POST(self):
+        if self.path != "/evaluate":
+            return self._reply(404, {"error":"unknown path " + self.path})
+        is_npy = self.headers.get("Content-Type", "") == "application/x-npy"
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if is_npy:
+                x = np.load(io.BytesIO(body), allow_pickle=False)
+            else:
+                x = np.array(json.loads(body)["data"], dtype=np.single)
+            output = self.server.batcher.evaluate(x)
+        except Exception as e:
+            return self._reply(400, {"error":str(e)})
+        if is_npy:
+            buffer = io.BytesIO()
+            np.save(buffer, output, allow_pickle=False)
+            return self._reply(200, buffer.getvalue(), "application/x-npy")
+        return self._reply(200, {"output":output.tolist()})
+
+    def do_GET(self):
+        if self.path != "/stats":
+            return self._reply(404, {"error":"unknown path " + self.path})
+        return self._reply(200, self.server.batcher.stats())
+
+    def log_message(self, format, *args):
+        pass # one line per request would dominate the cost of small requests
+
+    def _reply(self, code:int, body, content_type:str="application/json") -> None:
+        if content_type == "application/json":
+            body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# === CALLABLE FUNCTIONS ===
+
+
+def load_model(filename:str, energy_mode:str, calibration_filename:str=None) -> hnet.HNetModel:
+    """
+    Inputs
+    ======
+    filename             - (str) ".hnetmodel.json" or ".hnetmodel.bin" file, or a ".hnetmodel.pt2" file from hnet.export_compiled_model (which fixes the energy mode and offsets)
+    energy_mode          - (str) "hamiltonian" | "edgematch" | "bitpacked" | "boolweights"
+    calibration_filename - OPTIONAL (str) ".dataset.json" or ".dataset.bin" file whose data sets the model's energy offsets (see hnet.calibrate_energy_offsets); typically the training set
+
+    Returns
+    =======
+    model - (HNetModel|HNetCompiledModel) calibrated if calibration_filename was given
+    """
+    if filename.endswith(".hnetmodel.pt2"):
+        if calibration_filename is not None:
+            raise Exception("a compiled model's energy offsets were fixed when it was exported")
+        return hnet.load_compiled_model(filename)
+    if filename.endswith(".hnetmodel.bin"):
+        model = hnet.construct_hnet_model_from_bin(filename, energy_mode)
+    else:
+        model = hnet.construct_hnet_model_from_json(filename, energy_mode)
+    if calibration_filename is not None:
+        data,_ = hnet._load_dataset(calibration_filename)
+        hnet.calibrate_energy_offsets(model, data)
+    return model
+
+
+def serve(model:hnet.HNetModel, host:str="127.0.0.1", port:int=8765, max_batch_size:int=256, max_wait_ms:float=2.0) -> None:
+    """
+    serves a calibrated model over HTTP until interrupted (see the HTTP API above)
+
+    Inputs
+    ======
+    model          - (HNetModel|HNetCompiledModel) calibrated (see hnet.calibrate_energy_offsets)
+    host           - OPTIONAL (str) interface to listen on (default = local only)
+    port           - OPTIONAL (int)
+    max_batch_size - OPTIONAL (int) max datapoints per micro-batch
+    max_wait_ms    - OPTIONAL (float) max time a request waits for others to join its micro-batch (bounds the added latency)
+    """
+    batcher = HNetMicroBatcher(model, max_batch_size, max_wait_ms)
+    server = http.server.ThreadingHTTPServer((host, port), HNetRequestHandler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    print("serving on http://{}:{} (max_batch_size={}, max_wait_ms={})".format(host, server.server_address[1], max_batch_size, max_wait_ms))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+def evaluate_remote(url:str, data) -> np.ndarray:
+    """
+    client for serve(): like hnet.evaluate(model, data), but run by the server at url (e.g. "http://127.0.0.1:8765")
+
+    Inputs
+    ======
+    url  - (str) server address
+    data - n x n_nodes (ndarray)
+
+    Returns
+    =======
+    output - n x n_out (ndarray)
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(data, dtype=np.single), allow_pickle=False)
+    request = urllib.request.Request(url.rstrip("/") + "/evaluate", data=buffer.getvalue(), headers={"Content-Type":"application/x-npy"})
+    with urllib.request.urlopen(request) as response:
+        return np.load(io.BytesIO(response.read()), allow_pickle=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serves a pytorch_hnet model over local HTTP, gathering concurrent requests into micro-batches")
+    parser.add_argument("--model", type=str, required=True, help=".hnetmodel.json, .hnetmodel.bin or (compiled) .hnetmodel.pt2 file")
+    parser.add_argument("--energy-mode", type=str, default="hamiltonian", choices=["hamiltonian", "edgematch", "bitpacked", "boolweights"])
+    parser.add_argument("--calibration-data", type=str, default=None, help=".dataset.json or .dataset.bin file that sets the energy offsets (typically the training set); required unless the model is compiled")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch-size", type=int, default=256, help="max datapoints per micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="max time a request waits for others to join its micro-batch")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default = torch's)")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    model = load_model(args.model, args.energy_mode, args.calibration_data)
+    serve(model, args.host, args.port, args.max_batch_size, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()